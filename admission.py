@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Admission Control for Plant Disease Detection System
+Bounds the work each web worker takes on per pipeline stage, so a traffic spike sheds
+load quickly instead of queueing every request behind slow LLM calls and rendering.
+
+Each stage has a limit on requests in flight and a bounded wait queue. Model inference
+is required: when its queue is full, or a request waits longer than ADMIT_INFERENCE_WAIT,
+the request is answered at once with 503 and a Retry-After estimate. The LLM explanation
+and the result image are optional: when their stage is full the response is degraded
+(classification only) rather than delayed. Limits apply per worker process.
+
+Settings are read from the environment:
+    ADMISSION                set to 0 to admit everything
+    ADMIT_INFERENCE          inference requests in flight (default 2)
+    ADMIT_INFERENCE_QUEUE    requests waiting for inference (default 8)
+    ADMIT_INFERENCE_WAIT     longest wait for inference in seconds (default 2)
+    ADMIT_LLM                LLM explanation calls in flight (default 4)
+    ADMIT_RENDER             result images rendered at once (default 2)
+"""
+
+import os
+import math
+import time
+import threading
+import contextlib
+import metrics
+
+ENABLED = os.getenv('ADMISSION', '1') != '0'
+# Smoothing for the service time estimate behind Retry-After
+SERVICE_TIME_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 30
+
+
+class StageLimiter:
+    """
+    Concurrency limit with a bounded wait queue for one pipeline stage
+    Requests that cannot be admitted are counted as shed with the stage's action
+    ('rejected' for required stages, 'degraded' for optional ones)
+    """
+
+    def __init__(self, stage, limit, queue_size=0, max_wait=0.0, action='rejected'):
+        self.stage = stage
+        self.limit = max(1, limit)
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.action = action
+        self.in_flight = 0
+        self.waiting = 0
+        self.service_time = None
+        self._condition = threading.Condition()
+
+    def has_capacity(self):
+        """Whether a request arriving now could be admitted or queued"""
+        return self.in_flight < self.limit or self.waiting < self.queue_size
+
+    def _acquire(self):
+        with self._condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.queue_size or self.max_wait <= 0:
+                return False
+            self.waiting += 1
+            start = time.perf_counter()
+            try:
+                deadline = time.monotonic() + self.max_wait
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage=f'{self.stage}_queue')
+
+    def release(self, elapsed=None):
+        """Give back a slot taken by acquire(); elapsed (seconds) updates the service time estimate"""
+        if not ENABLED:
+            return
+        with self._condition:
+            self.in_flight -= 1
+            if elapsed is not None:
+                self.service_time = elapsed if self.service_time is None else (
+                    SERVICE_TIME_SMOOTHING * elapsed + (1 - SERVICE_TIME_SMOOTHING) * self.service_time)
+            self._condition.notify()
+        metrics.STAGE_IN_FLIGHT.set(self.in_flight, stage=self.stage)
+
+    def acquire(self, action=None):
+        """
+        Take a slot, waiting in the queue if there is room; False when the request is shed
+        action overrides how a shed request is counted
+        """
+        if not ENABLED:
+            return True
+        admitted = self._acquire()
+        if admitted:
+            metrics.STAGE_IN_FLIGHT.set(self.in_flight, stage=self.stage)
+        else:
+            metrics.SHED.inc(stage=self.stage, action=action or self.action)
+        return admitted
+
+    @contextlib.contextmanager
+    def admit(self, action=None):
+        """Context manager yielding whether the block may run; the slot is released on exit"""
+        if not self.acquire(action):
+            yield False
+            return
+        start = time.perf_counter()
+        try:
+            yield True
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free, from the queue depth and recent service times"""
+        service_time = self.service_time or 1.0
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(service_time * (self.waiting + 1) / self.limit)))
+
+
+INFERENCE = StageLimiter(
+    'inference', int(os.getenv('ADMIT_INFERENCE', '2')),
+    queue_size=int(os.getenv('ADMIT_INFERENCE_QUEUE', '8')),
+    max_wait=float(os.getenv('ADMIT_INFERENCE_WAIT', '2')),
+)
+LLM = StageLimiter('llm', int(os.getenv('ADMIT_LLM', '4')), action='degraded')
+RENDER = StageLimiter('render', int(os.getenv('ADMIT_RENDER', '2')), action='degraded')
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Offline Advice Knowledge Base for Plant Disease Detection System
+Stores expert advice for every class in class_names.json in a local SQLite file,
+indexed by class name and by normalised plant/disease pair.
+
+Usage:
+    python advice_kb.py refresh [--force]      # Fill missing entries from the LLM
+    python advice_kb.py lookup Tomato___Early_blight
+    python advice_kb.py lookup --plant Tomato --disease "Early Blight"
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+import time
+import argparse
+
+DEFAULT_KB_PATH = os.getenv('ADVICE_KB_PATH', 'advice_kb.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS advice (
+    class_name  TEXT PRIMARY KEY,
+    plant       TEXT NOT NULL,
+    disease     TEXT NOT NULL,
+    plant_key   TEXT NOT NULL,
+    disease_key TEXT NOT NULL,
+    advice      TEXT NOT NULL,
+    source      TEXT,
+    updated_at  REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS advice_pair ON advice (plant_key, disease_key);
+"""
+
+
+def normalize_key(text):
+    """Lower-case and collapse everything but letters and digits to single spaces"""
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def split_class_name(class_name):
+    """
+    Split a PlantVillage class name into (plant, disease)
+    e.g. 'Pepper__bell___Bacterial_spot' -> ('Pepper bell', 'Bacterial spot'),
+         'Tomato__Tomato_mosaic_virus' -> ('Tomato', 'Tomato mosaic virus')
+    """
+    if '___' in class_name:
+        plant, disease = class_name.split('___', 1)
+    elif '_' in class_name:
+        plant, disease = class_name.split('_', 1)
+    else:
+        plant, disease = class_name, 'healthy'
+
+    plant = ' '.join(plant.replace('_', ' ').split())
+    disease = ' '.join(disease.replace('_', ' ').split())
+    return plant, disease
+
+
+def disease_key_for(plant, disease):
+    """Normalised disease key with a redundant leading plant name removed"""
+    plant_key = normalize_key(plant)
+    disease_key = normalize_key(disease)
+    first_plant_word = plant_key.split(' ')[0] if plant_key else ''
+    if first_plant_word and disease_key.startswith(first_plant_word + ' '):
+        disease_key = disease_key[len(first_plant_word) + 1:]
+    return disease_key
+
+
+class AdviceKnowledgeBase:
+    """Local, indexed store of expert advice keyed by class name"""
+
+    def __init__(self, db_path=DEFAULT_KB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connect(self, create=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        if not create and not os.path.exists(self.db_path):
+            return None
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        return conn
+
+    def lookup(self, class_name):
+        """Return stored advice for a model class name, or None"""
+        conn = self._connect()
+        if conn is None:
+            return None
+        row = conn.execute('SELECT advice FROM advice WHERE class_name = ?', (class_name,)).fetchone()
+        return row[0] if row else None
+
+    def lookup_pair(self, plant_type, disease):
+        """
+        Return stored advice for a plant/disease pair, e.g. from PlantDiseaseDemo.parse_analysis
+        Tries an exact normalised match first, then a containment match within the same plant,
+        used only when exactly one stored disease matches: for an ambiguous name such as
+        'Blight' (early or late?) None is returned, so the LLM answers instead of the wrong advice
+        """
+        conn = self._connect()
+        if conn is None:
+            return None
+
+        plant_key = normalize_key(plant_type)
+        disease_key = disease_key_for(plant_type, disease)
+        row = conn.execute(
+            'SELECT advice FROM advice WHERE plant_key = ? AND disease_key = ?',
+            (plant_key, disease_key)
+        ).fetchone()
+        if row:
+            return row[0]
+
+        # Plants such as 'Pepper bell' may be reported as just 'Pepper'
+        rows = conn.execute(
+            "SELECT disease_key, advice FROM advice WHERE plant_key = ? OR plant_key LIKE ? || ' %'",
+            (plant_key, plant_key)
+        ).fetchall()
+        if not disease_key:
+            return None
+        matches = [advice for candidate_key, advice in rows
+                   if disease_key in candidate_key or candidate_key in disease_key]
+        return matches[0] if len(matches) == 1 else None
+
+    def upsert(self, class_name, advice, source=None):
+        """Insert or replace the advice for a class"""
+        plant, disease = split_class_name(class_name)
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO advice VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (class_name, plant, disease, normalize_key(plant), disease_key_for(plant, disease),
+                 advice, source, time.time())
+            )
+
+    def class_names(self):
+        """Return the class names that have stored advice"""
+        conn = self._connect()
+        if conn is None:
+            return []
+        return [row[0] for row in conn.execute('SELECT class_name FROM advice ORDER BY class_name')]
+
+    def refresh(self, class_names, generate_advice, force=False):
+        """
+        Fill the knowledge base for every class name
+        generate_advice(class_name) must return advice text; existing entries are kept unless force
+        """
+        existing = set() if force else set(self.class_names())
+        updated = 0
+        for class_name in class_names:
+            if class_name in existing:
+                continue
+            print(f"Generating advice for {class_name}...")
+            try:
+                advice = generate_advice(class_name)
+            except Exception as e:
+                print(f"Error generating advice for {class_name}: {e}")
+                continue
+            self.upsert(class_name, advice, source='llm')
+            updated += 1
+        print(f"Knowledge base updated: {updated} entries written to {self.db_path}")
+        return updated
+
+
+_shared_kb = None
+_shared_kb_lock = threading.Lock()
+
+
+def get_advice_kb():
+    """Return the process-wide advice knowledge base"""
+    global _shared_kb
+    if _shared_kb is None:
+        with _shared_kb_lock:
+            if _shared_kb is None:
+                _shared_kb = AdviceKnowledgeBase()
+    return _shared_kb
+
+
+def main():
+    """Command line interface for refreshing and querying the knowledge base"""
+    parser = argparse.ArgumentParser(description='Offline advice knowledge base')
+    parser.add_argument('--db', default=DEFAULT_KB_PATH, help='Knowledge base SQLite file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    refresh_parser = subparsers.add_parser('refresh', help='Generate advice for every known class')
+    refresh_parser.add_argument('--class-names', default='class_names.json', help='Path to class_names.json')
+    refresh_parser.add_argument('--force', action='store_true', help='Regenerate existing entries')
+
+    lookup_parser = subparsers.add_parser('lookup', help='Print stored advice')
+    lookup_parser.add_argument('class_name', nargs='?', help='Model class name')
+    lookup_parser.add_argument('--plant', help='Plant type')
+    lookup_parser.add_argument('--disease', help='Disease name')
+
+    args = parser.parse_args()
+    kb = AdviceKnowledgeBase(args.db)
+
+    if args.command == 'refresh':
+        if not os.path.exists(args.class_names):
+            print(f"Error: '{args.class_names}' not found. Train or load a model first.")
+            return
+        with open(args.class_names, 'r') as f:
+            class_names = json.load(f)
+
+        from llm_client import get_llm_client
+        from plant_disease_detection import PlantDiseaseDetector
+        client = get_llm_client()
+        detector = PlantDiseaseDetector()
+
+        def generate_advice(class_name):
+            return client.chat(
+                model="gpt-4o",
+                messages=detector._explanation_messages(class_name),
+                max_tokens=1000,
+                temperature=0.7
+            )
+
+        kb.refresh(class_names, generate_advice, force=args.force)
+    else:
+        start = time.perf_counter()
+        if args.class_name:
+            advice = kb.lookup(args.class_name)
+        else:
+            advice = kb.lookup_pair(args.plant or '', args.disease or '')
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(advice if advice else "No advice stored for this query.")
+        print(f"\n(lookup took {elapsed_ms:.3f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Inference Benchmark Suite for Plant Disease Detection System
+Measures preprocess, inference, top-k and render latency (p50/p95/p99) at a range
+of batch sizes on a synthetic leaf corpus, the latency added by the leaf crop, and /upload throughput under concurrent
+load against the Flask app with a stubbed OpenAI server, optionally across gunicorn
+worker counts.
+Results are written as JSON so runs can be diffed between commits.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --batch-sizes 1 8 32 --skip-load
+    python benchmark.py --compare benchmark_results/<earlier run>.json
+    python benchmark.py --skip-load --workers 1 2 4 --concurrency 8 16
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from stub_openai_server import start_stub_server
+
+# Corpus image sizes: small web image, phone preview and 12 MP phone photo
+CORPUS_SIZES = [(400, 300), (1024, 768), (4000, 3000)]
+TOP_K = 5
+
+
+def summarize(samples_s):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    samples_ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    if samples_ms.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(samples_ms.size),
+        'mean_ms': float(samples_ms.mean()),
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'p99_ms': float(np.percentile(samples_ms, 99)),
+    }
+
+
+def build_corpus(corpus_dir, count, seed=0):
+    """Create count synthetic healthy/diseased leaves of mixed sizes"""
+    from create_test_image import create_diseased_leaf_image, create_healthy_leaf_image
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        size = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        quality = rng.randint(75, 95)
+        if i % 2:
+            path = os.path.join(corpus_dir, f"healthy_{i:04d}_{size[0]}x{size[1]}.jpg")
+            if not os.path.exists(path):
+                create_healthy_leaf_image(path, size=size, quality=quality)
+        else:
+            path = os.path.join(corpus_dir, f"diseased_{i:04d}_{size[0]}x{size[1]}.jpg")
+            if not os.path.exists(path):
+                create_diseased_leaf_image(path, size=size, quality=quality)
+        paths.append(path)
+    return paths
+
+
+def load_detector(model_path, class_names_path, num_classes):
+    """Load the trained model, or build a randomly initialised one of the same architecture"""
+    from plant_disease_detection import PlantDiseaseDetector
+
+    detector = PlantDiseaseDetector()
+    if detector.load_model(model_path, class_names_path):
+        return detector, 'trained'
+
+    print("No trained model found; benchmarking an untrained model of the same architecture.")
+    detector.class_names = [f"Synthetic_class_{i}" for i in range(num_classes)]
+    detector.model = detector.build_cnn_model(num_classes)
+    return detector, 'untrained'
+
+
+def top_k(detector, probabilities, k=TOP_K):
+    """Top-k (class, probability) pairs, computed the way the apps display them"""
+    indices = np.argsort(probabilities)[-k:][::-1]
+    return [(detector.class_names[i], float(probabilities[i])) for i in indices]
+
+
+def bench_stages(detector, corpus, batch_sizes, repeats):
+    """Time preprocess, inference and top-k for each batch size"""
+    from preprocessing import BatchPreprocessor
+
+    preprocessor = BatchPreprocessor(detector.img_size, batch_size=max(batch_sizes), crop=detector.leaf_crop)
+    results = {}
+    for batch_size in batch_sizes:
+        batches = [
+            [corpus[(start + j) % len(corpus)] for j in range(batch_size)]
+            for start in range(0, max(len(corpus), batch_size) * repeats, batch_size)
+        ]
+
+        # Warm up so graph tracing for this batch shape is not timed
+        detector.model.predict(preprocessor(batches[0]), verbose=0)
+
+        timings = {'preprocess': [], 'inference': [], 'top_k': [], 'end_to_end': []}
+        for paths in batches:
+            start = time.perf_counter()
+            batch = preprocessor(paths)
+            preprocessed = time.perf_counter()
+            predictions = detector.model.predict(batch, verbose=0)
+            inferred = time.perf_counter()
+            for probabilities in predictions:
+                top_k(detector, probabilities)
+            finished = time.perf_counter()
+
+            timings['preprocess'].append(preprocessed - start)
+            timings['inference'].append(inferred - preprocessed)
+            timings['top_k'].append(finished - inferred)
+            timings['end_to_end'].append(finished - start)
+
+        stage_results = {stage: summarize(samples) for stage, samples in timings.items()}
+        stage_results['images_per_second'] = batch_size * len(batches) / sum(timings['end_to_end'])
+        results[f"batch_{batch_size}"] = stage_results
+        print(f"batch {batch_size:>3}: end-to-end p50 {stage_results['end_to_end']['p50_ms']:.1f} ms, "
+              f"{stage_results['images_per_second']:.1f} images/s")
+    return results
+
+
+def bench_leaf_crop(detector, corpus, repeats):
+    """Time single-image decode + preprocess with and without the leaf crop"""
+    import preprocessing
+
+    results = {}
+    for crop in (False, True):
+        timings = []
+        for _ in range(repeats):
+            for image_path in corpus:
+                start = time.perf_counter()
+                preprocessing.preprocess_file(image_path, detector.img_size, crop=crop)
+                timings.append(time.perf_counter() - start)
+        results['crop' if crop else 'no_crop'] = summarize(timings)
+
+    # How often a crop applies, and how much of the frame it keeps
+    kept = []
+    for image_path in corpus:
+        img = preprocessing.decode_image(image_path, min_size=preprocessing.decode_size(detector.img_size, True))
+        box = preprocessing.leaf_bbox(img)
+        if box is not None:
+            kept.append((box[2] - box[0]) * (box[3] - box[1]) / (img.shape[0] * img.shape[1]))
+    results['cropped_fraction'] = len(kept) / len(corpus)
+    results['mean_area_kept'] = float(np.mean(kept)) if kept else 1.0
+    added = results['crop']['p50_ms'] - results['no_crop']['p50_ms']
+    print(f"leaf crop: +{added:.2f} ms p50, applied to {results['cropped_fraction']:.0%} of images, "
+          f"keeping {results['mean_area_kept']:.0%} of the frame")
+    return results
+
+
+def bench_render(detector, corpus, samples):
+    """Time result figure rendering as done by the Flask app"""
+    import web_app
+
+    web_app.detector = detector
+    explanation = "Remove infected leaves and apply copper-based sprays. " * 20
+    timings = []
+    for image_path in corpus[:samples]:
+        prediction = detector.predict_leaf_disease(image_path)
+        start = time.perf_counter()
+        web_app.generate_result_image(image_path, prediction, explanation)
+        timings.append(time.perf_counter() - start)
+    result = summarize(timings)
+    print(f"render: p50 {result['p50_ms']:.1f} ms")
+    return result
+
+
+def read_payloads(corpus):
+    payloads = []
+    for image_path in corpus:
+        with open(image_path, 'rb') as f:
+            payloads.append((os.path.basename(image_path), f.read()))
+    return payloads
+
+
+def run_load(url, payloads, concurrency_levels, requests_per_level):
+    """POST the corpus to url at each concurrency level and report throughput and latency"""
+    import httpx
+
+    results = {}
+    with httpx.Client(timeout=120, limits=httpx.Limits(max_connections=max(concurrency_levels))) as client:
+        def send(i):
+            name, data = payloads[i % len(payloads)]
+            start = time.perf_counter()
+            try:
+                response = client.post(url, files={'file': (name, data, 'image/jpeg')})
+                if response.status_code == 503:
+                    outcome = 'shed'
+                elif response.status_code == 200 and response.json().get('success', False):
+                    outcome = 'degraded' if response.json().get('degraded') else 'ok'
+                else:
+                    outcome = 'error'
+            except httpx.HTTPError:
+                outcome = 'error'
+            return time.perf_counter() - start, outcome
+
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(send, range(requests_per_level)))
+            elapsed = time.perf_counter() - start
+
+            counts = {name: sum(1 for _, outcome in outcomes if outcome == name)
+                      for name in ('ok', 'degraded', 'shed', 'error')}
+            served = [latency for latency, outcome in outcomes if outcome in ('ok', 'degraded')]
+            shed = [latency for latency, outcome in outcomes if outcome == 'shed']
+            results[f"concurrency_{concurrency}"] = {
+                'requests': requests_per_level,
+                'errors': counts['error'],
+                'degraded': counts['degraded'],
+                'shed': counts['shed'],
+                'throughput_rps': (counts['ok'] + counts['degraded']) / elapsed,
+                'latency': summarize(served),
+                'shed_latency': summarize(shed),
+            }
+            level = results[f"concurrency_{concurrency}"]
+            print(f"concurrency {concurrency:>3}: {level['throughput_rps']:.1f} req/s, "
+                  f"p95 {level['latency'].get('p95_ms', 0):.1f} ms, p99 {level['latency'].get('p99_ms', 0):.1f} ms, "
+                  f"{counts['degraded']} degraded, {counts['shed']} shed, {counts['error']} errors")
+    return results
+
+
+def bench_load(detector, corpus, concurrency_levels, requests_per_level):
+    """Measure /upload throughput and latency under concurrent load"""
+    from werkzeug.serving import make_server
+    import web_app
+
+    web_app.detector = detector
+    server = make_server('127.0.0.1', 0, web_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        return run_load(f"http://127.0.0.1:{server.server_port}/upload", read_payloads(corpus),
+                        concurrency_levels, requests_per_level)
+    finally:
+        server.shutdown()
+
+
+def wait_until_ready(base_url, workers, timeout=300):
+    """Poll /ready until every worker has reported a warmed-up model"""
+    import httpx
+
+    ready_pids = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # A fresh connection per poll, so the kernel can hand it to any worker
+            response = httpx.get(f"{base_url}/ready", headers={'Connection': 'close'}, timeout=5)
+            if response.status_code == 200:
+                ready_pids.add(response.json()['pid'])
+                if len(ready_pids) >= workers:
+                    return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def bench_workers(corpus, worker_counts, concurrency_levels, requests_per_level, model_path, class_names_path):
+    """Measure /upload throughput of the production server at each gunicorn worker count"""
+    import socket
+
+    payloads = read_payloads(corpus)
+    results = {}
+    for workers in worker_counts:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        # Workers load the model from the working directory, so run them next to it
+        model_dir = os.path.dirname(os.path.abspath(model_path))
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, WEB_CONCURRENCY=str(workers), PYTHONPATH=repo_dir)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(repo_dir, 'gunicorn.conf.py'),
+             '--bind', f"127.0.0.1:{port}", '--chdir', model_dir, '--access-logfile', '/dev/null'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            start = time.perf_counter()
+            if not wait_until_ready(base_url, workers):
+                print(f"workers {workers}: server did not become ready; skipping")
+                continue
+            print(f"workers {workers} (ready in {time.perf_counter() - start:.1f} s)")
+            results[f"workers_{workers}"] = run_load(f"{base_url}/upload", payloads,
+                                                     concurrency_levels, requests_per_level)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+    return results
+
+
+def git_revision():
+    """Short commit hash of the working tree, or 'unknown'"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return 'unknown'
+
+
+def flatten_metrics(results, prefix=''):
+    """Flatten nested results into {'dotted.key': value} for comparison"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(current, baseline_path):
+    """Print how latency and throughput changed against an earlier results file"""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    old = flatten_metrics({k: v for k, v in baseline.items() if k != 'meta'})
+    new = flatten_metrics({k: v for k, v in current.items() if k != 'meta'})
+    tracked = ('p50_ms', 'p95_ms', 'p99_ms', 'images_per_second', 'throughput_rps')
+
+    print("\n" + "=" * 80)
+    print(f"Comparison against {baseline_path} ({baseline['meta'].get('git_revision', 'unknown')})")
+    print("=" * 80)
+    for key in sorted(new):
+        if key in old and key.endswith(tracked) and old[key]:
+            change = (new[key] - old[key]) / old[key]
+            print(f"{key:<50} {old[key]:>10.2f} {new[key]:>10.2f} {change:>+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plant disease detection benchmark suite')
+    parser.add_argument('--images', type=int, default=24, help='Synthetic corpus size')
+    parser.add_argument('--corpus-dir', default=None, help='Where to write the corpus (default: temp dir)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--repeats', type=int, default=3, help='Passes over the corpus per batch size')
+    parser.add_argument('--render-samples', type=int, default=6, help='Images used for the render benchmark')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests', type=int, default=32, help='/upload requests per concurrency level')
+    parser.add_argument('--llm-delay', type=float, default=0.2, help='Stub OpenAI response delay in seconds')
+    parser.add_argument('--skip-load', action='store_true', help='Skip the Flask load test')
+    parser.add_argument('--workers', type=int, nargs='*', default=[],
+                        help='Also load test gunicorn with these worker counts (needs a trained model)')
+    parser.add_argument('--model', default='leafdoctor_model.h5')
+    parser.add_argument('--class-names', default='class_names.json')
+    parser.add_argument('--num-classes', type=int, default=15, help='Classes for the untrained fallback model')
+    parser.add_argument('--output-dir', default='benchmark_results')
+    parser.add_argument('--compare', default=None, help='Earlier results file to diff against')
+    args = parser.parse_args()
+
+    # Point every LLM call at a local stub before any module creates the shared client,
+    # and keep the offline advice knowledge base from answering instead of the stub
+    stub_server, stub_url = start_stub_server(delay=args.llm_delay)
+    os.environ['OPENAI_BASE_URL'] = stub_url
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='leaf_bench_')
+    os.environ['ADVICE_KB_PATH'] = os.path.join(corpus_dir, 'no_advice_kb.sqlite')
+
+    print(f"Building synthetic corpus of {args.images} images in {corpus_dir}...")
+    corpus = build_corpus(corpus_dir, args.images)
+    detector, model_kind = load_detector(args.model, args.class_names, args.num_classes)
+
+    results = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'model': model_kind,
+            'corpus_images': len(corpus),
+            'args': vars(args),
+        }
+    }
+
+    print("\nStage latency")
+    results['stages'] = bench_stages(detector, corpus, args.batch_sizes, args.repeats)
+    print("\nLeaf crop latency")
+    results['leaf_crop'] = bench_leaf_crop(detector, corpus, args.repeats)
+    print("\nRender latency")
+    results['render'] = bench_render(detector, corpus, args.render_samples)
+    if not args.skip_load:
+        print(f"\nLoad test (stub LLM delay {args.llm_delay * 1000:.0f} ms)")
+        results['load'] = bench_load(detector, corpus, args.concurrency, args.requests)
+    if args.workers:
+        if model_kind != 'trained':
+            print("\nSkipping worker scaling test: gunicorn workers need a trained model")
+        else:
+            print(f"\nWorker scaling (stub LLM delay {args.llm_delay * 1000:.0f} ms)")
+            results['workers'] = bench_workers(corpus, args.workers, args.concurrency, args.requests,
+                                               args.model, args.class_names)
+    stub_server.shutdown()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(
+        args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{results['meta']['git_revision']}.json"
+    )
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
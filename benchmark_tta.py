@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark test-time augmentation (TTA) for the Plant Disease Detection System
+Compares latency and top-1 accuracy of single-view prediction against batched TTA
+on a labelled image directory laid out like PlantVillage (one folder per class).
+Images go through the serving path: decode, admission gate, leaf crop and calibrated
+inference (including the early exit for single views). Images the gate rejects are
+counted and left out of accuracy and latency.
+
+Usage:
+    python benchmark_tta.py data/PlantVillage --views 1 4 8 10 --limit 50
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import image_gate
+import preprocessing
+from plant_disease_detection import PlantDiseaseDetector
+
+
+def collect_labelled_images(data_path, class_names, limit):
+    """Return (image_path, class_index) pairs for classes the model knows"""
+    samples = []
+    for class_idx, class_name in enumerate(class_names):
+        class_path = os.path.join(data_path, class_name)
+        if not os.path.isdir(class_path):
+            continue
+        image_files = sorted(f for f in os.listdir(class_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))
+        for img_file in image_files[:limit]:
+            samples.append((os.path.join(class_path, img_file), class_idx))
+    return samples
+
+
+def prepare(detector, image_path, n_views):
+    """Decode, gate and preprocess one image as the serving path does; None if the gate rejects it"""
+    if n_views > 1:
+        img = detector.read_image_rgb(image_path, detector.tta_decode_size())
+    else:
+        img = detector.read_image_rgb(image_path, preprocessing.decode_size(detector.img_size, detector.leaf_crop))
+    if image_gate.ENABLED and not image_gate.assess_image(img)['accepted']:
+        return None
+    if n_views > 1:
+        return detector.build_tta_views(img, n_views)
+    return preprocessing.preprocess_array(img, detector.img_size, crop=detector.leaf_crop)
+
+
+def run_benchmark(detector, samples, n_views):
+    """Classify every sample with n_views views and return accuracy and latency stats"""
+    # Warm up so graph tracing for this batch shape is not timed
+    detector.infer(np.zeros((n_views, *detector.img_size, 3), dtype=np.float32))
+
+    latencies = []
+    correct = rejected = 0
+    for image_path, class_idx in samples:
+        start = time.perf_counter()
+        try:
+            batch = prepare(detector, image_path, n_views)
+        except Exception as e:
+            print(f"Error preprocessing {image_path}: {e}")
+            continue
+        if batch is None:
+            rejected += 1
+            continue
+        probabilities, _ = detector.infer(batch)
+        latencies.append(time.perf_counter() - start)
+        correct += int(np.argmax(probabilities) == class_idx)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'views': n_views,
+        'images': len(latencies),
+        'rejected': rejected,
+        'accuracy': correct / max(len(latencies), 1),
+        'mean_ms': float(latencies_ms.mean()),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark test-time augmentation')
+    parser.add_argument('data_path', help='Directory with one sub-directory of images per class')
+    parser.add_argument('--views', type=int, nargs='+', default=[1, 4, 8, 10], help='View counts to compare')
+    parser.add_argument('--limit', type=int, default=50, help='Images per class')
+    parser.add_argument('--model', default='leafdoctor_model.h5', help='Model file')
+    parser.add_argument('--class-names', default='class_names.json', help='Class names file')
+    args = parser.parse_args()
+
+    detector = PlantDiseaseDetector()
+    if not detector.load_model(args.model, args.class_names):
+        print("Error: model or class names not found. Train a model first.")
+        return
+
+    samples = collect_labelled_images(args.data_path, detector.class_names, args.limit)
+    if not samples:
+        print(f"Error: no labelled images found in '{args.data_path}'")
+        return
+
+    print(f"Benchmarking {len(samples)} images...")
+    results = [run_benchmark(detector, samples, n_views) for n_views in args.views]
+    baseline = results[0]
+
+    print("\n" + "=" * 81)
+    print(f"{'Views':>5} {'Images':>7} {'Rejected':>8} {'Accuracy':>9} {'Gain':>7} {'Mean ms':>9} {'p95 ms':>9} {'Overhead':>9}")
+    print("=" * 81)
+    for result in results:
+        gain = result['accuracy'] - baseline['accuracy']
+        overhead = result['mean_ms'] / baseline['mean_ms']
+        print(f"{result['views']:>5} {result['images']:>7} {result['rejected']:>8} {result['accuracy']:>9.2%} {gain:>+7.2%} "
+              f"{result['mean_ms']:>9.1f} {result['p95_ms']:>9.1f} {overhead:>8.2f}x")
+    print("=" * 81)
+
+
+if __name__ == "__main__":
+    main()
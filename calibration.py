@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Confidence Calibration for Plant Disease Detection System
+Temperature scaling for the classifier's softmax output, expected calibration error,
+and selection of the early-exit confidence threshold. Fitting re-creates the validation
+split used by train_model and writes calibration.json (and the early-exit head) next
+to the model.
+
+Usage:
+    python calibration.py data/PlantVillage
+    python calibration.py data/PlantVillage --model models/v2/leafdoctor_model.h5 --no-early-exit
+"""
+
+import os
+import argparse
+import numpy as np
+
+# Search range for the temperature, in log space
+LOG_T_RANGE = (np.log(0.05), np.log(20.0))
+
+
+def apply_temperature(probabilities, temperature):
+    """
+    Rescale softmax outputs by a temperature. The model ends in a softmax, so log-probabilities
+    stand in for logits: softmax(log(p) / T) equals temperature scaling of the original logits
+    """
+    if temperature == 1.0:
+        return probabilities
+    log_p = np.log(np.clip(probabilities, 1e-12, 1.0)) / temperature
+    log_p -= log_p.max(axis=-1, keepdims=True)
+    scaled = np.exp(log_p)
+    return scaled / scaled.sum(axis=-1, keepdims=True)
+
+
+def negative_log_likelihood(probabilities, labels):
+    return float(-np.mean(np.log(np.clip(probabilities[np.arange(len(labels)), labels], 1e-12, 1.0))))
+
+
+def fit_temperature(probabilities, labels, iterations=60):
+    """Temperature minimising validation NLL, found by golden-section search on log T"""
+    ratio = (np.sqrt(5) - 1) / 2
+    low, high = LOG_T_RANGE
+
+    def loss(log_t):
+        return negative_log_likelihood(apply_temperature(probabilities, float(np.exp(log_t))), labels)
+
+    a, b = high - ratio * (high - low), low + ratio * (high - low)
+    loss_a, loss_b = loss(a), loss(b)
+    for _ in range(iterations):
+        if loss_a < loss_b:
+            high, b, loss_b = b, a, loss_a
+            a = high - ratio * (high - low)
+            loss_a = loss(a)
+        else:
+            low, a, loss_a = a, b, loss_b
+            b = low + ratio * (high - low)
+            loss_b = loss(b)
+    return float(np.exp((low + high) / 2))
+
+
+def expected_calibration_error(probabilities, labels, bins=15):
+    """Gap between confidence and accuracy, averaged over equal-width confidence bins"""
+    confidence = probabilities.max(axis=-1)
+    correct = probabilities.argmax(axis=-1) == labels
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    ece = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if in_bin.any():
+            ece += in_bin.mean() * abs(correct[in_bin].mean() - confidence[in_bin].mean())
+    return float(ece)
+
+
+def choose_exit_threshold(probabilities, labels, target_accuracy, min_exits=10):
+    """
+    Lowest calibrated confidence at which images that exit early are classified at least
+    as accurately as target_accuracy (normally the full model's). None if no threshold qualifies
+    """
+    confidence = probabilities.max(axis=-1)
+    correct = probabilities.argmax(axis=-1) == labels
+    for threshold in np.linspace(0.5, 0.99, 50):
+        exits = confidence >= threshold
+        if exits.sum() >= min_exits and correct[exits].mean() >= target_accuracy:
+            return float(threshold)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit confidence calibration for a trained model')
+    parser.add_argument('data_path', help='Training data directory (one sub-directory per class)')
+    parser.add_argument('--model', default='leafdoctor_model.h5', help='Model file')
+    parser.add_argument('--class-names', default=None, help='Class names file (default: next to the model)')
+    parser.add_argument('--no-early-exit', action='store_true', help='Only fit temperature scaling')
+    args = parser.parse_args()
+
+    from sklearn.model_selection import train_test_split
+    from plant_disease_detection import PlantDiseaseDetector
+
+    class_names_path = args.class_names or os.path.join(os.path.dirname(args.model), 'class_names.json')
+    detector = PlantDiseaseDetector()
+    if not detector.load_model(args.model, class_names_path):
+        print("Error: model or class names not found.")
+        return
+    trained_classes = list(detector.class_names)
+
+    X, y = detector.load_and_preprocess_data(args.data_path)
+    if detector.class_names != trained_classes:
+        print("Error: dataset classes do not match the model's classes.")
+        return
+    # Same split as train_model, so calibration never sees training images
+    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+    detector.fit_calibration(X_train, y_train, X_val, y_val,
+                             early_exit=not args.no_early_exit,
+                             output_dir=os.path.dirname(args.model) or '.')
+
+
+if __name__ == "__main__":
+    main()
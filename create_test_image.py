@@ -7,26 +7,28 @@ import numpy as np
 from PIL import Image, ImageDraw
 import matplotlib.pyplot as plt
 
-def create_diseased_leaf_image():
+def create_diseased_leaf_image(output_path='test_diseased_leaf.jpg', size=(400, 300), quality=95):
     """Create a synthetic diseased leaf image for testing"""
     
-    # Create a leaf-shaped image
-    width, height = 400, 300
+    # Create a leaf-shaped image; geometry is laid out on a 400x300 grid and scaled to size
+    width, height = size
+    sx, sy = width / 400, height / 300
+    s = min(sx, sy)
     img = Image.new('RGB', (width, height), color='white')
     draw = ImageDraw.Draw(img)
     
     # Draw leaf shape (oval with pointed ends)
     leaf_color = (34, 139, 34)  # Forest green
-    draw.ellipse([50, 50, 350, 250], fill=leaf_color)
+    draw.ellipse([50*sx, 50*sy, 350*sx, 250*sy], fill=leaf_color)
     
     # Add leaf texture with darker green veins
     vein_color = (0, 100, 0)
     # Central vein
-    draw.line([200, 60, 200, 240], fill=vein_color, width=4)
+    draw.line([200*sx, 60*sy, 200*sx, 240*sy], fill=vein_color, width=max(1, round(4*s)))
     # Side veins
     for i in range(70, 230, 20):
-        draw.line([200, i, 120, i+30], fill=vein_color, width=2)
-        draw.line([200, i, 280, i+30], fill=vein_color, width=2)
+        draw.line([200*sx, i*sy, 120*sx, (i+30)*sy], fill=vein_color, width=max(1, round(2*s)))
+        draw.line([200*sx, i*sy, 280*sx, (i+30)*sy], fill=vein_color, width=max(1, round(2*s)))
     
     # Add disease spots (brown spots for leaf spot disease)
     spot_color = (139, 69, 19)  # Saddle brown
@@ -34,50 +36,52 @@ def create_diseased_leaf_image():
     
     for x, y in spot_positions:
         # Create irregular spots
-        draw.ellipse([x-15, y-10, x+15, y+10], fill=spot_color)
-        draw.ellipse([x-10, y-8, x+12, y+8], fill=(160, 82, 45))  # Lighter brown center
+        draw.ellipse([(x-15)*sx, (y-10)*sy, (x+15)*sx, (y+10)*sy], fill=spot_color)
+        draw.ellipse([(x-10)*sx, (y-8)*sy, (x+12)*sx, (y+8)*sy], fill=(160, 82, 45))  # Lighter brown center
     
     # Add some yellowing around spots
     yellow_color = (255, 255, 0)
     for x, y in spot_positions:
-        draw.ellipse([x-20, y-15, x+20, y+15], fill=None, outline=yellow_color, width=2)
+        draw.ellipse([(x-20)*sx, (y-15)*sy, (x+20)*sx, (y+15)*sy], fill=None, outline=yellow_color, width=max(1, round(2*s)))
     
     # Save the image
-    img.save('test_diseased_leaf.jpg', 'JPEG', quality=95)
-    print("Test diseased leaf image created: test_diseased_leaf.jpg")
+    img.save(output_path, 'JPEG', quality=quality)
+    print(f"Test diseased leaf image created: {output_path}")
     
-    return 'test_diseased_leaf.jpg'
+    return output_path
 
-def create_healthy_leaf_image():
+def create_healthy_leaf_image(output_path='test_healthy_leaf.jpg', size=(400, 300), quality=95):
     """Create a healthy leaf image for testing"""
     
-    width, height = 400, 300
+    width, height = size
+    sx, sy = width / 400, height / 300
+    s = min(sx, sy)
     img = Image.new('RGB', (width, height), color='white')
     draw = ImageDraw.Draw(img)
     
     # Draw healthy leaf shape
     leaf_color = (50, 205, 50)  # Lime green
-    draw.ellipse([50, 50, 350, 250], fill=leaf_color)
+    draw.ellipse([50*sx, 50*sy, 350*sx, 250*sy], fill=leaf_color)
     
     # Add healthy leaf texture
     vein_color = (34, 139, 34)  # Forest green
     # Central vein
-    draw.line([200, 60, 200, 240], fill=vein_color, width=4)
+    draw.line([200*sx, 60*sy, 200*sx, 240*sy], fill=vein_color, width=max(1, round(4*s)))
     # Side veins
     for i in range(70, 230, 20):
-        draw.line([200, i, 120, i+30], fill=vein_color, width=2)
-        draw.line([200, i, 280, i+30], fill=vein_color, width=2)
+        draw.line([200*sx, i*sy, 120*sx, (i+30)*sy], fill=vein_color, width=max(1, round(2*s)))
+        draw.line([200*sx, i*sy, 280*sx, (i+30)*sy], fill=vein_color, width=max(1, round(2*s)))
     
     # Add subtle shading for depth
     for i in range(10):
         shade_color = (50 - i*2, 205 - i*5, 50 - i*2)
-        draw.ellipse([50+i*2, 50+i*2, 350-i*2, 250-i*2], outline=shade_color)
+        draw.ellipse([(50+i*2)*sx, (50+i*2)*sy, (350-i*2)*sx, (250-i*2)*sy], outline=shade_color)
     
     # Save the image
-    img.save('test_healthy_leaf.jpg', 'JPEG', quality=95)
-    print("Test healthy leaf image created: test_healthy_leaf.jpg")
+    img.save(output_path, 'JPEG', quality=quality)
+    print(f"Test healthy leaf image created: {output_path}")
     
-    return 'test_healthy_leaf.jpg'
+    return output_path
 
 if __name__ == "__main__":
     diseased_path = create_diseased_leaf_image()
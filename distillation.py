@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Knowledge Distillation for Plant Disease Detection System
+Trains a small student network against the soft outputs of the serving model (the
+teacher) and writes a serving-ready model directory plus a report comparing the two on
+CPU latency, size and top-1 accuracy.
+
+The student starts with a strided convolution and uses depthwise-separable convolutions
+with a quarter of the teacher's filters, about 20 times fewer multiply-adds. It is trained
+on a mix of the teacher's temperature-softened probabilities (knowledge distillation)
+and the true labels, on the same train/validation split as train_model. Optional
+magnitude pruning then zeroes the smallest weights in steps, fine-tuning in between.
+Zeroed weights shrink the compressed model but do not speed up dense CPU kernels; the
+speed-up comes from the student's architecture.
+
+The output directory holds leafdoctor_model.h5, class_names.json, calibration.json
+(temperature scaling fitted on the validation split) and distillation_report.json, so
+it can be served directly or published to the model registry.
+
+Usage:
+    python distillation.py data/PlantVillage
+    python distillation.py data/PlantVillage --prune 0.5 --output-dir student/
+    python distillation.py data/PlantVillage --teacher models/v2/leafdoctor_model.h5 --publish v2-student
+"""
+
+import os
+import json
+import time
+import zlib
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from tensorflow import keras
+from tensorflow.keras import layers
+import calibration
+
+# Softening of teacher and student outputs in the distillation loss
+DEFAULT_TEMPERATURE = 4.0
+# Weight of the distillation term; the rest goes to cross-entropy on the true labels
+DEFAULT_ALPHA = 0.7
+# Filters of the student's stem; each following block doubles them
+DEFAULT_WIDTH = 16
+PRUNE_STEPS = 3
+LATENCY_RUNS = 50
+
+
+def build_student_model(num_classes, img_size=(128, 128), width=DEFAULT_WIDTH):
+    """Compact CNN: strided stem, depthwise-separable blocks and global average pooling"""
+    img_width, img_height = img_size
+
+    def separable_block(filters, pool=True):
+        block = [
+            layers.SeparableConv2D(filters, (3, 3), padding='same', use_bias=False),
+            layers.BatchNormalization(),
+            layers.ReLU(),
+        ]
+        return block + [layers.MaxPooling2D((2, 2))] if pool else block
+
+    return keras.Sequential(
+        [
+            layers.Input(shape=(img_height, img_width, 3)),
+            # The stride halves the resolution before any wide layer runs
+            layers.Conv2D(width, (3, 3), strides=2, padding='same', use_bias=False),
+            layers.BatchNormalization(),
+            layers.ReLU(),
+        ]
+        + separable_block(width * 2)
+        + separable_block(width * 4)
+        + separable_block(width * 8)
+        + separable_block(width * 16, pool=False)
+        + [
+            layers.GlobalAveragePooling2D(),
+            layers.Dropout(0.2),
+            layers.Dense(num_classes, activation='softmax'),
+        ],
+        name='student'
+    )
+
+
+def distillation_loss(num_classes, temperature, alpha):
+    """
+    Loss on targets that concatenate one-hot labels and softened teacher probabilities.
+    The student ends in a softmax, so its log-probabilities stand in for logits
+    """
+    def loss(y_true, y_pred):
+        hard, soft = y_true[:, :num_classes], y_true[:, num_classes:]
+        student_soft = keras.ops.softmax(keras.ops.log(keras.ops.clip(y_pred, 1e-7, 1.0)) / temperature, axis=-1)
+        # Scaling by T^2 keeps the gradient size of the soft term independent of T
+        distill = keras.losses.KLD(soft, student_soft) * temperature ** 2
+        return alpha * distill + (1 - alpha) * keras.losses.categorical_crossentropy(hard, y_pred)
+
+    def accuracy(y_true, y_pred):
+        return keras.metrics.categorical_accuracy(y_true[:, :num_classes], y_pred)
+
+    return loss, accuracy
+
+
+def prunable_kernels(model):
+    """Convolution and dense kernels; depthwise kernels are too small to be worth pruning"""
+    return [variable for variable in model.trainable_weights
+            if variable.name.endswith('kernel') and 'depthwise' not in variable.name]
+
+
+def magnitude_prune(model, sparsity):
+    """Zero the smallest-magnitude fraction of each prunable kernel; returns (variable, mask) pairs"""
+    masks = []
+    for variable in prunable_kernels(model):
+        values = variable.numpy()
+        mask = (np.abs(values) > np.quantile(np.abs(values), sparsity)).astype(values.dtype)
+        variable.assign(values * mask)
+        masks.append((variable, mask))
+    return masks
+
+
+class KeepPruned(keras.callbacks.Callback):
+    """Re-apply pruning masks after every training step so pruned weights stay zero"""
+
+    def __init__(self, masks):
+        super().__init__()
+        self.masks = masks
+
+    def on_train_batch_end(self, batch, logs=None):
+        for variable, mask in self.masks:
+            variable.assign(variable * mask)
+
+
+def model_report(model, X_val, labels_val, teacher_predictions=None, batch_size=32):
+    """Size, sparsity, CPU latency and accuracy of a model on the validation split"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.h5')
+        model.save(path)
+        with open(path, 'rb') as f:
+            saved = f.read()
+
+    weights = [w.numpy() for w in prunable_kernels(model)]
+    single = X_val[:1]
+    batch = X_val[:batch_size]
+    # First calls trace the graph
+    model.predict_on_batch(single)
+    model.predict_on_batch(batch)
+    single_times = []
+    for _ in range(LATENCY_RUNS):
+        start = time.perf_counter()
+        model.predict_on_batch(single)
+        single_times.append(time.perf_counter() - start)
+    batch_times = []
+    for _ in range(max(3, LATENCY_RUNS // 10)):
+        start = time.perf_counter()
+        model.predict_on_batch(batch)
+        batch_times.append(time.perf_counter() - start)
+
+    predictions = model.predict(X_val, batch_size=64, verbose=0)
+    report = {
+        'parameters': int(model.count_params()),
+        'size_bytes': len(saved),
+        'compressed_bytes': len(zlib.compress(saved, 6)),
+        'kernel_sparsity': float(sum((w == 0).sum() for w in weights) / max(1, sum(w.size for w in weights))),
+        'latency_ms_p50': float(np.percentile(single_times, 50) * 1000),
+        'latency_ms_p95': float(np.percentile(single_times, 95) * 1000),
+        'images_per_second': float(len(batch) / np.median(batch_times)),
+        'top1_accuracy': float((predictions.argmax(axis=1) == labels_val).mean()),
+    }
+    if teacher_predictions is not None:
+        report['teacher_agreement'] = float((predictions.argmax(axis=1) == teacher_predictions.argmax(axis=1)).mean())
+    return report, predictions
+
+
+def distill(teacher, X_train, y_train, X_val, y_val, epochs=20, temperature=DEFAULT_TEMPERATURE,
+            alpha=DEFAULT_ALPHA, width=DEFAULT_WIDTH, prune=0.0, prune_epochs=2, img_size=(128, 128)):
+    """Train (and optionally prune) a student on the teacher's softened outputs; returns the student"""
+    num_classes = y_train.shape[1]
+    print("Computing teacher soft targets...")
+    soft_train = calibration.apply_temperature(teacher.predict(X_train, batch_size=64, verbose=0), temperature)
+    soft_val = calibration.apply_temperature(teacher.predict(X_val, batch_size=64, verbose=0), temperature)
+    targets_train = np.concatenate([y_train, soft_train], axis=1)
+    targets_val = np.concatenate([y_val, soft_val], axis=1)
+
+    student = build_student_model(num_classes, img_size, width)
+    loss, accuracy = distillation_loss(num_classes, temperature, alpha)
+    student.compile(optimizer='adam', loss=loss, metrics=[accuracy])
+    print(f"Training student ({student.count_params():,} parameters, teacher {teacher.count_params():,})...")
+    student.fit(
+        X_train, targets_train,
+        batch_size=32,
+        epochs=epochs,
+        validation_data=(X_val, targets_val),
+        callbacks=[
+            keras.callbacks.EarlyStopping(patience=3, restore_best_weights=True),
+            keras.callbacks.ReduceLROnPlateau(factor=0.2, patience=2)
+        ],
+        verbose=1
+    )
+
+    if prune > 0:
+        # Gradual pruning recovers more accuracy than removing everything at once
+        student.compile(optimizer=keras.optimizers.Adam(1e-4), loss=loss, metrics=[accuracy])
+        for step in range(1, PRUNE_STEPS + 1):
+            sparsity = prune * step / PRUNE_STEPS
+            print(f"Pruning to {sparsity:.0%} sparsity...")
+            masks = magnitude_prune(student, sparsity)
+            student.fit(X_train, targets_train, batch_size=32, epochs=prune_epochs,
+                        validation_data=(X_val, targets_val), callbacks=[KeepPruned(masks)], verbose=1)
+
+    # Plain compile settings, so the saved model loads without the custom loss
+    student.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return student
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distil the serving model into a smaller, faster student')
+    parser.add_argument('data_path', nargs='?', default='data/PlantVillage',
+                        help='Training data directory (one sub-directory per class)')
+    parser.add_argument('--teacher', default='leafdoctor_model.h5', help='Teacher model file')
+    parser.add_argument('--class-names', default=None, help='Class names file (default: next to the teacher)')
+    parser.add_argument('--output-dir', default='distilled', help='Where to write the student model and report')
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--temperature', type=float, default=DEFAULT_TEMPERATURE)
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA, help='Weight of the distillation loss')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH, help='Filters in the student stem')
+    parser.add_argument('--prune', type=float, default=0.0, help='Target kernel sparsity, e.g. 0.5 (default: no pruning)')
+    parser.add_argument('--publish', default=None, metavar='VERSION',
+                        help='Publish the student to the model registry under this version (not activated)')
+    args = parser.parse_args()
+
+    from sklearn.model_selection import train_test_split
+    from plant_disease_detection import PlantDiseaseDetector
+
+    keras.utils.set_random_seed(42)
+    class_names_path = args.class_names or os.path.join(os.path.dirname(args.teacher), 'class_names.json')
+    teacher = PlantDiseaseDetector()
+    if not teacher.load_model(args.teacher, class_names_path):
+        print("Error: teacher model or class names not found.")
+        return
+    trained_classes = list(teacher.class_names)
+
+    X, y = teacher.load_and_preprocess_data(args.data_path)
+    if teacher.class_names != trained_classes:
+        print("Error: dataset classes do not match the teacher's classes.")
+        return
+    # Same split as train_model, so the report is measured on images neither model trained on
+    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+    labels_val = y_val.argmax(axis=1)
+
+    student_model = distill(teacher.model, X_train, y_train, X_val, y_val, epochs=args.epochs,
+                            temperature=args.temperature, alpha=args.alpha, width=args.width,
+                            prune=args.prune, img_size=teacher.img_size)
+
+    print("Measuring teacher and student...")
+    teacher_report, teacher_predictions = model_report(teacher.model, X_val, labels_val)
+    student_report, _ = model_report(student_model, X_val, labels_val, teacher_predictions)
+    report = {
+        'teacher': dict(teacher_report, path=args.teacher),
+        'student': student_report,
+        'speedup': teacher_report['latency_ms_p50'] / student_report['latency_ms_p50'],
+        'throughput_ratio': student_report['images_per_second'] / teacher_report['images_per_second'],
+        'size_ratio': teacher_report['size_bytes'] / student_report['size_bytes'],
+        'accuracy_change': student_report['top1_accuracy'] - teacher_report['top1_accuracy'],
+        'validation_images': len(X_val),
+        'settings': {name: getattr(args, name) for name in ('epochs', 'temperature', 'alpha', 'width', 'prune')},
+    }
+
+    # A serving-ready model directory: model, class names and calibration
+    os.makedirs(args.output_dir, exist_ok=True)
+    model_path = os.path.join(args.output_dir, 'leafdoctor_model.h5')
+    student_model.save(model_path)
+    shutil.copy2(class_names_path, os.path.join(args.output_dir, 'class_names.json'))
+    student = PlantDiseaseDetector()
+    student.model, student.class_names, student.img_size = student_model, trained_classes, teacher.img_size
+    # Trained on the teacher's inputs, so the student is served with the teacher's crop setting
+    student.leaf_crop = teacher.leaf_crop
+    student.fit_calibration(X_train, y_train, X_val, y_val, early_exit=False, output_dir=args.output_dir)
+    with open(os.path.join(args.output_dir, 'distillation_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'':<22}{'teacher':>12}{'student':>12}")
+    rows = [
+        ('parameters', 'parameters', '{:,}'),
+        ('size (MB)', 'size_bytes', lambda v: f"{v / 1e6:.2f}"),
+        ('compressed (MB)', 'compressed_bytes', lambda v: f"{v / 1e6:.2f}"),
+        ('kernel sparsity', 'kernel_sparsity', '{:.0%}'),
+        ('latency p50 (ms)', 'latency_ms_p50', '{:.2f}'),
+        ('images/s (batch 32)', 'images_per_second', '{:.0f}'),
+        ('top-1 accuracy', 'top1_accuracy', '{:.2%}'),
+    ]
+    for label, key, fmt in rows:
+        render = fmt if callable(fmt) else fmt.format
+        print(f"{label:<22}{render(teacher_report[key]):>12}{render(student_report[key]):>12}")
+    print(f"Student is {report['speedup']:.1f}x faster at batch 1, {report['throughput_ratio']:.1f}x at batch 32, "
+          f"{report['size_ratio']:.0f}x smaller, agrees with the teacher on {student_report['teacher_agreement']:.1%} "
+          f"of validation images")
+    print(f"Student model and report written to {args.output_dir}/")
+
+    if args.publish:
+        from model_registry import ModelRegistry
+        version = ModelRegistry().publish(model_path, os.path.join(args.output_dir, 'class_names.json'),
+                                          version=args.publish, activate=False)
+        print(f"Published as version '{version}'; activate it with: python model_registry.py activate {version}")
+
+
+if __name__ == "__main__":
+    main()
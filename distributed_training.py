@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Distributed CPU Training for Plant Disease Detection System
+Data-parallel training of the build_cnn_model network across several worker processes,
+on one machine or many, with tf.distribute.MultiWorkerMirroredStrategy. Every worker
+holds a replica of the model, trains on its own shard of the training images, and
+gradients are averaged with a ring all-reduce after each step. Workers talk to each
+other directly over gRPC; no parameter server or other service is needed.
+
+Every worker lists the same sorted files and splits the paths 80/20 with train_model's
+seed before decoding, then decodes only its 1/N of the training and validation images,
+so loading scales with the worker count as well as the training steps. train_model
+splits after dropping images that fail to decode, so the two splits only match when
+every image is readable. Each worker trains on BATCH_SIZE images per
+step (a global batch of BATCH_SIZE x N). The chief (worker 0) writes leafdoctor_model.h5,
+class_names.json and calibration.json (temperature scaling) to the output directory.
+Fit the early-exit head afterwards with calibration.py if it is wanted.
+
+Usage:
+    # N workers on this machine, each limited to its share of the cores
+    python distributed_training.py data/PlantVillage --workers 4
+
+    # One worker per node: run on every node with the same --cluster and its own index
+    python distributed_training.py data/PlantVillage --cluster node1:23456,node2:23456 --worker-index 0
+
+    # Under a cluster manager that sets TF_CONFIG
+    python distributed_training.py data/PlantVillage
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
+from plant_disease_detection import PlantDiseaseDetector
+import preprocessing
+
+BATCH_SIZE = 32
+
+
+def free_ports(count):
+    """Ports the operating system reports free on localhost"""
+    sockets = [socket.socket() for _ in range(count)]
+    try:
+        for sock in sockets:
+            sock.bind(('127.0.0.1', 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def launch_local(args, passthrough):
+    """Start --workers worker processes on this machine and wait for them"""
+    cluster = ','.join(f"localhost:{port}" for port in free_ports(args.workers))
+    # Workers would otherwise each start a thread per core and fight over them
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Starting {args.workers} workers ({threads} threads each); worker logs in {args.output_dir}/")
+
+    workers = []
+    for index in range(args.workers):
+        command = [sys.executable, os.path.abspath(__file__), *passthrough,
+                   '--cluster', cluster, '--worker-index', str(index), '--threads', str(threads)]
+        # The chief reports to this terminal; the other workers log to files
+        log = None if index == 0 else open(os.path.join(args.output_dir, f"worker-{index}.log"), 'w')
+        workers.append((subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT if log else None), log))
+
+    start = time.perf_counter()
+    failed = False
+    try:
+        while any(process.poll() is None for process, _ in workers):
+            if any(process.poll() not in (None, 0) for process, _ in workers):
+                # One worker failing blocks the others in their next all-reduce
+                failed = True
+                break
+            time.sleep(0.5)
+    finally:
+        for process, log in workers:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+            if log:
+                log.close()
+    failed = failed or any(process.returncode != 0 for process, _ in workers)
+    print(f"{'Training failed' if failed else 'Training finished'} after {time.perf_counter() - start:.1f} s")
+    return 1 if failed else 0
+
+
+def distributed_steps(strategy, model, global_batch_size):
+    """
+    Compiled train and evaluation steps for the strategy; each returns the
+    all-reduced (loss sum, correct count) over every worker's batch
+    """
+    def train_replica(images, labels):
+        with tf.GradientTape() as tape:
+            probabilities = model(images, training=True)
+            losses = keras.losses.categorical_crossentropy(labels, probabilities)
+            # The optimizer sums gradients across workers, so scale by the global batch
+            loss = tf.reduce_sum(losses) / global_batch_size
+        gradients = tape.gradient(loss, model.trainable_variables)
+        model.optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return tf.reduce_sum(losses), correct_count(labels, probabilities)
+
+    def eval_replica(images, labels):
+        probabilities = model(images, training=False)
+        losses = keras.losses.categorical_crossentropy(labels, probabilities)
+        return tf.reduce_sum(losses), correct_count(labels, probabilities)
+
+    def correct_count(labels, probabilities):
+        return tf.reduce_sum(tf.cast(tf.equal(tf.argmax(labels, 1), tf.argmax(probabilities, 1)), tf.float32))
+
+    def step_fn(replica_fn):
+        @tf.function
+        def step(iterator):
+            loss, correct = strategy.run(replica_fn, args=next(iterator))
+            return (strategy.reduce(tf.distribute.ReduceOp.SUM, loss, axis=None),
+                    strategy.reduce(tf.distribute.ReduceOp.SUM, correct, axis=None))
+        return step
+
+    return step_fn(train_replica), step_fn(eval_replica)
+
+
+def run_worker(data_path, cluster, index, epochs, batch_size, output_dir, threads=None):
+    """Train as one worker of the cluster; worker 0 saves the model"""
+    if cluster:
+        os.environ['TF_CONFIG'] = json.dumps({
+            'cluster': {'worker': cluster},
+            'task': {'type': 'worker', 'index': index},
+        })
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING
+        )
+    )
+    task = json.loads(os.environ.get('TF_CONFIG', '{}')).get('task', {})
+    index = task.get('index', 0)
+    num_workers = strategy.num_replicas_in_sync
+    is_chief = index == 0
+
+    detector = PlantDiseaseDetector()
+    # The listing is sorted, so every worker sees the same files and the same split
+    image_paths, labels = detector.list_image_files(data_path)
+    image_paths = np.array(image_paths)
+    encoder = LabelEncoder().fit(detector.class_names)
+    y = keras.utils.to_categorical(encoder.transform(labels), num_classes=len(detector.class_names))
+    train_paths, val_paths, y_train, y_val = train_test_split(image_paths, y, test_size=0.2, random_state=42)
+
+    def load_shard(paths, targets):
+        images, kept = preprocessing.load_images(
+            list(paths[index::num_workers]), detector.img_size,
+            on_error=lambda img_path, e: print(f"Error loading {img_path}: {e}"),
+            crop=detector.leaf_crop
+        )
+        return images, targets[index::num_workers][kept]
+
+    start = time.perf_counter()
+    X_shard, y_shard = load_shard(train_paths, y_train)
+    Xv_shard, yv_shard = load_shard(val_paths, y_val)
+    print(f"Worker {index}/{num_workers}: {len(X_shard)} training and {len(Xv_shard)} validation images "
+          f"loaded in {time.perf_counter() - start:.1f} s", flush=True)
+
+    # Every worker must run the same number of steps, so count from the smallest shard
+    steps_per_epoch = max(1, len(train_paths) // num_workers // batch_size)
+    validation_steps = max(1, len(val_paths) // num_workers // batch_size)
+
+    def shard_dataset(images, targets, shuffle):
+        def dataset_fn(input_context):
+            dataset = tf.data.Dataset.from_tensor_slices((images, targets))
+            if shuffle:
+                dataset = dataset.shuffle(len(images), seed=42 + index)
+            # The shard was taken when loading, so tf.data must not shard again
+            options = tf.data.Options()
+            options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+            return dataset.repeat().batch(batch_size).with_options(options).prefetch(tf.data.AUTOTUNE)
+        return strategy.distribute_datasets_from_function(dataset_fn)
+
+    with strategy.scope():
+        model = detector.build_cnn_model(len(detector.class_names))
+    train_step, eval_step = distributed_steps(strategy, model, batch_size * num_workers)
+    train_iterator = iter(shard_dataset(X_shard, y_shard, shuffle=True))
+    val_iterator = iter(shard_dataset(Xv_shard, yv_shard, shuffle=False))
+
+    # Model.fit cannot drive a multi-worker strategy in Keras 3, so this loop applies
+    # train_model's EarlyStopping(patience=3) and ReduceLROnPlateau(factor=0.2, patience=2).
+    # Losses are all-reduced, so every worker takes the same decisions.
+    best_loss, best_weights, since_best = float('inf'), None, 0
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        loss = correct = 0.0
+        for _ in range(steps_per_epoch):
+            step_loss, step_correct = train_step(train_iterator)
+            loss += float(step_loss)
+            correct += float(step_correct)
+        elapsed = time.perf_counter() - start
+        seen = steps_per_epoch * batch_size * num_workers
+
+        val_loss = val_correct = 0.0
+        for _ in range(validation_steps):
+            step_loss, step_correct = eval_step(val_iterator)
+            val_loss += float(step_loss)
+            val_correct += float(step_correct)
+        val_seen = validation_steps * batch_size * num_workers
+        val_loss /= val_seen
+        if is_chief:
+            print(f"Epoch {epoch + 1}/{epochs}: {elapsed:.1f} s, {seen / elapsed:.1f} images/s - "
+                  f"loss {loss / seen:.4f} - accuracy {correct / seen:.4f} - "
+                  f"val_loss {val_loss:.4f} - val_accuracy {val_correct / val_seen:.4f}", flush=True)
+
+        if val_loss < best_loss:
+            best_loss, best_weights, since_best = val_loss, model.get_weights(), 0
+            continue
+        since_best += 1
+        if since_best >= 3:
+            if is_chief:
+                print(f"Early stopping; restoring weights from epoch {epoch + 1 - since_best}")
+            break
+        if since_best % 2 == 0:
+            model.optimizer.learning_rate.assign(model.optimizer.learning_rate * 0.2)
+    if best_weights is not None:
+        model.set_weights(best_weights)
+
+    # Every worker saves, since saving can read distributed variables; only the chief's copy is kept
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, 'leafdoctor_model.h5' if is_chief else f'.worker-{index}.h5')
+    model.save(model_path)
+    if not is_chief:
+        os.remove(model_path)
+        return
+
+    with open(os.path.join(output_dir, 'class_names.json'), 'w') as f:
+        json.dump(detector.class_names, f)
+    print(f"Model saved to {model_path}")
+
+    # Temperature scaling on the whole validation split, with a plain (undistributed) copy of the model
+    X_val, kept = preprocessing.load_images(list(val_paths), detector.img_size, crop=detector.leaf_crop)
+    calibrated = PlantDiseaseDetector()
+    calibrated.model = keras.models.load_model(model_path)
+    calibrated.class_names = detector.class_names
+    calibrated.leaf_crop = detector.leaf_crop
+    calibrated.fit_calibration(None, None, X_val, y_val[kept], early_exit=False, output_dir=output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data-parallel training across worker processes or nodes')
+    parser.add_argument('data_path', help='Training data directory (one sub-directory per class)')
+    parser.add_argument('--workers', type=int, default=None, help='Launch this many local worker processes')
+    parser.add_argument('--cluster', default=None, help='Comma-separated host:port of every worker')
+    parser.add_argument('--worker-index', type=int, default=0, help="This worker's position in --cluster")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Images per worker per step')
+    parser.add_argument('--output-dir', default='.', help='Where the chief writes the model')
+    parser.add_argument('--threads', type=int, default=None, help='TensorFlow threads per worker')
+    args = parser.parse_args()
+
+    if args.workers:
+        passthrough = [args.data_path, '--epochs', str(args.epochs), '--batch-size', str(args.batch_size),
+                       '--output-dir', args.output_dir]
+        sys.exit(launch_local(args, passthrough))
+    cluster = args.cluster.split(',') if args.cluster else None
+    if cluster is None and 'TF_CONFIG' not in os.environ:
+        print("Single worker: pass --workers N for local processes, or --cluster for several nodes.")
+    run_worker(args.data_path, cluster, args.worker_index, args.epochs, args.batch_size,
+               args.output_dir, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Synthetic Leaf Dataset Generator for Plant Disease Detection System
+Writes any number of randomised synthetic leaf images in a PlantVillage-style
+layout (one directory per class) for load testing and training smoke tests,
+without downloading the real dataset from Kaggle.
+
+Every class gets a fixed visual style (leaf shape, colour, lesion pattern) so a
+model can actually learn the classes; each image varies size, pose, texture,
+lighting, background and format. Drawing is vectorised with NumPy/OpenCV and
+images are generated across a process pool.
+
+Usage:
+    python generate_synthetic_dataset.py data/synthetic --images-per-class 500
+    python generate_synthetic_dataset.py data/synthetic --class-names class_names.json --formats jpg png webp
+"""
+
+import os
+import json
+import time
+import zlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+# Class layout of the PlantVillage dataset used by download_dataset()
+PLANTVILLAGE_CLASSES = [
+    'Pepper__bell___Bacterial_spot',
+    'Pepper__bell___healthy',
+    'Potato___Early_blight',
+    'Potato___Late_blight',
+    'Potato___healthy',
+    'Tomato_Bacterial_spot',
+    'Tomato_Early_blight',
+    'Tomato_Late_blight',
+    'Tomato_Leaf_Mold',
+    'Tomato_Septoria_leaf_spot',
+    'Tomato_Spider_mites_Two_spotted_spider_mite',
+    'Tomato__Target_Spot',
+    'Tomato__Tomato_YellowLeaf__Curl_Virus',
+    'Tomato__Tomato_mosaic_virus',
+    'Tomato_healthy',
+]
+
+LEAF_SHAPES = ('ellipse', 'lanceolate', 'ovate', 'lobed')
+LESION_PATTERNS = ('spots', 'rings', 'blotches', 'mottle', 'stipple', 'mold')
+
+
+def class_style(class_name):
+    """Deterministic visual style for a class, derived from its name"""
+    rng = np.random.default_rng(zlib.crc32(class_name.encode('utf-8')))
+    healthy = 'healthy' in class_name.lower()
+    lower_name = class_name.lower()
+
+    # Pick a lesion pattern that loosely matches the disease name
+    if healthy:
+        pattern = None
+    elif 'target' in lower_name or 'early' in lower_name:
+        pattern = 'rings'
+    elif 'late' in lower_name:
+        pattern = 'blotches'
+    elif 'mosaic' in lower_name or 'curl' in lower_name:
+        pattern = 'mottle'
+    elif 'mite' in lower_name:
+        pattern = 'stipple'
+    elif 'mold' in lower_name:
+        pattern = 'mold'
+    else:
+        pattern = 'spots'
+
+    return {
+        'shape': LEAF_SHAPES[int(rng.integers(len(LEAF_SHAPES)))],
+        'leaf_hsv': (int(rng.integers(38, 62)), int(rng.integers(140, 230)), int(rng.integers(110, 200))),
+        'pattern': pattern,
+        'lesion_bgr': tuple(int(c) for c in rng.integers(10, 90, size=3)) if pattern else None,
+        'lesion_density': float(rng.uniform(0.4, 1.0)),
+    }
+
+
+def smooth_noise(rng, height, width, cells, amplitude):
+    """Low-frequency noise field made by upscaling a small random grid"""
+    grid = rng.normal(0, amplitude, size=(cells, cells)).astype(np.float32)
+    return cv2.resize(grid, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def leaf_mask(shape, height, width, rng):
+    """Boolean leaf mask and leaf-aligned (u, v) coordinates for one random pose"""
+    cy = height * rng.uniform(0.42, 0.58)
+    cx = width * rng.uniform(0.42, 0.58)
+    length = min(height, width) * rng.uniform(0.38, 0.48)
+    angle = rng.uniform(0, np.pi)
+    cos_a, sin_a = np.float32(np.cos(angle)), np.float32(np.sin(angle))
+
+    # float32 coordinate grids; broadcasting keeps the row/column terms 1-D until combined
+    dy = ((np.arange(height, dtype=np.float32) - cy) / length)[:, None]
+    dx = ((np.arange(width, dtype=np.float32) - cx) / length)[None, :]
+    u = dx * cos_a + dy * sin_a       # along the midrib, -1..1
+    v = dy * cos_a - dx * sin_a       # across the blade
+
+    span = np.clip(1 - u ** 2, 0, None)
+    if shape == 'ellipse':
+        half_width = 0.55 * np.sqrt(span)
+    elif shape == 'lanceolate':
+        half_width = 0.35 * span ** 1.3
+    elif shape == 'ovate':
+        half_width = 0.6 * np.sqrt(span) * (1 - 0.35 * u)
+    else:
+        theta = np.arctan2(v, u)
+        half_width = 0.6 * np.sqrt(span) * (1 + 0.18 * np.cos(5 * theta))
+    return np.abs(v) < half_width, u, v, angle, (cx, cy), length
+
+
+def draw_lesions(rng, canvas, mask, style, length):
+    """Draw the class lesion pattern inside the leaf mask"""
+    height, width = mask.shape
+    pattern = style['pattern']
+    colour = np.array(style['lesion_bgr'], dtype=np.float32)
+    lesion = np.zeros((height, width), dtype=np.uint8)
+    scale = max(2, int(length * 0.06))
+
+    ys, xs = np.nonzero(mask)
+    if len(ys) == 0:
+        return canvas
+    count = int(style['lesion_density'] * {
+        'spots': 18, 'rings': 8, 'blotches': 4, 'mottle': 0, 'stipple': 400, 'mold': 10
+    }[pattern] * rng.uniform(0.6, 1.4))
+    picks = rng.integers(0, len(ys), size=max(count, 1))
+
+    if pattern == 'mottle':
+        # Patchy light/dark mosaic over the whole blade
+        field = smooth_noise(rng, height, width, 12, 1.0)
+        lesion[(field > 0.3) & mask] = 255
+        colour = np.array([60, 200, 190], dtype=np.float32)
+    else:
+        for y, x in zip(ys[picks], xs[picks]):
+            if pattern == 'spots':
+                radius = int(scale * rng.uniform(0.4, 1.0))
+                cv2.circle(lesion, (int(x), int(y)), radius, 255, -1)
+            elif pattern == 'rings':
+                radius = int(scale * rng.uniform(1.2, 2.2))
+                for r in range(radius, 0, -max(1, radius // 3)):
+                    cv2.circle(lesion, (int(x), int(y)), r, 255, max(1, radius // 6))
+            elif pattern == 'blotches':
+                axes = (int(scale * rng.uniform(2, 4)), int(scale * rng.uniform(1.5, 3)))
+                cv2.ellipse(lesion, (int(x), int(y)), axes, rng.uniform(0, 180), 0, 360, 255, -1)
+            elif pattern == 'stipple':
+                cv2.circle(lesion, (int(x), int(y)), max(1, scale // 5), 255, -1)
+            else:
+                axes = (int(scale * rng.uniform(1.5, 3)), int(scale * rng.uniform(1, 2)))
+                cv2.ellipse(lesion, (int(x), int(y)), axes, rng.uniform(0, 180), 0, 360, 160, -1)
+        lesion = cv2.GaussianBlur(lesion, (0, 0), max(0.8, scale * 0.15))
+
+    # Yellow halo around lesions, then the lesions themselves
+    alpha = lesion.astype(np.float32) * np.float32(1 / 255)
+    alpha[~mask] = 0
+    if pattern in ('spots', 'rings', 'blotches'):
+        halo = cv2.GaussianBlur(alpha, (0, 0), scale * 0.6)
+        halo[~mask] = 0
+        canvas += (halo[..., None] * np.float32(0.6)) * (np.array([40, 220, 230], dtype=np.float32) - canvas)
+    canvas += alpha[..., None] * (colour - canvas)
+    return canvas
+
+
+def render_leaf(rng, style, width, height):
+    """Render one synthetic leaf as a BGR uint8 image"""
+    mask, u, v, angle, centre, length = leaf_mask(style['shape'], height, width, rng)
+
+    # Background: soil, bench or paper tones with a lighting gradient
+    background = np.array(rng.choice([[60, 90, 120], [200, 210, 215], [40, 70, 50], [150, 170, 180]]), dtype=np.float32)
+    gradient = np.linspace(rng.uniform(0.7, 1.0), rng.uniform(1.0, 1.3), width, dtype=np.float32)[None, :, None]
+    canvas = np.broadcast_to(background, (height, width, 3)) * gradient
+    canvas += smooth_noise(rng, height, width, 8, 12)[..., None]
+
+    # Leaf colour from the class hue with per-image jitter, plus blade texture
+    h, s, val = style['leaf_hsv']
+    hsv = np.uint8([[[np.clip(h + rng.integers(-4, 5), 0, 179),
+                      np.clip(s + rng.integers(-20, 21), 0, 255),
+                      np.clip(val + rng.integers(-25, 26), 0, 255)]]])
+    leaf_bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0].astype(np.float32)
+    texture = smooth_noise(rng, height, width, 24, 10)[..., None]
+    leaf = leaf_bgr + texture
+
+    # Veins: darker midrib and lateral veins following the leaf pose
+    vein_width = np.float32(0.012 + 0.006 * rng.random())
+    abs_v = np.abs(v)
+    midrib = abs_v < vein_width
+    laterals = (np.abs(np.mod(u - 0.6 * abs_v, 0.22) - 0.11) < vein_width * 0.6) & ~midrib
+    leaf[midrib | laterals] *= 0.72
+
+    np.copyto(canvas, leaf, where=mask[..., None])
+    if style['pattern']:
+        canvas = draw_lesions(rng, canvas, mask, style, length)
+
+    # Sensor noise; OpenCV's generator is much faster than NumPy's for full frames
+    cv2.setRNGSeed(int(rng.integers(2 ** 31)))
+    noise = np.empty_like(canvas)
+    cv2.randn(noise, 0, 3)
+    canvas += noise
+    return np.clip(canvas, 0, 255, out=canvas).astype(np.uint8)
+
+
+def save_image(path, image, image_format, rng):
+    """Write an image in the requested format with randomised quality"""
+    if image_format == 'jpg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(rng.integers(70, 96))]
+    elif image_format == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(rng.integers(70, 96))]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    if not cv2.imwrite(path, image, params):
+        raise IOError(f"Could not write {path}")
+
+
+def generate_chunk(task):
+    """Worker: render and save a run of images for one class"""
+    output_dir, class_name, start, count, seed, min_size, max_size, formats = task
+    style = class_style(class_name)
+    class_dir = os.path.join(output_dir, class_name)
+    os.makedirs(class_dir, exist_ok=True)
+
+    written = 0
+    for index in range(start, start + count):
+        # Seed per image so results do not depend on chunking or worker count
+        rng = np.random.default_rng([seed, zlib.crc32(class_name.encode('utf-8')), index])
+        width = int(rng.integers(min_size, max_size + 1))
+        height = int(width * rng.uniform(0.75, 1.33))
+        image_format = formats[int(rng.integers(len(formats)))]
+        image = render_leaf(rng, style, width, height)
+        save_image(os.path.join(class_dir, f"synthetic_{index:06d}.{image_format}"), image, image_format, rng)
+        written += 1
+    return written
+
+
+def generate_dataset(output_dir, class_names, images_per_class, min_size=256, max_size=768,
+                     formats=('jpg', 'png'), workers=None, seed=0, chunk_size=25):
+    """Generate images_per_class images for every class across a process pool"""
+    tasks = []
+    for class_name in class_names:
+        for start in range(0, images_per_class, chunk_size):
+            count = min(chunk_size, images_per_class - start)
+            tasks.append((output_dir, class_name, start, count, seed, min_size, max_size, tuple(formats)))
+
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(generate_chunk, tasks))
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Generated {total} images in {len(class_names)} classes under {output_dir} "
+          f"in {elapsed:.1f}s ({total / elapsed:.1f} images/s)")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic PlantVillage-style leaf dataset')
+    parser.add_argument('output_dir', help='Dataset root; one sub-directory is created per class')
+    parser.add_argument('--images-per-class', type=int, default=100)
+    parser.add_argument('--class-names', default=None, help='class_names.json to take classes from')
+    parser.add_argument('--classes', type=int, default=None, help='Use only the first N classes')
+    parser.add_argument('--min-size', type=int, default=256, help='Minimum image width in pixels')
+    parser.add_argument('--max-size', type=int, default=768, help='Maximum image width in pixels')
+    parser.add_argument('--formats', nargs='+', default=['jpg', 'png'], choices=['jpg', 'png', 'webp'])
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.class_names:
+        with open(args.class_names, 'r') as f:
+            class_names = json.load(f)
+    else:
+        class_names = PLANTVILLAGE_CLASSES
+    if args.classes:
+        class_names = class_names[:args.classes]
+
+    generate_dataset(args.output_dir, class_names, args.images_per_class, args.min_size,
+                     args.max_size, args.formats, args.workers, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Gunicorn configuration for serving the Plant Disease Detection web app in production
+
+Each worker imports web_app, which loads the model and runs a warm-up forward pass
+before the worker starts accepting connections. The app is deliberately not preloaded
+in the master: TensorFlow's thread pools do not survive fork().
+
+Settings are read from the environment:
+    PORT               listen port (default 5001)
+    WEB_CONCURRENCY    worker processes (default 2); each holds its own copy of the model
+    WEB_THREADS        threads per worker (default 8); overlaps LLM and disk waits, and leaves
+                       threads free to shed load when admission-controlled stages are full
+    WEB_TIMEOUT        seconds before a silent worker is restarted (default 120)
+    WEB_MAX_REQUESTS   recycle a worker after this many requests, 0 disables (default 0)
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+    kill -HUP <master pid>    # graceful reload: new workers warm up, old ones finish in-flight requests
+"""
+
+import os
+
+wsgi_app = 'web_app:app'
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+preload_app = False
+
+timeout = int(os.getenv('WEB_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # Runs after web_app has been imported, i.e. after model load and warm-up
+    import web_app
+    state = 'ready' if web_app.model_warmed else 'serving without a model'
+    worker.log.info("Worker %s %s", worker.pid, state)
+
+
+def on_reload(arbiter):
+    arbiter.log.info("Reloading: starting new workers, old workers finish in-flight requests")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Image Admission Gate for Plant Disease Detection System
+Cheap OpenCV/NumPy checks run before the model or the vision API sees an image:
+sharpness (variance of the Laplacian), exposure, and the fraction of vegetation-
+coloured pixels (excess green or green/yellow hue). Rejections come with advice the
+user can act on, so model, GPT and render work is only spent on usable leaf photos.
+
+Checks run on a copy scaled down to GATE_SIZE pixels on the long side, so one check
+costs about a millisecond regardless of the upload's resolution.
+
+Settings are read from the environment:
+    IMAGE_GATE              set to 0 to accept every image
+    GATE_MIN_SHARPNESS      minimum Laplacian variance (default 25)
+    GATE_MIN_BRIGHTNESS     minimum mean luminance, 0-255 (default 40)
+    GATE_MAX_BRIGHTNESS     maximum mean luminance, 0-255 (default 225)
+    GATE_MIN_VEGETATION     minimum fraction of vegetation-coloured pixels (default 0.10)
+
+Usage:
+    python image_gate.py leaf1.jpg leaf2.jpg
+"""
+
+import os
+import sys
+import time
+import cv2
+import numpy as np
+import preprocessing
+import metrics
+
+ENABLED = os.getenv('IMAGE_GATE', '1') != '0'
+GATE_SIZE = 256
+MIN_SHARPNESS = float(os.getenv('GATE_MIN_SHARPNESS', '25'))
+MIN_BRIGHTNESS = float(os.getenv('GATE_MIN_BRIGHTNESS', '40'))
+MAX_BRIGHTNESS = float(os.getenv('GATE_MAX_BRIGHTNESS', '225'))
+MIN_VEGETATION = float(os.getenv('GATE_MIN_VEGETATION', '0.10'))
+
+ADVICE = {
+    'blurry': "The image is blurry. Hold the camera steady and tap the leaf to focus before taking the photo.",
+    'too_dark': "The image is too dark. Take the photo in daylight or turn on the flash.",
+    'overexposed': "The image is overexposed. Avoid direct sunlight or glare on the leaf.",
+    'no_leaf': "No leaf was found. Fill the frame with a single leaf against a plain background.",
+}
+
+
+def downscale(img, size=GATE_SIZE):
+    """Shrink so the longest side is at most size pixels"""
+    height, width = img.shape[:2]
+    scale = size / max(height, width)
+    if scale >= 1:
+        return img
+    return cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def vegetation_fraction(img):
+    """Fraction of pixels that look like plant tissue"""
+    mask = preprocessing.vegetation_mask(img)
+    return float(np.count_nonzero(mask) / mask.size)
+
+
+def assess_image(img):
+    """
+    Check an RGB uint8 image
+    Returns {'accepted', 'reasons' (codes), 'advice' (messages), 'scores'}
+    """
+    start = time.perf_counter()
+    small = downscale(img)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    scores = {
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+        'brightness': float(gray.mean()),
+        'vegetation': vegetation_fraction(small),
+    }
+
+    reasons = []
+    if scores['brightness'] < MIN_BRIGHTNESS:
+        reasons.append('too_dark')
+    elif scores['brightness'] > MAX_BRIGHTNESS:
+        reasons.append('overexposed')
+    # Exposure problems flatten the image, so only judge sharpness on a usable exposure
+    if not reasons and scores['sharpness'] < MIN_SHARPNESS:
+        reasons.append('blurry')
+    if scores['vegetation'] < MIN_VEGETATION:
+        reasons.append('no_leaf')
+
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage='gate')
+    for reason in reasons or ['accepted']:
+        metrics.GATE_DECISIONS.inc(result=reason)
+    return {
+        'accepted': not reasons,
+        'reasons': reasons,
+        'advice': [ADVICE[reason] for reason in reasons],
+        'scores': {name: round(value, 3) for name, value in scores.items()},
+    }
+
+
+def check_image_file(image_path):
+    """
+    Decode an image file at reduced scale and check it
+    Returns None when the gate is disabled; unreadable files are left to the caller's decoder
+    """
+    if not ENABLED:
+        return None
+    try:
+        img = preprocessing.decode_image(image_path, min_size=(GATE_SIZE, GATE_SIZE))
+    except Exception:
+        return None
+    return assess_image(img)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python image_gate.py <image> [<image> ...]")
+        return
+    for image_path in sys.argv[1:]:
+        result = assess_image(preprocessing.decode_image(image_path, min_size=(GATE_SIZE, GATE_SIZE)))
+        verdict = 'accepted' if result['accepted'] else 'rejected: ' + ', '.join(result['reasons'])
+        scores = ' '.join(f"{name}={value:g}" for name, value in result['scores'].items())
+        print(f"{image_path}: {verdict} ({scores})")
+
+
+if __name__ == "__main__":
+    main()
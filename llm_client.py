@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Shared LLM Client for Plant Disease Detection System
+One pooled OpenAI client with timeouts, jittered retries, a circuit breaker
+and a concurrency cap, used by every module that talks to the OpenAI API.
+
+Settings are read from the environment:
+    OPENAI_API_KEY, OPENAI_BASE_URL (point at a local stub server for testing)
+    LLM_TIMEOUT, LLM_CONNECT_TIMEOUT     request/connect timeouts in seconds
+    LLM_MAX_RETRIES, LLM_RETRY_BACKOFF   retry count and base backoff in seconds
+    LLM_MAX_CONNECTIONS                  keep-alive connection pool size
+    LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT  in-flight request cap and wait for a slot
+    LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET  failures before opening and cool-down seconds
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+import openai
+from openai import OpenAI
+from dotenv import load_dotenv
+load_dotenv()
+import metrics
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def is_outage(error):
+    """Whether an API error says the service is struggling (transport, 429 or 5xx) rather than the request is bad"""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return getattr(error, 'status_code', 0) >= 500
+
+
+class LLMUnavailableError(Exception):
+    """Raised when no completion and no cached answer can be returned"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling the API after repeated failures until a cool-down has passed, then lets
+    a single probe call through; its outcome closes or reopens the breaker
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # When the half-open probe was let through; a probe that never reports back expires
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """Return True if a call may be attempted; when half-open, only for the one probe"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+                return False
+            self.probe_started = now
+            return True
+
+    def cancel_probe(self):
+        """Give back the half-open probe when the call was never made"""
+        with self._lock:
+            self.probe_started = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.probe_started is not None:
+                # (Re)open; a failed half-open probe restarts the cool-down
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+
+class LLMClient:
+    """Pooled, rate-limited and fault-tolerant wrapper around the OpenAI chat API"""
+
+    def __init__(self, api_key=None, base_url=None, timeout=None, connect_timeout=None,
+                 max_retries=None, retry_backoff=None, max_connections=None,
+                 max_concurrency=None, queue_timeout=None, failure_threshold=None,
+                 reset_timeout=None, cache_size=256):
+        self.timeout = timeout if timeout is not None else float(os.getenv('LLM_TIMEOUT', '30'))
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('LLM_MAX_RETRIES', '2'))
+        self.retry_backoff = retry_backoff if retry_backoff is not None else float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv('LLM_QUEUE_TIMEOUT', '10'))
+        max_connections = max_connections or int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+        max_concurrency = max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+
+        self.breaker = CircuitBreaker(
+            failure_threshold=failure_threshold or int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+            reset_timeout=reset_timeout if reset_timeout is not None else float(os.getenv('LLM_BREAKER_RESET', '30')),
+        )
+
+        # One keep-alive pool shared by every thread; retries are handled here, not by the SDK
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+        )
+        self._client = OpenAI(
+            api_key=api_key or os.getenv('OPENAI_API_KEY'),
+            base_url=base_url or os.getenv('OPENAI_BASE_URL'),
+            http_client=self._http,
+            max_retries=0,
+        )
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        # Last good answer per cache key, served while the API is failing
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def chat(self, messages, model="gpt-4o", cache_key=None, **kwargs):
+        """
+        Run a chat completion and return the message text
+        Falls back to the last cached answer for cache_key when the API is unavailable
+        """
+        if not self.breaker.allow():
+            return self._fallback(cache_key, "circuit breaker is open")
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.breaker.cancel_probe()
+            return self._fallback(cache_key, "too many concurrent LLM requests")
+
+        try:
+            last_error = None
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self._client.chat.completions.create(
+                        model=model, messages=messages, **kwargs
+                    )
+                    content = response.choices[0].message.content
+                    metrics.LLM_CALLS.inc(outcome='success')
+                    self.breaker.record_success()
+                    self._remember(cache_key, content)
+                    return content
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    self.breaker.record_failure()
+                    if attempt < self.max_retries and self.breaker.allow():
+                        metrics.LLM_CALLS.inc(outcome='retry')
+                        self._sleep_before_retry(attempt)
+                        continue
+                    break
+                except openai.APIError as e:
+                    last_error = e
+                    self._record_error(e)
+                    break
+        finally:
+            self._slots.release()
+
+        return self._fallback(cache_key, last_error)
+
+    def stream_chat(self, messages, model="gpt-4o", cache_key=None, **kwargs):
+        """
+        Stream a chat completion, yielding text fragments
+        Retries only happen before the first fragment; a cached answer is yielded whole on failure
+        """
+        if not self.breaker.allow():
+            yield self._fallback(cache_key, "circuit breaker is open")
+            return
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.breaker.cancel_probe()
+            yield self._fallback(cache_key, "too many concurrent LLM requests")
+            return
+
+        try:
+            last_error = None
+            for attempt in range(self.max_retries + 1):
+                fragments = []
+                try:
+                    stream = self._client.chat.completions.create(
+                        model=model, messages=messages, stream=True, **kwargs
+                    )
+                    for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            fragments.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                    metrics.LLM_CALLS.inc(outcome='success')
+                    self.breaker.record_success()
+                    self._remember(cache_key, ''.join(fragments))
+                    return
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    self.breaker.record_failure()
+                    if fragments:
+                        # Text has already been delivered; restarting would duplicate it
+                        raise
+                    if attempt < self.max_retries and self.breaker.allow():
+                        metrics.LLM_CALLS.inc(outcome='retry')
+                        self._sleep_before_retry(attempt)
+                        continue
+                    break
+                except openai.APIError as e:
+                    last_error = e
+                    self._record_error(e)
+                    if fragments:
+                        raise
+                    break
+        finally:
+            self._slots.release()
+
+        yield self._fallback(cache_key, last_error)
+
+    def cached(self, cache_key):
+        """Last good answer remembered for cache_key, or None"""
+        if cache_key is None:
+            return None
+        with self._cache_lock:
+            return self._cache.get(cache_key)
+
+    def close(self):
+        """Close pooled connections"""
+        self._http.close()
+
+    def _record_error(self, error):
+        """Count outages against the breaker; a rejected request (400, 401, ...) still shows the API is up"""
+        if is_outage(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spread retries from concurrent workers across the backoff window
+        time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+
+    def _remember(self, cache_key, content):
+        if cache_key is None or not content:
+            return
+        with self._cache_lock:
+            self._cache[cache_key] = content
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _fallback(self, cache_key, reason):
+        if cache_key is not None:
+            with self._cache_lock:
+                cached = self._cache.get(cache_key)
+            if cached is not None:
+                metrics.LLM_CALLS.inc(outcome='cached_fallback')
+                print(f"LLM unavailable ({reason}); serving cached answer")
+                return cached
+        metrics.LLM_CALLS.inc(outcome='unavailable')
+        raise LLMUnavailableError(f"LLM unavailable: {reason}")
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the process-wide LLM client, creating it on first use"""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = LLMClient()
+    return _shared_client
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Lightweight Metrics for Plant Disease Detection System
+Counters, gauges and histograms rendered in the Prometheus text exposition format,
+with the pipeline's shared metrics defined at the bottom of this module.
+
+Set LEAF_METRICS=0 to disable recording; every call then returns immediately and
+timers are a shared no-op context manager.
+
+Metrics live in the memory of the process that records them. Under gunicorn each
+worker keeps its own values and /metrics is answered by whichever worker takes the
+request, so every sample carries a pid label: the series of one worker stay
+monotonic, and totals come from summing rates across pids rather than reading a
+single scrape.
+"""
+
+import os
+import time
+import bisect
+import threading
+
+ENABLED = os.getenv('LEAF_METRICS', '1') != '0'
+
+# Latency buckets in seconds, from sub-millisecond decode up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _NullTimer:
+    """Context manager used when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Context manager that observes its elapsed time into a histogram"""
+
+    __slots__ = ('histogram', 'key', 'start')
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram._observe(self.key, time.perf_counter() - self.start)
+        return False
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Base class for a named metric with optional labels"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self, const_labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key, const_labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in fixed buckets"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        self._observe(self._key(labels), value)
+
+    def time(self, **labels):
+        """Context manager that records the duration of its block"""
+        if not ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, self._key(labels))
+
+    def _observe(self, key, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self, const_labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        const_labels = list(const_labels)
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, const_labels + [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, const_labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, const_labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format, every sample labelled with this process's pid"""
+        with self._lock:
+            metrics = list(self._metrics)
+        # Read at render time: gunicorn workers are forked after this module is imported
+        const_labels = [('pid', os.getpid())]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(const_labels))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Shared pipeline metrics
+STAGE_SECONDS = histogram('leafdoctor_stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+REQUESTS = counter('leafdoctor_requests_total', 'HTTP requests handled', ['endpoint', 'status'])
+REQUEST_SECONDS = histogram('leafdoctor_request_seconds', 'HTTP request latency', ['endpoint'])
+FAILURES = counter('leafdoctor_failures_total', 'Failures by pipeline stage', ['stage'])
+CACHE_LOOKUPS = counter('leafdoctor_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+LLM_CALLS = counter('leafdoctor_llm_calls_total', 'LLM API calls by outcome', ['outcome'])
+MODEL_LOAD_SECONDS = gauge('leafdoctor_model_load_seconds', 'Time taken by the last model load')
+MODEL_LOADED = gauge('leafdoctor_model_loaded', 'Whether a model is loaded (1) or not (0)')
+MODEL_WARMUP_SECONDS = gauge('leafdoctor_model_warmup_seconds', 'Time taken by the last model warm-up')
+MODEL_VERSION = gauge('leafdoctor_model_version', 'Model version being served (1) or retired (0)', ['version'])
+MODEL_SWAPS = counter('leafdoctor_model_swaps_total', 'Model hot swaps by result', ['result'])
+INFERENCE_EXITS = counter('leafdoctor_inference_exits_total', 'Predictions by exit (early head or full model)', ['exit'])
+UPLOAD_STORE_BYTES = gauge('leafdoctor_upload_store_bytes', 'Bytes held by the upload store')
+UPLOADS_EVICTED = counter('leafdoctor_uploads_evicted_total', 'Files evicted from the upload store')
+TILES = counter('leafdoctor_tiles_total', 'Tiles seen by tiled field analysis (classified or background)', ['result'])
+SCOUT_FRAMES = counter('leafdoctor_scout_frames_total', 'Video scouting frames by outcome (selected, rejected or dropped)', ['result'])
+HISTORY_RECORDS = counter('leafdoctor_history_records_total', 'Prediction history records (written or dropped)', ['result'])
+GATE_DECISIONS = counter('leafdoctor_gate_decisions_total', 'Admission gate decisions (accepted or rejection reason)', ['result'])
+SIMILAR_INDEX_SIZE = gauge('leafdoctor_similar_index_size', 'Embeddings in the similar-case index of the serving model')
+SHED = counter('leafdoctor_shed_total', 'Requests shed by admission control, by stage and action (rejected or degraded)', ['stage', 'action'])
+STAGE_IN_FLIGHT = gauge('leafdoctor_stage_in_flight', 'Requests in flight per admission-controlled stage', ['stage'])
+SINGLE_FLIGHT = counter('leafdoctor_single_flight_total', 'Coalesced work by kind: computed, shared within or across processes, or computed after a wait timeout', ['kind', 'result'])
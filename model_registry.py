@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Model Registry for Plant Disease Detection System
+Versioned model artifacts with an active-version pointer, and a manager that loads a
+new version in the background, warms it up and swaps it in atomically so in-flight
+requests finish on the version they started with.
+
+Layout:
+    models/<version>/leafdoctor_model.h5
+    models/<version>/class_names.json
+    models/CURRENT                      name of the active version
+
+Without a registry the legacy leafdoctor_model.h5 and class_names.json in the working
+directory are served, versioned by a fingerprint of their size and modification time,
+so retraining in place is picked up as a new version too.
+
+Settings are read from the environment:
+    MODEL_REGISTRY_DIR     registry root (default 'models')
+    MODEL_WATCH_INTERVAL   seconds between checks for a new active version, 0 disables (default 10)
+
+Usage:
+    python model_registry.py publish leafdoctor_model.h5 class_names.json [--version v2] [--no-activate]
+    python model_registry.py activate v2
+    python model_registry.py list
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import metrics
+
+MODEL_FILENAME = 'leafdoctor_model.h5'
+CLASS_NAMES_FILENAME = 'class_names.json'
+CURRENT_FILENAME = 'CURRENT'
+# Optional artifacts stored next to the model
+CALIBRATION_FILENAME = 'calibration.json'
+EARLY_EXIT_FILENAME = 'leafdoctor_early_exit.h5'
+EXTRA_FILENAMES = (CALIBRATION_FILENAME, EARLY_EXIT_FILENAME)
+
+
+def fingerprint(*paths):
+    """Short version id for files that are not in the registry, from their size and mtime"""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()[:10]
+
+
+class ModelRegistry:
+    """Directory of versioned model artifacts with an atomically updated active pointer"""
+
+    def __init__(self, root=None, legacy_model_path=MODEL_FILENAME, legacy_class_names_path=CLASS_NAMES_FILENAME):
+        self.root = root or os.getenv('MODEL_REGISTRY_DIR', 'models')
+        self.legacy_model_path = legacy_model_path
+        self.legacy_class_names_path = legacy_class_names_path
+
+    def artifact_paths(self, version):
+        version_dir = os.path.join(self.root, version)
+        return os.path.join(version_dir, MODEL_FILENAME), os.path.join(version_dir, CLASS_NAMES_FILENAME)
+
+    def versions(self):
+        """Published versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        found = [v for v in os.listdir(self.root)
+                 if not v.startswith('.') and all(os.path.exists(p) for p in self.artifact_paths(v))]
+        return sorted(found, key=lambda v: os.path.getmtime(os.path.join(self.root, v)))
+
+    def active_version(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_FILENAME), 'r') as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version if version in self.versions() else None
+
+    def resolve(self, version=None):
+        """
+        Return (version, model_path, class_names_path) for the requested or active version,
+        falling back to the legacy files; None if there is nothing to load
+        """
+        version = version or self.active_version()
+        if version:
+            model_path, class_names_path = self.artifact_paths(version)
+            if os.path.exists(model_path) and os.path.exists(class_names_path):
+                return version, model_path, class_names_path
+            return None
+        if os.path.exists(self.legacy_model_path) and os.path.exists(self.legacy_class_names_path):
+            extras = [os.path.join(os.path.dirname(self.legacy_model_path), name) for name in EXTRA_FILENAMES]
+            version = f"legacy-{fingerprint(self.legacy_model_path, self.legacy_class_names_path, *filter(os.path.exists, extras))}"
+            return version, self.legacy_model_path, self.legacy_class_names_path
+        return None
+
+    def publish(self, model_path, class_names_path, version=None, activate=True):
+        """Copy artifacts into a new version directory and optionally make it active"""
+        version = version or time.strftime('%Y%m%d-%H%M%S')
+        final_dir = os.path.join(self.root, version)
+        if os.path.exists(final_dir):
+            raise ValueError(f"Version '{version}' already exists")
+
+        # Copy into a hidden directory first so watchers never see a half-written version
+        staging_dir = os.path.join(self.root, f".{version}.staging")
+        os.makedirs(staging_dir)
+        shutil.copy2(model_path, os.path.join(staging_dir, MODEL_FILENAME))
+        shutil.copy2(class_names_path, os.path.join(staging_dir, CLASS_NAMES_FILENAME))
+        for name in EXTRA_FILENAMES:
+            extra_path = os.path.join(os.path.dirname(model_path), name)
+            if os.path.exists(extra_path):
+                shutil.copy2(extra_path, os.path.join(staging_dir, name))
+        os.rename(staging_dir, final_dir)
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        """Point CURRENT at a published version"""
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version '{version}'")
+        pointer = os.path.join(self.root, CURRENT_FILENAME)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(version + '\n')
+        os.replace(pointer + '.tmp', pointer)
+
+
+class ModelManager:
+    """
+    Keeps the serving model current: loads new versions off the request path and
+    swaps them in with a single reference assignment
+
+    loader(version, model_path, class_names_path) must return a ready-to-serve object
+    (loaded and warmed up) or None; on_swap(obj) is called after each swap.
+    """
+
+    def __init__(self, registry, loader, on_swap=None, watch_interval=None):
+        self.registry = registry
+        self.loader = loader
+        self.on_swap = on_swap
+        self.watch_interval = watch_interval if watch_interval is not None else float(os.getenv('MODEL_WATCH_INTERVAL', '10'))
+        self.current = None
+        self.version = None
+        self._failed_version = None
+        self._reloading = threading.Lock()
+        self._watcher = None
+
+    def load_initial(self):
+        """Load the active version synchronously; returns True if a model was loaded"""
+        return self._load_and_swap()
+
+    def reload(self, version=None, wait=False):
+        """
+        Load a version (default: the active one) in the background and swap it in
+        Returns False if a reload is already running
+        """
+        if self._reloading.locked():
+            return False
+        thread = threading.Thread(target=self._load_and_swap, args=(version,), daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return True
+
+    def _load_and_swap(self, version=None):
+        if not self._reloading.acquire(blocking=False):
+            return False
+        try:
+            resolved = self.registry.resolve(version)
+            if resolved is None:
+                return False
+            new_version, model_path, class_names_path = resolved
+            if new_version == self.version:
+                return True
+            if new_version == self._failed_version and version is None:
+                return False  # Do not retry a broken version on every watch tick
+
+            print(f"Loading model version {new_version}...")
+            start = time.perf_counter()
+            try:
+                loaded = self.loader(new_version, model_path, class_names_path)
+            except Exception as e:
+                print(f"Error loading model version {new_version}: {e}")
+                loaded = None
+            if loaded is None:
+                self._failed_version = new_version
+                metrics.MODEL_SWAPS.inc(result='failed')
+                return False
+
+            old_version = self.version
+            self.current, self.version = loaded, new_version
+            if self.on_swap:
+                self.on_swap(loaded)
+            if old_version:
+                metrics.MODEL_VERSION.set(0, version=old_version)
+            metrics.MODEL_VERSION.set(1, version=new_version)
+            metrics.MODEL_SWAPS.inc(result='success')
+            print(f"Serving model version {new_version} (ready in {time.perf_counter() - start:.1f} s)")
+            return True
+        finally:
+            self._reloading.release()
+
+    def start_watching(self):
+        """Poll the registry and swap in a new active version when it changes"""
+        if self.watch_interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                resolved = self.registry.resolve()
+                if resolved and resolved[0] != self.version:
+                    self._load_and_swap()
+            except Exception as e:
+                print(f"Warning: model watch failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage versioned model artifacts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    publish_parser = subparsers.add_parser('publish', help='Add a model version')
+    publish_parser.add_argument('model_path')
+    publish_parser.add_argument('class_names_path')
+    publish_parser.add_argument('--version', default=None, help='Version name (default: timestamp)')
+    publish_parser.add_argument('--no-activate', action='store_true', help='Publish without making it active')
+    activate_parser = subparsers.add_parser('activate', help='Make a version active')
+    activate_parser.add_argument('version')
+    subparsers.add_parser('list', help='List versions')
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == 'publish':
+        version = registry.publish(args.model_path, args.class_names_path, args.version, activate=not args.no_activate)
+        print(f"Published model version {version}{' (active)' if not args.no_activate else ''}")
+    elif args.command == 'activate':
+        registry.activate(args.version)
+        print(f"Active model version: {args.version}")
+    else:
+        active = registry.active_version()
+        for version in registry.versions():
+            print(f"{'*' if version == active else ' '} {version}")
+        if active is None:
+            resolved = registry.resolve()
+            print(f"No active registry version; serving {resolved[0] if resolved else 'nothing'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,22 @@ This demo works without requiring dataset download or model training
 
 import os
 import base64
+import hashlib
 import cv2
 import numpy as np
 from PIL import Image
 import matplotlib.pyplot as plt
-import openai
 from pathlib import Path
 import argparse
 from dotenv import load_dotenv
 load_dotenv()
+from llm_client import get_llm_client
+from advice_kb import get_advice_kb
+import image_gate
+from prediction_history import get_prediction_history
 
-# Set up OpenAI client
-client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Shared, pooled OpenAI client
+client = get_llm_client()
 
 class PlantDiseaseDemo:
     def __init__(self):
@@ -40,6 +44,14 @@ class PlantDiseaseDemo:
         """
         print("Analyzing plant image with AI...")
         
+        # Skip the API call for blurry, badly exposed or non-leaf photos
+        admission = image_gate.check_image_file(image_path)
+        if admission and not admission['accepted']:
+            print("Image rejected:")
+            for advice in admission['advice']:
+                print(f"- {advice}")
+            return None
+        
         # Encode image
         base64_image = self.encode_image_to_base64(image_path)
         if not base64_image:
@@ -47,7 +59,7 @@ class PlantDiseaseDemo:
         
         try:
             # First, detect if image contains a plant and identify the disease
-            response = client.chat.completions.create(
+            analysis = client.chat(
                 model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
                 messages=[
                     {
@@ -84,7 +96,6 @@ Symptoms: [description of visual symptoms]"""
                 temperature=0.3
             )
             
-            analysis = response.choices[0].message.content
             print("AI Analysis Complete!")
             return self.parse_analysis(analysis)
             
@@ -125,13 +136,8 @@ Symptoms: [description of visual symptoms]"""
                 'symptoms': 'Unable to analyze'
             }
     
-    def get_treatment_advice(self, plant_type, disease):
-        """
-        Part 3: GPT Integration
-        Get comprehensive treatment advice from agricultural expert
-        """
-        print("Getting expert treatment advice...")
-        
+    def _treatment_messages(self, plant_type, disease):
+        """Build the chat messages used to request treatment advice"""
         if disease.lower() == 'healthy':
             prompt = f"""The {plant_type} plant appears healthy. Provide preventive care advice including:
 1. Optimal growing conditions
@@ -150,29 +156,65 @@ Symptoms: [description of visual symptoms]"""
 
 Provide step-by-step, practical advice suitable for smallholder farmers."""
         
+        return [
+            {
+                "role": "system",
+                "content": "You are an expert agricultural extension officer with 20+ years of experience helping smallholder farmers. Provide practical, actionable advice."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    def get_treatment_advice(self, plant_type, disease):
+        """
+        Part 3: GPT Integration
+        Get comprehensive treatment advice from agricultural expert
+        Served from the offline advice knowledge base when it covers the plant/disease pair
+        """
+        print("Getting expert treatment advice...")
+        
+        stored_advice = get_advice_kb().lookup_pair(plant_type, disease)
+        if stored_advice:
+            return stored_advice
+        
         try:
-            response = client.chat.completions.create(
+            return client.chat(
                 model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert agricultural extension officer with 20+ years of experience helping smallholder farmers. Provide practical, actionable advice."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                messages=self._treatment_messages(plant_type, disease),
+                cache_key=('treatment', plant_type, disease),
                 max_tokens=1200,
                 temperature=0.7
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             print(f"Error getting treatment advice: {e}")
             return f"Unable to get detailed treatment advice. Please consult with a local agricultural extension officer for {disease} treatment."
     
+    def stream_treatment_advice(self, plant_type, disease):
+        """
+        Stream treatment advice as it is generated
+        Yields text fragments so the advice can be shown before the full completion arrives
+        """
+        stored_advice = get_advice_kb().lookup_pair(plant_type, disease)
+        if stored_advice:
+            yield stored_advice
+            return
+        
+        try:
+            yield from client.stream_chat(
+                model="gpt-4o",
+                messages=self._treatment_messages(plant_type, disease),
+                cache_key=('treatment', plant_type, disease),
+                max_tokens=1200,
+                temperature=0.7
+            )
+                    
+        except Exception as e:
+            print(f"Error streaming treatment advice: {e}")
+            yield f"Unable to get detailed treatment advice. Please consult with a local agricultural extension officer for {disease} treatment."
+    
     def create_visualization(self, image_path, analysis_result, treatment_advice):
         """
         Part 4: Output Display
@@ -260,6 +302,20 @@ Provide step-by-step, practical advice suitable for smallholder farmers."""
         
         return lines
     
+    def record_prediction(self, image_path, analysis_result):
+        """Add the Vision API diagnosis to the prediction history"""
+        history = get_prediction_history()
+        if history is None:
+            return
+        with open(image_path, 'rb') as f:
+            image_sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+        # Confidence is free text from the model, so it is kept with the details
+        history.record(
+            'demo', f"{analysis_result['plant_type']}___{analysis_result['disease']}",
+            image_sha256=image_sha256, model_version='gpt-4o',
+            details={key: analysis_result[key] for key in ('plant_type', 'disease', 'confidence')},
+        )
+    
     def save_report(self, image_path, analysis_result, treatment_advice):
         """Save complete analysis report"""
         report_path = self.results_dir / f"report_{Path(image_path).stem}.txt"
@@ -313,12 +369,16 @@ Using OpenAI Vision API for analysis
         
         print(f"\nDiagnosis: {analysis_result['disease']} on {analysis_result['plant_type']}")
         print(f"Confidence: {analysis_result['confidence']}")
+        self.record_prediction(image_path, analysis_result)
         
-        # Part 3: Get treatment advice
-        treatment_advice = self.get_treatment_advice(
-            analysis_result['plant_type'], 
-            analysis_result['disease']
-        )
+        # Part 3: Get treatment advice, printing it as it streams in
+        print("Getting expert treatment advice...\n")
+        fragments = []
+        for fragment in self.stream_treatment_advice(analysis_result['plant_type'], analysis_result['disease']):
+            print(fragment, end='', flush=True)
+            fragments.append(fragment)
+        print()
+        treatment_advice = ''.join(fragments)
         
         # Part 4: Create visualization and save results
         visualization_path = self.create_visualization(image_path, analysis_result, treatment_advice)
@@ -8,6 +8,7 @@ Part 4: Output Display
 """
 
 import os
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 import cv2
@@ -18,17 +19,40 @@ from tensorflow.keras import layers
 import keras as standalone_keras
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
-from openai import OpenAI
 import kaggle
 import zipfile
 import shutil
 from pathlib import Path
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 load_dotenv()
 
-# Set up OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+from llm_client import get_llm_client
+from advice_kb import get_advice_kb
+from single_flight import get_single_flight
+import preprocessing
+import metrics
+import calibration
+import image_gate
+from model_registry import fingerprint, CALIBRATION_FILENAME, EARLY_EXIT_FILENAME
+
+# Shared, pooled OpenAI client
+client = get_llm_client()
+
+# Maximum number of test-time augmentation views per image
+TTA_MAX_VIEWS = 10
+
+# Predictions kept per loaded model, keyed by image content
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '256'))
+
+# The early-exit head reads the output of the second conv block: the model is split
+# where its third convolution starts. Set EARLY_EXIT=0 to always run the full model
+EARLY_EXIT_CONV = 2
+CONV_LAYERS = (layers.Conv2D, layers.SeparableConv2D, layers.DepthwiseConv2D)
+EARLY_EXIT_ENABLED = os.getenv('EARLY_EXIT', '1') != '0'
 
 class PlantDiseaseDetector:
     def __init__(self):
@@ -36,6 +60,14 @@ class PlantDiseaseDetector:
         self.label_encoder = None
         self.class_names = []
         self.img_size = (128, 128)
+        self.model_version = None
+        self.temperature = 1.0
+        self.early_exit = None
+        self.embedding_model = None
+        # Leaf crop for models trained from here; load_model switches to the model's own setting
+        self.leaf_crop = preprocessing.LEAF_CROP
+        self._prediction_cache = OrderedDict()
+        self._prediction_cache_lock = threading.Lock()
         
     def download_dataset(self):
         """Download PlantVillage dataset from Kaggle"""
@@ -63,11 +95,11 @@ class PlantDiseaseDetector:
             print("Then create a ~/.kaggle/kaggle.json file or set KAGGLE_USERNAME and KAGGLE_KEY environment variables.")
             return None
     
-    def load_and_preprocess_data(self, data_path):
-        """Load and preprocess images from the dataset"""
-        print("Loading and preprocessing data...")
-        
-        images = []
+    def list_image_files(self, data_path):
+        """
+        Image paths and class labels of the dataset (one sub-directory per class), in the
+        same order on every machine. Sets class_names to the sorted class directories
+        """
         labels = []
         
         # Get all class directories
@@ -78,35 +110,35 @@ class PlantDiseaseDetector:
         for i, class_name in enumerate(self.class_names):
             print(f"{i}: {class_name}")
         
-        # Load images from each class
+        # Collect image files from each class
+        image_paths = []
         for class_idx, class_name in enumerate(self.class_names):
             class_path = os.path.join(data_path, class_name)
-            image_files = [f for f in os.listdir(class_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+            # Sorted, since listdir order varies between filesystems and machines and decides
+            # which images survive the per-class limit
+            image_files = sorted(f for f in os.listdir(class_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))
             
             print(f"Loading {len(image_files)} images from {class_name}...")
             
             for img_file in image_files[:500]:  # Limit to 500 images per class for faster training
-                img_path = os.path.join(class_path, img_file)
-                
-                try:
-                    # Load and resize image
-                    img = cv2.imread(img_path)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                    img = cv2.resize(img, self.img_size)
-                    
-                    # Normalize pixel values
-                    img = img.astype('float32') / 255.0
-                    
-                    images.append(img)
-                    labels.append(class_name)
-                    
-                except Exception as e:
-                    print(f"Error loading {img_path}: {e}")
-                    continue
+                image_paths.append(os.path.join(class_path, img_file))
+                labels.append(class_name)
         
-        # Convert to numpy arrays
-        images = np.array(images)
-        labels = np.array(labels)
+        return image_paths, labels
+    
+    def load_and_preprocess_data(self, data_path):
+        """Load and preprocess images from the dataset"""
+        print("Loading and preprocessing data...")
+        
+        image_paths, labels = self.list_image_files(data_path)
+        
+        # Decode and resize into one uint8 array, normalised once at the end
+        images, kept = preprocessing.load_images(
+            image_paths, self.img_size,
+            on_error=lambda img_path, e: print(f"Error loading {img_path}: {e}"),
+            crop=self.leaf_crop
+        )
+        labels = np.array(labels)[kept]
         
         # Encode labels
         self.label_encoder = LabelEncoder()
@@ -202,12 +234,171 @@ class PlantDiseaseDetector:
         
         print("Model saved as 'leafdoctor_model.h5'")
         
+        # Calibrate confidence and fit the early-exit head on the same validation split
+        self.fit_calibration(X_train, y_train, X_val, y_val)
+        
         return history
     
-    def load_model(self, model_path='leafdoctor_model.h5', class_names_path='class_names.json'):
+    def split_for_early_exit(self):
+        """
+        Stem (first two conv blocks) and tail views of the model, sharing its weights, and
+        the index of the first tail layer. Returns None when the model cannot be split
+        there: it is not a plain Sequential stack, has fewer than three convolutions, or
+        the stem does not end in feature maps
+        """
+        if not isinstance(self.model, keras.Sequential):
+            return None
+        convolutions = [i for i, layer in enumerate(self.model.layers) if isinstance(layer, CONV_LAYERS)]
+        if len(convolutions) <= EARLY_EXIT_CONV:
+            return None
+        split = convolutions[EARLY_EXIT_CONV]
+        stem = keras.Sequential(self.model.layers[:split])
+        if len(stem.compute_output_shape((None, *self.img_size, 3))) != 4:
+            return None
+        return stem, keras.Sequential(self.model.layers[split:]), split
+    
+    def build_embedding_model(self, start=0, input_shape=None):
+        """
+        Model returning (embedding, class probabilities) from one forward pass, where the
+        embedding is the last hidden Dense layer (256 units in build_cnn_model); it shares
+        the model's weights. With start, it begins at that layer and takes input_shape
+        features (the early-exit stem output) instead of images
+        """
+        model_layers = self.model.layers
+        # The last layer before the classifier that is not dropout
+        split = max(i for i, layer in enumerate(model_layers[:-1]) if not isinstance(layer, layers.Dropout))
+        inputs = keras.Input(shape=input_shape or (*self.img_size, 3))
+        x = inputs
+        for layer in model_layers[start:split + 1]:
+            x = layer(x)
+        embedding = x
+        for layer in model_layers[split + 1:]:
+            x = layer(x)
+        return keras.Model(inputs, [embedding, x])
+    
+    def fit_calibration(self, X_train, y_train, X_val, y_val, early_exit=True, output_dir='.'):
+        """
+        Fit temperature scaling on the validation split and, optionally, an early-exit head
+        on the second conv block. Writes calibration.json (and the head) to output_dir
+        """
+        print("Calibrating confidence...")
+        labels_val = y_val.argmax(axis=1)
+        probabilities = self.model.predict(X_val, batch_size=64, verbose=0)
+        temperature = calibration.fit_temperature(probabilities, labels_val)
+        calibrated = calibration.apply_temperature(probabilities, temperature)
+        full_accuracy = float((probabilities.argmax(axis=1) == labels_val).mean())
+        print(f"Temperature {temperature:.3f}: expected calibration error "
+              f"{calibration.expected_calibration_error(probabilities, labels_val):.3f} -> "
+              f"{calibration.expected_calibration_error(calibrated, labels_val):.3f}")
+        # The crop the model was trained with, so serving feeds it the same inputs
+        config = {'temperature': temperature, 'validation_accuracy': full_accuracy, 'leaf_crop': self.leaf_crop}
+        
+        head = None
+        split = self.split_for_early_exit() if early_exit else None
+        if early_exit and split is None:
+            print("Early exit skipped: the model has no second conv block to branch from")
+        if split is not None:
+            print("Training early-exit head...")
+            stem, _, split_layer = split
+            
+            # The head starts with global average pooling, so it can be trained on pooled
+            # stem features instead of full feature maps
+            def pooled_features(X):
+                return np.concatenate([
+                    np.asarray(stem.predict_on_batch(X[i:i + 64])).mean(axis=(1, 2))
+                    for i in range(0, len(X), 64)
+                ])
+            
+            train_features, val_features = pooled_features(X_train), pooled_features(X_val)
+            classifier = keras.Sequential([
+                layers.Input(shape=(train_features.shape[1],)),
+                layers.Dense(128, activation='relu'),
+                layers.Dropout(0.2),
+                layers.Dense(len(self.class_names), activation='softmax')
+            ])
+            classifier.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+            classifier.fit(
+                train_features, y_train, batch_size=64, epochs=50,
+                validation_data=(val_features, y_val),
+                callbacks=[keras.callbacks.EarlyStopping(patience=5, restore_best_weights=True)],
+                verbose=0
+            )
+            
+            head_probabilities = classifier.predict(val_features, verbose=0)
+            head_temperature = calibration.fit_temperature(head_probabilities, labels_val)
+            head_calibrated = calibration.apply_temperature(head_probabilities, head_temperature)
+            threshold = calibration.choose_exit_threshold(head_calibrated, labels_val, full_accuracy)
+            if threshold is None:
+                print("Early exit disabled: no threshold keeps full-model accuracy on the validation split")
+            else:
+                exits = head_calibrated.max(axis=1) >= threshold
+                exit_accuracy = float((head_calibrated.argmax(axis=1) == labels_val)[exits].mean())
+                # Recorded so a head is never attached to a model split elsewhere
+                config['early_exit'] = {
+                    'layer': split_layer,
+                    'layer_name': self.model.layers[split_layer].name,
+                    'temperature': head_temperature,
+                    'threshold': threshold,
+                    'validation_exit_rate': float(exits.mean()),
+                    'validation_exit_accuracy': exit_accuracy,
+                }
+                head = keras.Sequential(
+                    [layers.Input(shape=stem.compute_output_shape((None, *self.img_size, 3))[1:]), layers.GlobalAveragePooling2D()] + classifier.layers
+                )
+                head.save(os.path.join(output_dir, EARLY_EXIT_FILENAME))
+                print(f"Early exit at confidence >= {threshold:.2f}: {exits.mean():.1%} of validation images, "
+                      f"{exit_accuracy:.2%} accurate (full model {full_accuracy:.2%})")
+        
+        with open(os.path.join(output_dir, CALIBRATION_FILENAME), 'w') as f:
+            json.dump(config, f, indent=2)
+        self._apply_calibration(config, head)
+        return config
+    
+    def _apply_calibration(self, config, head=None):
+        self.temperature = config.get('temperature', 1.0)
+        # Models saved before the crop was recorded were trained on whole photos
+        self.leaf_crop = config.get('leaf_crop', False)
+        self.early_exit = None
+        exit_config = config.get('early_exit')
+        if not (EARLY_EXIT_ENABLED and exit_config and head is not None):
+            return
+        split = self.split_for_early_exit()
+        if split is None:
+            print("Early exit disabled: the model has no second conv block to branch from")
+            return
+        stem, tail, split_layer = split
+        stem_shape = tuple(stem.compute_output_shape((None, *self.img_size, 3))[1:])
+        # Heads saved before the layer name was recorded are checked by index and shape only
+        if (exit_config['layer'] != split_layer
+                or exit_config.get('layer_name', self.model.layers[split_layer].name) != self.model.layers[split_layer].name
+                or tuple(head.inputs[0].shape[1:]) != stem_shape):
+            print(f"Early exit disabled: the head was fitted at layer {exit_config['layer']} "
+                  f"({exit_config.get('layer_name', 'unnamed')}), which does not match this model's split "
+                  f"at layer {split_layer} ({self.model.layers[split_layer].name})")
+            return
+        # Full exits that also need the embedding continue from the same stem features
+        tail_embedding = self.build_embedding_model(start=split_layer, input_shape=stem_shape)
+        self.early_exit = dict(exit_config, stem=stem, head=head, tail=tail, tail_embedding=tail_embedding)
+    
+    def _load_calibration(self, model_dir):
+        """Load calibration.json and the early-exit head stored next to the model, if present"""
+        calibration_path = os.path.join(model_dir, CALIBRATION_FILENAME)
+        if not os.path.exists(calibration_path):
+            self._apply_calibration({})
+            return
+        with open(calibration_path, 'r') as f:
+            config = json.load(f)
+        head = None
+        head_path = os.path.join(model_dir, EARLY_EXIT_FILENAME)
+        if config.get('early_exit') and os.path.exists(head_path):
+            head = keras.models.load_model(head_path)
+        self._apply_calibration(config, head)
+    
+    def load_model(self, model_path='leafdoctor_model.h5', class_names_path='class_names.json', model_version=None):
         """Load a pre-trained model"""
         if os.path.exists(model_path) and os.path.exists(class_names_path):
             print("Loading pre-trained model...")
+            start = time.perf_counter()
             self.model = keras.models.load_model(model_path)
             
             with open(class_names_path, 'r') as f:
@@ -216,50 +407,194 @@ class PlantDiseaseDetector:
             # Recreate label encoder
             self.label_encoder = LabelEncoder()
             self.label_encoder.fit(self.class_names)
+            self._load_calibration(os.path.dirname(model_path) or '.')
+            self.embedding_model = self.build_embedding_model()
+            
+            # Cached predictions and explanations are keyed by version, so a new model never
+            # serves answers computed by the old one
+            self.model_version = model_version or fingerprint(model_path, class_names_path)
+            with self._prediction_cache_lock:
+                self._prediction_cache.clear()
             
+            metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+            metrics.MODEL_LOADED.set(1)
             print("Model loaded successfully!")
             return True
         return False
     
+    def warm_up(self, batch_sizes=(1,)):
+        """
+        Run dummy forward passes so graph tracing and kernel selection happen before
+        the first real request. Returns False if no model is loaded
+        """
+        if self.model is None:
+            return False
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            batch = np.zeros((batch_size, *self.img_size, 3), dtype=np.float32)
+            self.model.predict_on_batch(batch)
+            if self.early_exit is not None:
+                features = self.early_exit['stem'].predict_on_batch(batch)
+                self.early_exit['head'].predict_on_batch(features)
+                self.early_exit['tail'].predict_on_batch(features)
+                self.early_exit['tail_embedding'].predict_on_batch(features)
+            if self.embedding_model is not None:
+                self.embedding_model.predict_on_batch(batch)
+        metrics.MODEL_WARMUP_SECONDS.set(time.perf_counter() - start)
+        return True
+    
+    def read_image_rgb(self, image_path, min_size=None):
+        """Read an image file as an RGB uint8 array, decoding large JPEGs at reduced scale"""
+        return preprocessing.decode_image(image_path, min_size=min_size)
+    
     def preprocess_image(self, image_path):
         """Preprocess a single image for prediction"""
         try:
-            # Load image
-            img = cv2.imread(image_path)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Resize to model input size
-            img = cv2.resize(img, self.img_size)
-            
-            # Normalize
-            img = img.astype('float32') / 255.0
-            
-            # Add batch dimension
-            img = np.expand_dims(img, axis=0)
-            
-            return img
+            with metrics.STAGE_SECONDS.time(stage='preprocess'):
+                return preprocessing.preprocess_file(image_path, self.img_size, crop=self.leaf_crop)
         except Exception as e:
+            metrics.FAILURES.inc(stage='preprocess')
             print(f"Error preprocessing image: {e}")
             return None
     
-    def predict_leaf_disease(self, image_path):
+    def build_tta_views(self, img, n_views=TTA_MAX_VIEWS):
+        """
+        Build up to n_views augmented copies of an RGB uint8 image as one normalised batch
+        Views, in order: full image, horizontal flip, vertical flip, centre crop,
+        four corner crops, and rotations of +/-10 degrees
+        """
+        width, height = self.img_size
+        n_views = max(1, min(n_views, TTA_MAX_VIEWS))
+        if self.leaf_crop:
+            img = preprocessing.crop_to_leaf(img)
+        
+        base = cv2.resize(img, (width, height))
+        # Crops are taken from a slightly larger resize so each keeps ~87% of the field of view
+        crop_w, crop_h = int(round(width * 1.15)), int(round(height * 1.15))
+        enlarged = cv2.resize(img, (crop_w, crop_h))
+        dx, dy = crop_w - width, crop_h - height
+        
+        def rotate(angle):
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+            return cv2.warpAffine(base, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+        
+        view_builders = [
+            lambda: base,
+            lambda: base[:, ::-1],
+            lambda: base[::-1, :],
+            lambda: enlarged[dy // 2:dy // 2 + height, dx // 2:dx // 2 + width],
+            lambda: enlarged[:height, :width],
+            lambda: enlarged[:height, dx:],
+            lambda: enlarged[dy:, :width],
+            lambda: enlarged[dy:, dx:],
+            lambda: rotate(10),
+            lambda: rotate(-10),
+        ]
+        
+        batch = np.empty((n_views, height, width, 3), dtype=np.uint8)
+        for i in range(n_views):
+            batch[i] = view_builders[i]()
+        
+        return preprocessing.normalize_batch(batch)
+    
+    def tta_decode_size(self):
+        """TTA crops come from a 1.15x resize, so decode at least that large"""
+        width, height = self.img_size
+        crop_width, crop_height = preprocessing.decode_size(self.img_size, self.leaf_crop)
+        return (max(crop_width, int(round(width * 1.15))), max(crop_height, int(round(height * 1.15))))
+    
+    def preprocess_image_tta(self, image_path, n_views=TTA_MAX_VIEWS):
+        """Preprocess a single image into a batch of test-time augmentation views"""
+        try:
+            with metrics.STAGE_SECONDS.time(stage='preprocess'):
+                return self.build_tta_views(self.read_image_rgb(image_path, self.tta_decode_size()), n_views)
+        except Exception as e:
+            metrics.FAILURES.inc(stage='preprocess')
+            print(f"Error preprocessing image: {e}")
+            return None
+    
+    def predict_leaf_disease(self, image_path, tta_views=None, with_embedding=False):
         """
         Part 2: Prediction Function
         Loads a user-provided image, preprocesses it, and predicts the disease class
+        With tta_views > 1, augmented views are classified in one batched forward pass
+        and their probabilities averaged
+        With with_embedding, the result also holds 'embedding', the penultimate-layer
+        features (for similar-case search); images that leave at the early-exit head
+        also run the tail on their stem features to get it
+        Images that fail the admission gate return {'rejected': True, 'reasons', 'advice', 'scores'}
         """
         if self.model is None:
             print("Model not loaded. Please train or load a model first.")
             return None
         
-        # Preprocess image
-        processed_img = self.preprocess_image(image_path)
-        if processed_img is None:
+        # Repeat uploads of the same photo are answered from the cache
+        try:
+            with open(image_path, 'rb') as f:
+                cache_key = (self.model_version, hashlib.file_digest(f, 'sha256').hexdigest(), tta_views or 1, with_embedding)
+        except OSError:
+            cache_key = None
+        with self._prediction_cache_lock:
+            cached = self._prediction_cache.get(cache_key)
+            if cached is not None:
+                self._prediction_cache.move_to_end(cache_key)
+        metrics.CACHE_LOOKUPS.inc(cache='prediction', result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            return dict(cached)
+        if cache_key is None:
+            return self._predict_uncached(image_path, tta_views, with_embedding, None)
+        
+        # Concurrent requests for the same image share one forward pass
+        result = get_single_flight().do(
+            'predict', ('predict',) + cache_key,
+            lambda: self._predict_uncached(image_path, tta_views, with_embedding, cache_key[1])
+        )
+        if result is None:
+            return None
+        if not result.get('rejected') and PREDICTION_CACHE_SIZE > 0:
+            with self._prediction_cache_lock:
+                self._prediction_cache[cache_key] = result
+                while len(self._prediction_cache) > PREDICTION_CACHE_SIZE:
+                    self._prediction_cache.popitem(last=False)
+        return dict(result)
+    
+    def _predict_uncached(self, image_path, tta_views, with_embedding, image_sha256):
+        """Decode, gate, preprocess and classify one image (predict_leaf_disease without the caches)"""
+        # Decode once: the admission gate and preprocessing share the pixels
+        use_tta = tta_views and tta_views > 1
+        try:
+            start = time.perf_counter()
+            img = self.read_image_rgb(image_path, self.tta_decode_size() if use_tta else preprocessing.decode_size(self.img_size, self.leaf_crop))
+            decode_seconds = time.perf_counter() - start
+        except Exception as e:
+            metrics.FAILURES.inc(stage='preprocess')
+            print(f"Error preprocessing image: {e}")
             return None
         
-        # Make prediction
-        predictions = self.model.predict(processed_img)
-        predicted_class_idx = np.argmax(predictions[0])
-        confidence = np.max(predictions[0])
+        # Blurry, badly exposed and non-leaf photos are rejected before any model work
+        if image_gate.ENABLED:
+            admission = image_gate.assess_image(img)
+            if not admission['accepted']:
+                print(f"Image rejected: {', '.join(admission['reasons'])}")
+                return dict(admission, rejected=True)
+        
+        start = time.perf_counter()
+        if use_tta:
+            processed_img = self.build_tta_views(img, tta_views)
+        else:
+            processed_img = preprocessing.preprocess_array(img, self.img_size, crop=self.leaf_crop)
+        metrics.STAGE_SECONDS.observe(decode_seconds + time.perf_counter() - start, stage='preprocess')
+        
+        # Make prediction, averaging over augmented views when TTA is on
+        embedding = None
+        with metrics.STAGE_SECONDS.time(stage='inference'):
+            if with_embedding:
+                probabilities, embedding, exit_taken = self.infer_with_embedding(processed_img)
+            else:
+                probabilities, exit_taken = self.infer(processed_img)
+        metrics.INFERENCE_EXITS.inc(exit=exit_taken)
+        predicted_class_idx = np.argmax(probabilities)
+        confidence = np.max(probabilities)
         
         # Get class name
         predicted_class = self.class_names[predicted_class_idx]
@@ -267,45 +602,158 @@ class PlantDiseaseDetector:
         print(f"Predicted disease: {predicted_class}")
         print(f"Confidence: {confidence:.2%}")
         
-        return {
+        result = {
             'predicted_class': predicted_class,
             'confidence': confidence,
-            'all_predictions': predictions[0]
+            'all_predictions': probabilities,
+            'tta_views': len(processed_img),
+            'exit': exit_taken,
+            'image_sha256': image_sha256
         }
+        if embedding is not None:
+            result['embedding'] = embedding
+        return result
+    
+    def infer(self, batch):
+        """
+        Calibrated class probabilities for a preprocessed batch, averaged over its views,
+        and which exit produced them. Single images leave at the early-exit head when its
+        calibrated confidence clears the threshold; otherwise the stem features are reused
+        by the rest of the network
+        """
+        if self.early_exit is not None and len(batch) == 1:
+            features, head_probabilities = self._early_exit(batch)
+            if head_probabilities is not None:
+                return head_probabilities, 'early'
+            predictions = self.early_exit['tail'].predict_on_batch(features)
+        else:
+            # predict_on_batch skips predict()'s per-call dataset setup, which dominates small batches
+            predictions = self.model.predict_on_batch(batch)
+        probabilities = calibration.apply_temperature(np.asarray(predictions), self.temperature)
+        return probabilities.mean(axis=0), 'full'
+    
+    def _early_exit(self, batch):
+        """Stem features of a single image, and the head's calibrated probabilities if confident enough to exit"""
+        features = self.early_exit['stem'].predict_on_batch(batch)
+        head_probabilities = calibration.apply_temperature(
+            np.asarray(self.early_exit['head'].predict_on_batch(features)), self.early_exit['temperature']
+        )
+        if head_probabilities.max() >= self.early_exit['threshold']:
+            return features, head_probabilities.mean(axis=0)
+        return features, None
+    
+    def infer_with_embedding(self, batch):
+        """
+        infer() that also returns the penultimate-layer embedding, averaged over the views:
+        (probabilities, embedding, exit). Both exits run the tail on the stem features to
+        reach the embedding layer; early exits still answer with the head's probabilities,
+        so the prediction matches infer()
+        """
+        if self.early_exit is not None and len(batch) == 1:
+            features, head_probabilities = self._early_exit(batch)
+            embeddings, predictions = self.early_exit['tail_embedding'].predict_on_batch(features)
+            if head_probabilities is not None:
+                return head_probabilities, np.asarray(embeddings).mean(axis=0), 'early'
+        else:
+            if self.embedding_model is None:
+                self.embedding_model = self.build_embedding_model()
+            embeddings, predictions = self.embedding_model.predict_on_batch(batch)
+        probabilities = calibration.apply_temperature(np.asarray(predictions), self.temperature)
+        return probabilities.mean(axis=0), np.asarray(embeddings).mean(axis=0), 'full'
+    
+    def classify_batch(self, batch):
+        """Calibrated class probabilities for each image of a preprocessed batch, from the full model"""
+        return calibration.apply_temperature(np.asarray(self.model.predict_on_batch(batch)), self.temperature)
+    
+    def top_predictions(self, probabilities, k=3):
+        """Return the k most likely (class_name, probability) pairs, highest first"""
+        k = max(1, min(k, len(probabilities)))
+        # argpartition avoids sorting the full class vector for a handful of results
+        indices = np.argpartition(probabilities, -k)[-k:]
+        indices = indices[np.argsort(probabilities[indices])[::-1]]
+        return [(self.class_names[i], float(probabilities[i])) for i in indices]
+    
+    def _explanation_messages(self, predicted_class):
+        """Build the chat messages used to request a farmer-friendly explanation"""
+        prompt = f"""Explain what {predicted_class} is and how to treat it in organic and non-organic ways. 
+        Provide step-by-step advice for a smallholder farmer. Include:
+        
+        1. What is this disease/condition?
+        2. What causes it?
+        3. Organic treatment methods
+        4. Non-organic treatment methods
+        5. Prevention strategies
+        6. When to seek professional help
+        
+        Please provide practical, actionable advice that a farmer can implement."""
+        
+        return [
+            {"role": "system", "content": "You are an expert agricultural extension officer helping smallholder farmers."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _explanation_fallback(self, predicted_class):
+        """Static advice returned when the explanation cannot be generated"""
+        return f"Unable to get detailed explanation for {predicted_class}. Please consult with a local agricultural extension officer."
     
     def get_gpt_explanation(self, predicted_class):
         """
         Part 3: GPT Integration
         Get farmer-friendly explanation and treatment advice from GPT-4
+        Served from the offline advice knowledge base when it has an entry for the class
         """
+        stored_advice = get_advice_kb().lookup(predicted_class)
+        metrics.CACHE_LOOKUPS.inc(cache='advice_kb', result='hit' if stored_advice else 'miss')
+        if stored_advice:
+            return stored_advice
+        
+        # Explanations already generated in this process skip the API and the coalescing locks
+        cache_key = ('explanation', self.model_version, predicted_class)
+        remembered = client.cached(cache_key)
+        metrics.CACHE_LOOKUPS.inc(cache='explanation', result='hit' if remembered else 'miss')
+        if remembered:
+            return remembered
+        
         try:
-            prompt = f"""Explain what {predicted_class} is and how to treat it in organic and non-organic ways. 
-            Provide step-by-step advice for a smallholder farmer. Include:
-            
-            1. What is this disease/condition?
-            2. What causes it?
-            3. Organic treatment methods
-            4. Non-organic treatment methods
-            5. Prevention strategies
-            6. When to seek professional help
-            
-            Please provide practical, actionable advice that a farmer can implement."""
+            with metrics.STAGE_SECONDS.time(stage='explanation'):
+                # Concurrent requests for the same class share one OpenAI call
+                return get_single_flight().do('explanation', cache_key, lambda: client.chat(
+                    model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
+                    messages=self._explanation_messages(predicted_class),
+                    cache_key=cache_key,
+                    max_tokens=1000,
+                    temperature=0.7
+                ))
             
-            response = client.chat.completions.create(
-                model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
-                messages=[
-                    {"role": "system", "content": "You are an expert agricultural extension officer helping smallholder farmers."},
-                    {"role": "user", "content": prompt}
-                ],
+        except Exception as e:
+            metrics.FAILURES.inc(stage='explanation')
+            print(f"Error getting GPT explanation: {e}")
+            return self._explanation_fallback(predicted_class)
+    
+    def stream_gpt_explanation(self, predicted_class):
+        """
+        Stream the GPT explanation as it is generated
+        Yields text fragments so callers can render advice before the full completion arrives
+        """
+        stored_advice = get_advice_kb().lookup(predicted_class)
+        metrics.CACHE_LOOKUPS.inc(cache='advice_kb', result='hit' if stored_advice else 'miss')
+        if stored_advice:
+            yield stored_advice
+            return
+        
+        try:
+            yield from client.stream_chat(
+                model="gpt-4o",
+                messages=self._explanation_messages(predicted_class),
+                cache_key=('explanation', self.model_version, predicted_class),
                 max_tokens=1000,
                 temperature=0.7
             )
-            
-            return response.choices[0].message.content
-            
+                    
         except Exception as e:
-            print(f"Error getting GPT explanation: {e}")
-            return f"Unable to get detailed explanation for {predicted_class}. Please consult with a local agricultural extension officer."
+            metrics.FAILURES.inc(stage='explanation')
+            print(f"Error streaming GPT explanation: {e}")
+            yield self._explanation_fallback(predicted_class)
     
     def display_results(self, image_path, prediction_result, gpt_explanation):
         """
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Prediction History for Plant Disease Detection System
+Records every diagnosis from the Flask app, the Streamlit app and the Vision API demo
+in a local SQLite file (WAL mode), indexed by time, class, image hash and model
+version so past diagnoses can be queried and aggregated. Writes are buffered in
+memory and committed in batches by a background thread, off the request path.
+History can be exported to Parquet (needs pyarrow) or CSV for analytics.
+
+Settings are read from the environment:
+    HISTORY_DB_PATH          SQLite file (default 'prediction_history.sqlite')
+    HISTORY                  set to 0 to stop recording
+    HISTORY_FLUSH_INTERVAL   seconds between batched writes (default 1)
+    HISTORY_BATCH_SIZE       buffered records that trigger an early write (default 500)
+    HISTORY_MAX_BUFFER       records held in memory before new ones are dropped (default 10000)
+
+Usage:
+    python prediction_history.py stats [--since 2026-10-01]
+    python prediction_history.py recent [--limit 20] [--class Tomato___Early_blight]
+    python prediction_history.py export history.parquet [--since 2026-10-01] [--until 2026-11-01]
+"""
+
+import os
+import csv
+import json
+import time
+import atexit
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+import metrics
+
+DEFAULT_HISTORY_PATH = os.getenv('HISTORY_DB_PATH', 'prediction_history.sqlite')
+ENABLED = os.getenv('HISTORY', '1') != '0'
+FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1'))
+BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '500'))
+MAX_BUFFER = int(os.getenv('HISTORY_MAX_BUFFER', '10000'))
+# Rows fetched per round trip when exporting, so exports never hold the whole table
+EXPORT_CHUNK_ROWS = 100000
+
+COLUMNS = ('created_at', 'source', 'image_sha256', 'model_version', 'predicted_class',
+           'confidence', 'exit', 'latency_ms', 'details')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id              INTEGER PRIMARY KEY,
+    created_at      REAL NOT NULL,
+    source          TEXT NOT NULL,
+    image_sha256    TEXT,
+    model_version   TEXT,
+    predicted_class TEXT NOT NULL,
+    confidence      REAL,
+    exit            TEXT,
+    latency_ms      REAL,
+    details         TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_time ON predictions (created_at);
+CREATE INDEX IF NOT EXISTS predictions_class ON predictions (predicted_class, created_at);
+CREATE INDEX IF NOT EXISTS predictions_image ON predictions (image_sha256);
+CREATE INDEX IF NOT EXISTS predictions_model ON predictions (model_version, created_at);
+"""
+
+
+def parse_date(text):
+    """Epoch seconds for 'YYYY-MM-DD' or an ISO timestamp; None passes through"""
+    if text is None:
+        return None
+    return datetime.fromisoformat(text).timestamp()
+
+
+class PredictionHistory:
+    """SQLite-backed diagnosis log with buffered, batched writes"""
+
+    def __init__(self, db_path=DEFAULT_HISTORY_PATH, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE,
+                 max_buffer=MAX_BUFFER):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._local = threading.local()
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = None
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        # WAL lets dashboards read while workers write; NORMAL sync is durable across
+        # application crashes and only risks the last commits on power loss
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        return conn
+
+    def record(self, source, predicted_class, confidence=None, image_sha256=None, model_version=None,
+               inference_exit=None, latency_ms=None, details=None, created_at=None):
+        """Queue one diagnosis for writing; never blocks on the database"""
+        row = (created_at or time.time(), source, image_sha256, model_version, predicted_class,
+               None if confidence is None else float(confidence), inference_exit,
+               None if latency_ms is None else float(latency_ms),
+               json.dumps(details) if details is not None else None)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                metrics.HISTORY_RECORDS.inc(result='dropped')
+                return False
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+        self._start_writer()
+        if full:
+            self._wake.set()
+        return True
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+                # Buffered records are written when the process exits normally
+                atexit.register(self.flush)
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Warning: could not write prediction history: {e}")
+
+    def flush(self):
+        """Write all buffered records in one transaction; returns the number written"""
+        with self._flushing:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                with metrics.STAGE_SECONDS.time(stage='history_write'):
+                    conn = self._connect()
+                    with conn:
+                        conn.executemany(
+                            f"INSERT INTO predictions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                            rows
+                        )
+            except Exception:
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    self._buffer[:0] = rows[:max(0, self.max_buffer - len(self._buffer))]
+                raise
+            metrics.HISTORY_RECORDS.inc(len(rows), result='written')
+            return len(rows)
+
+    def _where(self, since=None, until=None, class_name=None, model_version=None):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('created_at < ?')
+            params.append(until)
+        if class_name is not None:
+            clauses.append('predicted_class = ?')
+            params.append(class_name)
+        if model_version is not None:
+            clauses.append('model_version = ?')
+            params.append(model_version)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def recent(self, limit=20, since=None, class_name=None, model_version=None):
+        """Newest diagnoses first, as dicts"""
+        where, params = self._where(since, None, class_name, model_version)
+        cursor = self._connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM predictions{where} ORDER BY created_at DESC LIMIT ?",
+            params + [limit]
+        )
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def class_counts(self, since=None, until=None, model_version=None):
+        """{class: count} over a time range, most frequent first"""
+        where, params = self._where(since, until, None, model_version)
+        cursor = self._connect().execute(
+            f"SELECT predicted_class, COUNT(*) FROM predictions{where} GROUP BY predicted_class ORDER BY 2 DESC",
+            params
+        )
+        return dict(cursor.fetchall())
+
+    def daily_counts(self, since=None, until=None, class_name=None):
+        """[(day, class, count)] for dashboards, in day order"""
+        where, params = self._where(since, until, class_name, None)
+        cursor = self._connect().execute(
+            f"SELECT date(created_at, 'unixepoch') AS day, predicted_class, COUNT(*) FROM predictions{where} "
+            "GROUP BY day, predicted_class ORDER BY day",
+            params
+        )
+        return cursor.fetchall()
+
+    def export(self, output_path, since=None, until=None):
+        """
+        Write diagnoses to a columnar Parquet file (or CSV, by extension) in chunks
+        Returns the number of rows written
+        """
+        where, params = self._where(since, until)
+        cursor = self._connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM predictions{where} ORDER BY created_at", params
+        )
+        written = 0
+        if output_path.endswith('.parquet'):
+            if pa is None:
+                raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow); export to .csv instead")
+            schema = pa.schema([
+                ('created_at', pa.timestamp('ms', tz='UTC')), ('source', pa.string()),
+                ('image_sha256', pa.string()), ('model_version', pa.string()),
+                ('predicted_class', pa.string()), ('confidence', pa.float32()), ('exit', pa.string()),
+                ('latency_ms', pa.float32()), ('details', pa.string()),
+            ])
+            with pq.ParquetWriter(output_path, schema, compression='zstd') as writer:
+                while rows := cursor.fetchmany(EXPORT_CHUNK_ROWS):
+                    columns = [list(column) for column in zip(*rows)]
+                    columns[0] = [round(t * 1000) for t in columns[0]]
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                        schema=schema
+                    ))
+                    written += len(rows)
+        else:
+            with open(output_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS)
+                while rows := cursor.fetchmany(EXPORT_CHUNK_ROWS):
+                    writer.writerows(rows)
+                    written += len(rows)
+        return written
+
+
+_shared_history = None
+_shared_history_lock = threading.Lock()
+
+
+def get_prediction_history():
+    """Return the process-wide prediction history, or None when recording is disabled"""
+    global _shared_history
+    if not ENABLED:
+        return None
+    if _shared_history is None:
+        with _shared_history_lock:
+            if _shared_history is None:
+                _shared_history = PredictionHistory()
+    return _shared_history
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query and export the prediction history')
+    parser.add_argument('--db', default=DEFAULT_HISTORY_PATH, help='History SQLite file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    stats_parser = subparsers.add_parser('stats', help='Diagnoses per class')
+    stats_parser.add_argument('--since', default=None, help='Start date (YYYY-MM-DD)')
+    stats_parser.add_argument('--until', default=None, help='End date, exclusive (YYYY-MM-DD)')
+    recent_parser = subparsers.add_parser('recent', help='Latest diagnoses')
+    recent_parser.add_argument('--limit', type=int, default=20)
+    recent_parser.add_argument('--class', dest='class_name', default=None, help='Only this class')
+    export_parser = subparsers.add_parser('export', help='Export to .parquet or .csv')
+    export_parser.add_argument('output_path')
+    export_parser.add_argument('--since', default=None, help='Start date (YYYY-MM-DD)')
+    export_parser.add_argument('--until', default=None, help='End date, exclusive (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No prediction history at '{args.db}'.")
+        return
+    history = PredictionHistory(args.db)
+    if args.command == 'stats':
+        counts = history.class_counts(parse_date(args.since), parse_date(args.until))
+        total = sum(counts.values())
+        for class_name, count in counts.items():
+            print(f"{count:>10}  {count / total:6.1%}  {class_name}")
+        print(f"{total:>10}  diagnoses")
+    elif args.command == 'recent':
+        for row in history.recent(args.limit, class_name=args.class_name):
+            when = datetime.fromtimestamp(row['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+            confidence = f"{row['confidence']:.1%}" if row['confidence'] is not None else '-'
+            print(f"{when}  {row['source']:<9}  {confidence:>6}  {row['predicted_class']}  ({row['model_version'] or '-'})")
+    else:
+        start = time.perf_counter()
+        written = history.export(args.output_path, parse_date(args.since), parse_date(args.until))
+        print(f"Exported {written} diagnoses to {args.output_path} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
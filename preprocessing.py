@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Shared Image Preprocessing for Plant Disease Detection System
+One implementation of decode -> RGB -> resize -> normalise used by training,
+the Flask/CLI detector and the Streamlit app, so all of them feed the model
+identical inputs.
+
+Batches are resized straight into a preallocated uint8 buffer and converted to
+float32 once per batch, instead of allocating several temporaries per image.
+
+Before resizing, each image is cropped to the leaf: a vegetation-colour mask is
+closed over lesions and the bounding box of its largest contour, padded and squared,
+becomes the model input. Field photos where the leaf fills a small part of the frame
+then spend the 128x128 input on the leaf instead of the background.
+
+Whether a model expects cropped input is recorded with it (leaf_crop in calibration.json)
+and followed when serving; models without the record get the whole photo.
+
+Settings are read from the environment:
+    LEAF_CROP    set to 0 to train new models on the whole photo
+"""
+
+import os
+import cv2
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = (128, 128)
+
+LEAF_CROP = os.getenv('LEAF_CROP', '1') != '0'
+# Decode larger when cropping, so a leaf filling half the frame still covers the model input
+CROP_DECODE_SCALE = 2
+# The leaf mask is computed on a copy this size on the long side
+CROP_ANALYSIS_SIZE = 128
+CROP_MARGIN = 0.1
+# Leaves smaller than this fraction of the frame are treated as not found
+CROP_MIN_AREA = 0.01
+# Boxes covering more than this fraction of the frame are not worth cropping
+CROP_MAX_AREA = 0.85
+
+# Formats that may carry an alpha channel and need IMREAD_UNCHANGED to see it
+ALPHA_FORMATS = ('.png', '.webp', '.tif', '.tiff')
+
+# JPEGs can be decoded at 1/2, 1/4 or 1/8 scale by skipping DCT coefficients
+JPEG_FORMATS = ('.jpg', '.jpeg')
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def to_rgb(img, bgr=False):
+    """
+    Convert a decoded image array to 3-channel RGB uint8
+    Handles grayscale (HxW or HxWx1), alpha (composited onto white) and 16-bit input
+    """
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    elif img.dtype != np.uint8:
+        img = np.clip(img, 0, 255).astype(np.uint8)
+
+    if img.ndim == 2 or img.shape[2] == 1:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+
+    if img.shape[2] == 4:
+        alpha = img[:, :, 3:4]
+        colour = img[:, :, :3]
+        if alpha.min() < 255:
+            # Composite onto white so transparent backgrounds do not read as black
+            colour = (colour.astype(np.uint16) * alpha + 255 * (255 - alpha.astype(np.uint16))) // 255
+            colour = colour.astype(np.uint8)
+        img = colour
+
+    if bgr:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(img)
+
+
+def reduction_factor(image_size, min_size):
+    """Largest JPEG decode scale factor whose output still covers min_size on both axes"""
+    # Compare shortest against longest side so EXIF rotation cannot leave it too small
+    short_side = min(image_size)
+    required = max(min_size)
+    for factor in sorted(REDUCED_DECODE_FLAGS, reverse=True):
+        if short_side // factor >= required:
+            return factor
+    return 1
+
+
+def decode_flags(image_path, min_size=None):
+    """Pick the cv2.imread flags for a file, using reduced-size decode for large JPEGs"""
+    lower_path = image_path.lower()
+    if lower_path.endswith(ALPHA_FORMATS):
+        return cv2.IMREAD_UNCHANGED
+    if min_size is not None and lower_path.endswith(JPEG_FORMATS):
+        try:
+            # Opening only parses the header; pixels are not decoded
+            with Image.open(image_path) as header:
+                image_size = header.size
+        except Exception:
+            return cv2.IMREAD_COLOR
+        factor = reduction_factor(image_size, min_size)
+        if factor > 1:
+            return REDUCED_DECODE_FLAGS[factor]
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(image_path, min_size=None):
+    """
+    Read an image file as an RGB uint8 array
+    With min_size=(width, height), large JPEGs are decoded straight to the smallest
+    1/2, 1/4 or 1/8 scale that still covers it instead of at full resolution
+    """
+    img = cv2.imread(image_path, decode_flags(image_path, min_size))
+    if img is None:
+        raise ValueError(f"Could not read image '{image_path}'")
+    return to_rgb(img, bgr=True)
+
+
+def decode_size(img_size, crop=LEAF_CROP):
+    """Smallest decode size that leaves enough pixels for the model input after cropping"""
+    if not crop:
+        return img_size
+    width, height = img_size
+    return (width * CROP_DECODE_SCALE, height * CROP_DECODE_SCALE)
+
+
+def vegetation_mask(img):
+    """Boolean mask of pixels that look like plant tissue: excess green or a saturated green/yellow hue"""
+    rgb = img.astype(np.float32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    excess_green = (2 * g - r - b) / (r + g + b + 1.0)
+    hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    # OpenCV hue is 0-179: 18-95 spans yellow through green, which covers chlorotic leaves
+    green_hue = (hue >= 18) & (hue <= 95) & (saturation >= 60) & (value >= 40)
+    return (excess_green > 0.1) | green_hue
+
+
+def leaf_bbox(img):
+    """
+    Square (x0, y0, x1, y1) box around the largest vegetation region of an RGB uint8 image
+    Returns None when no leaf is found or the leaf already fills most of the frame
+    """
+    height, width = img.shape[:2]
+    scale = min(1.0, CROP_ANALYSIS_SIZE / max(height, width))
+    small = img
+    if scale < 1:
+        small = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    mask = vegetation_mask(small).astype(np.uint8)
+    # Closing joins brown lesions and leaf veins to the surrounding green tissue
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(largest) < CROP_MIN_AREA * mask.size:
+        return None
+
+    # Pad, square up (the model was trained on square images) and map back to full resolution
+    x, y, w, h = cv2.boundingRect(largest)
+    side = max(w, h) * (1 + 2 * CROP_MARGIN) / scale
+    side = min(side, width, height)
+    if side * side > CROP_MAX_AREA * width * height:
+        return None
+    cx, cy = (x + w / 2) / scale, (y + h / 2) / scale
+    x0 = int(round(min(max(cx - side / 2, 0), width - side)))
+    y0 = int(round(min(max(cy - side / 2, 0), height - side)))
+    return x0, y0, x0 + int(round(side)), y0 + int(round(side))
+
+
+def crop_to_leaf(img):
+    """Crop an RGB uint8 image to the leaf; the image is returned unchanged if no crop applies"""
+    box = leaf_bbox(img)
+    if box is None:
+        return img
+    x0, y0, x1, y1 = box
+    return img[y0:y1, x0:x1]
+
+
+def resize_into(img, out):
+    """Resize an RGB uint8 image directly into a preallocated (H, W, 3) uint8 slot"""
+    height, width = out.shape[:2]
+    cv2.resize(img, (width, height), dst=out, interpolation=cv2.INTER_LINEAR)
+    return out
+
+
+def normalize_batch(batch, out=None):
+    """Convert a uint8 batch to float32 in [0, 1] in a single pass"""
+    if out is None:
+        out = np.empty(batch.shape, dtype=np.float32)
+    np.divide(batch, np.float32(255.0), out=out, dtype=np.float32)
+    return out
+
+
+def preprocess_array(img, img_size=IMG_SIZE, crop=LEAF_CROP):
+    """Preprocess one RGB uint8 image into a (1, H, W, 3) float32 model batch"""
+    width, height = img_size
+    batch = np.empty((1, height, width, 3), dtype=np.uint8)
+    resize_into(crop_to_leaf(img) if crop else img, batch[0])
+    return normalize_batch(batch)
+
+
+def preprocess_file(image_path, img_size=IMG_SIZE, crop=LEAF_CROP):
+    """Decode and preprocess one image file into a (1, H, W, 3) float32 model batch"""
+    return preprocess_array(decode_image(image_path, min_size=decode_size(img_size, crop)), img_size, crop)
+
+
+class BatchPreprocessor:
+    """
+    Reusable batch preprocessing with preallocated buffers
+    The returned float32 batch is a view into an internal buffer that is
+    overwritten by the next call; copy it if it must outlive the call.
+    """
+
+    def __init__(self, img_size=IMG_SIZE, batch_size=32, crop=LEAF_CROP):
+        width, height = img_size
+        self.img_size = img_size
+        self.batch_size = batch_size
+        self.crop = crop
+        self._uint8 = np.empty((batch_size, height, width, 3), dtype=np.uint8)
+        self._float = np.empty((batch_size, height, width, 3), dtype=np.float32)
+
+    def __call__(self, images):
+        """Preprocess up to batch_size RGB uint8 arrays or image paths"""
+        if len(images) > self.batch_size:
+            raise ValueError(f"Batch of {len(images)} exceeds buffer size {self.batch_size}")
+        for i, img in enumerate(images):
+            if isinstance(img, (str, os.PathLike)):
+                img = decode_image(os.fspath(img), min_size=decode_size(self.img_size, self.crop))
+            if self.crop:
+                img = crop_to_leaf(img)
+            resize_into(img, self._uint8[i])
+        n = len(images)
+        return normalize_batch(self._uint8[:n], out=self._float[:n])
+
+
+def load_images(image_paths, img_size=IMG_SIZE, on_error=None, crop=LEAF_CROP):
+    """
+    Decode and resize many image files into one float32 array
+    Images are resized into a single uint8 array and normalised once at the end.
+    Returns (images, kept_indices); failed files are skipped and reported to on_error.
+    """
+    width, height = img_size
+    batch = np.empty((len(image_paths), height, width, 3), dtype=np.uint8)
+    kept = []
+    for i, image_path in enumerate(image_paths):
+        try:
+            img = decode_image(image_path, min_size=decode_size(img_size, crop))
+            resize_into(crop_to_leaf(img) if crop else img, batch[len(kept)])
+            kept.append(i)
+        except Exception as e:
+            if on_error is not None:
+                on_error(image_path, e)
+    return normalize_batch(batch[:len(kept)]), kept
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Request Profiling for Plant Disease Detection System
+Profiles a sampled fraction of requests and writes one file per request, and merges
+those files into a single flame graph.
+
+Settings are read from the environment:
+    PROFILE_SAMPLE_RATE   fraction of requests to profile, 0 (default) disables profiling
+    PROFILE_MODE          'sample' (default): stack sampler writing collapsed stacks (.folded)
+                          'cprofile': deterministic cProfile dump (.prof)
+    PROFILE_INTERVAL      sampling interval in seconds for 'sample' mode (default 0.005)
+    PROFILE_DIR           output directory (default 'profiles')
+
+Usage:
+    python profiling.py merge profiles/ --svg flamegraph.svg --folded merged.folded
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+import cProfile
+import argparse
+import threading
+import functools
+from collections import Counter
+from html import escape
+
+SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+MODE = os.getenv('PROFILE_MODE', 'sample')
+INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread"""
+
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def write(self, path):
+        """Write collapsed stacks, one 'frame;frame;frame count' line per stack"""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _profile_path(name, extension):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{threading.get_ident()}_{random.getrandbits(24):06x}.{extension}")
+
+
+def profiled(name):
+    """Decorator that profiles a sampled fraction of calls when PROFILE_SAMPLE_RATE > 0"""
+    def decorator(func):
+        if SAMPLE_RATE <= 0:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if random.random() >= SAMPLE_RATE:
+                return func(*args, **kwargs)
+
+            if MODE == 'cprofile':
+                return _cprofiled_call(name, func, args, kwargs)
+
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sampler.stop()
+                try:
+                    sampler.write(_profile_path(name, 'folded'))
+                except OSError as e:
+                    print(f"Warning: could not write profile: {e}")
+        return wrapper
+    return decorator
+
+
+# From Python 3.12 only one profiler can be active per interpreter, so concurrent
+# request threads take turns; a call that finds the profiler busy runs unprofiled
+_cprofile_lock = threading.Lock()
+
+
+def _cprofiled_call(name, func, args, kwargs):
+    """Run func under cProfile when no other profile is active; profiler errors never fail the call"""
+    if not _cprofile_lock.acquire(blocking=False):
+        return func(*args, **kwargs)
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiling tool (a debugger, coverage) owns the interpreter
+            print(f"Warning: call not profiled: {e}")
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                profiler.disable()
+                profiler.dump_stats(_profile_path(name, 'prof'))
+            except Exception as e:
+                print(f"Warning: could not write profile: {e}")
+    finally:
+        _cprofile_lock.release()
+
+
+def merge_folded(paths):
+    """Sum collapsed-stack files into one Counter"""
+    merged = Counter()
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack and count.isdigit():
+                    merged[stack] += int(count)
+    return merged
+
+
+def render_flamegraph(stacks, path, title='Request profile', width=1200, row_height=16):
+    """Render merged collapsed stacks as a standalone SVG flame graph"""
+    # Build a call tree: node = [count, children]
+    root = [0, {}]
+    for stack, count in stacks.items():
+        root[0] += count
+        node = root
+        for frame in stack.split(';'):
+            node = node[1].setdefault(frame, [0, {}])
+            node[0] += count
+
+    rects = []
+
+    def layout(children, x, depth, scale):
+        for frame, (count, grandchildren) in sorted(children.items()):
+            w = count * scale
+            if w >= 0.5:
+                rects.append((x, depth, w, frame, count))
+                layout(grandchildren, x, depth + 1, scale)
+            x += w
+
+    total = max(root[0], 1)
+    layout(root[1], 0.0, 0, width / total)
+    max_depth = max((depth for _, depth, _, _, _ in rects), default=0) + 1
+    height = (max_depth + 2) * row_height
+
+    with open(path, 'w') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                f'font-family="monospace" font-size="11">\n')
+        f.write(f'<text x="4" y="{row_height - 4}">{escape(title)} ({total} samples)</text>\n')
+        for x, depth, w, frame, count in rects:
+            y = height - (depth + 1) * row_height
+            # Warm colours vary by name so neighbouring frames are distinguishable
+            hue = 10 + zlib.crc32(frame.encode('utf-8')) % 40
+            if len(frame) * 7 < w:
+                label = frame
+            elif w > 28:
+                label = frame[:int(w / 7) - 2] + '..'
+            else:
+                label = ''
+            f.write(f'<g><title>{escape(frame)} ({count} samples, {count / total:.1%})</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" '
+                    f'fill="hsl({hue},85%,55%)"/>'
+                    f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{escape(label)}</text></g>\n')
+        f.write('</svg>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge request profiles into a flame graph')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='Merge profiles from a directory')
+    merge_parser.add_argument('profile_dir', nargs='?', default=PROFILE_DIR)
+    merge_parser.add_argument('--svg', default='flamegraph.svg', help='Flame graph output')
+    merge_parser.add_argument('--folded', default=None, help='Also write merged collapsed stacks')
+    merge_parser.add_argument('--top', type=int, default=25, help='Functions to list from cProfile dumps')
+    args = parser.parse_args()
+
+    files = sorted(os.listdir(args.profile_dir)) if os.path.isdir(args.profile_dir) else []
+    folded = [os.path.join(args.profile_dir, f) for f in files if f.endswith('.folded')]
+    prof = [os.path.join(args.profile_dir, f) for f in files if f.endswith('.prof')]
+    if not folded and not prof:
+        print(f"No profiles found in '{args.profile_dir}'")
+        return
+
+    if folded:
+        stacks = merge_folded(folded)
+        render_flamegraph(stacks, args.svg, title=f"{len(folded)} sampled requests")
+        print(f"Merged {len(folded)} collapsed-stack profiles into {args.svg}")
+        if args.folded:
+            with open(args.folded, 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            print(f"Merged collapsed stacks written to {args.folded}")
+
+    if prof:
+        import pstats
+        stats = pstats.Stats(*prof)
+        print(f"\nMerged {len(prof)} cProfile dumps; top {args.top} by cumulative time:")
+        stats.sort_stats('cumulative').print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
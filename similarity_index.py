@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Similar-Case Index for Plant Disease Detection System
+Stores the penultimate-layer embedding of every diagnosed upload and finds the
+visually closest past cases for a new one, so agronomists can compare a prediction
+with leaves that were diagnosed before.
+
+Embeddings are L2-normalised and stored as float16 (512 bytes each for the 256-wide
+layer); in memory they are held as int8 codes with a per-row scale (260 bytes), which
+numpy scans several times faster than float16. Search is approximate: once the index holds INDEX_TRAIN_MIN entries, a
+k-means coarse quantizer splits it into about 2*sqrt(N) inverted lists and a query
+scans only the SIMILAR_NPROBE lists whose centroids are closest. Below that size,
+every entry is scanned. The quantizer is retrained in the background as the index
+grows, and inserts are appended as uploads arrive.
+
+Each model version gets its own index directory, because embeddings from different
+weights are not comparable:
+    similar_index/<version>/vectors.f16     embeddings in insertion order
+    similar_index/<version>/lists.i32       inverted-list id of each embedding
+    similar_index/<version>/quantizer.npz   centroids
+    similar_index/<version>/cases.sqlite    upload, class and time of each embedding
+    similar_index/<version>/dim             embedding width
+Appends and retraining hold a file lock, so several gunicorn workers can share one index.
+
+Settings are read from the environment:
+    SIMILAR_CASES          set to 0 to turn similar-case retrieval off
+    SIMILAR_INDEX_DIR      index root (default 'similar_index')
+    SIMILAR_K              similar cases returned per upload (default 5)
+    SIMILAR_NPROBE         inverted lists scanned per query (default 8)
+
+Usage:
+    python similarity_index.py stats
+    python similarity_index.py rebuild [--version v2]
+    python similarity_index.py bench --count 1000000
+"""
+
+import os
+import time
+import fcntl
+import sqlite3
+import argparse
+import threading
+import contextlib
+import numpy as np
+import metrics
+
+ENABLED = os.getenv('SIMILAR_CASES', '1') != '0'
+DEFAULT_INDEX_DIR = os.getenv('SIMILAR_INDEX_DIR', 'similar_index')
+SIMILAR_K = int(os.getenv('SIMILAR_K', '5'))
+NPROBE = int(os.getenv('SIMILAR_NPROBE', '8'))
+# Exhaustive search is fast enough below this size; the quantizer is trained once it is reached
+INDEX_TRAIN_MIN = 4096
+# Retrain when the index has grown this many times since the last training
+RETRAIN_GROWTH = 4
+# Inverted lists per square root of the entry count; smaller lists mean fewer rows scanned per probe
+LISTS_PER_SQRT = 2
+KMEANS_SAMPLE = 65536
+KMEANS_ITERATIONS = 10
+
+CASES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id              INTEGER PRIMARY KEY,
+    image_sha256    TEXT,
+    upload          TEXT,
+    predicted_class TEXT,
+    confidence      REAL,
+    created_at      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cases_image ON cases (image_sha256);
+"""
+
+
+def normalize(vectors):
+    """L2-normalise rows so inner products are cosine similarities"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors):
+    """int8 codes and per-row scales for float vectors; code . query * scale approximates vector . query"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def assign(vectors, centroids, chunk=65536):
+    """Nearest centroid (by inner product) for each row, in chunks to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        assignments[start:start + chunk] = (block @ centroids.T).argmax(axis=1)
+    return assignments
+
+
+def train_centroids(vectors, n_lists, seed=0):
+    """Spherical k-means on a sample of the (normalised) vectors"""
+    rng = np.random.default_rng(seed)
+    sample_rows = rng.choice(len(vectors), size=min(len(vectors), KMEANS_SAMPLE), replace=False)
+    sample = np.asarray(vectors[np.sort(sample_rows)], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        labels = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Re-seed empty lists from random sample points
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Append-only float16 embedding index with an inverted-file quantizer"""
+
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # The embedding width is recorded on first use, so tools can open an index without a model
+        dim_path = os.path.join(directory, 'dim')
+        if dim is None:
+            with open(dim_path) as f:
+                dim = int(f.read())
+        elif not os.path.exists(dim_path):
+            with open(dim_path, 'w') as f:
+                f.write(str(dim))
+        self.dim = dim
+        self.row_bytes = dim * 2
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.lists_path = os.path.join(directory, 'lists.i32')
+        self.quantizer_path = os.path.join(directory, 'quantizer.npz')
+        self.lock_path = os.path.join(directory, '.lock')
+
+        self.count = 0
+        self.centroids = None
+        self.trained_count = 0
+        self._quantizer_mtime = None
+        # Inverted lists: list id -> (row ids, int8 codes, scales)
+        self._lists = {}
+        self._lock = threading.RLock()
+        self._retraining = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _cases(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, 'cases.sqlite'), timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(CASES_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _disk_count(self):
+        """Rows fully written by any process (lists are appended after vectors)"""
+        try:
+            return min(os.path.getsize(self.vectors_path) // self.row_bytes, os.path.getsize(self.lists_path) // 4)
+        except FileNotFoundError:
+            return 0
+
+    def _quantizer_changed(self):
+        try:
+            mtime = os.stat(self.quantizer_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        return mtime != self._quantizer_mtime
+
+    def refresh(self):
+        """Pick up rows and retrained quantizers written by other processes"""
+        if self._disk_count() == self.count and not self._quantizer_changed():
+            return
+        with self._file_lock(exclusive=False):
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        with self._lock:
+            if self._quantizer_changed():
+                # A new quantizer reassigns every row, so reload everything
+                self._load_quantizer()
+                self._lists, self.count = {}, 0
+            disk_count = self._disk_count()
+            if disk_count <= self.count:
+                return
+            vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(disk_count, self.dim))
+            list_ids = np.fromfile(self.lists_path, dtype=np.int32, count=disk_count)
+            self._add_to_lists(np.arange(self.count, disk_count), list_ids[self.count:],
+                               np.asarray(vectors[self.count:disk_count]))
+            self.count = disk_count
+            del vectors
+
+    def _load_quantizer(self):
+        try:
+            with np.load(self.quantizer_path) as quantizer:
+                self.centroids = quantizer['centroids']
+                self.trained_count = int(quantizer['trained_count'])
+            self._quantizer_mtime = os.stat(self.quantizer_path).st_mtime_ns
+        except FileNotFoundError:
+            self.centroids, self.trained_count, self._quantizer_mtime = None, 0, None
+
+    def _add_to_lists(self, rows, list_ids, vectors):
+        codes, scales = quantize(vectors)
+        order = np.argsort(list_ids, kind='stable')
+        boundaries = np.flatnonzero(np.diff(list_ids[order])) + 1
+        for group in np.split(order, boundaries):
+            if len(group) == 0:
+                continue
+            list_id = int(list_ids[group[0]])
+            existing = self._lists.get(list_id)
+            if existing is None:
+                self._lists[list_id] = (rows[group], codes[group], scales[group])
+            else:
+                self._lists[list_id] = (np.concatenate([existing[0], rows[group]]),
+                                        np.concatenate([existing[1], codes[group]]),
+                                        np.concatenate([existing[2], scales[group]]))
+
+    def add(self, embedding, image_sha256=None, upload=None, predicted_class=None, confidence=None):
+        """
+        Append one embedding with its case details; returns its row id, or None when the
+        same image is already indexed
+        """
+        vector = normalize(embedding).astype(np.float16)
+        with metrics.STAGE_SECONDS.time(stage='similar_insert'):
+            with self._file_lock(exclusive=True):
+                cases = self._cases()
+                if image_sha256 and cases.execute('SELECT 1 FROM cases WHERE image_sha256 = ?',
+                                                  (image_sha256,)).fetchone():
+                    return None
+                self._refresh_locked()
+                with self._lock:
+                    row = self.count
+                    list_id = 0 if self.centroids is None else int(assign(vector, self.centroids)[0])
+                    with open(self.vectors_path, 'ab') as f:
+                        f.write(vector.tobytes())
+                    with open(self.lists_path, 'ab') as f:
+                        f.write(np.int32(list_id).tobytes())
+                    with cases:
+                        cases.execute('INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?)',
+                                      (row, image_sha256, upload, predicted_class,
+                                       None if confidence is None else float(confidence), time.time()))
+                    self._add_to_lists(np.array([row]), np.array([list_id]), vector)
+                    self.count += 1
+        metrics.SIMILAR_INDEX_SIZE.set(self.count)
+
+        grown = self.count >= INDEX_TRAIN_MIN and self.count >= max(self.trained_count, 1) * RETRAIN_GROWTH
+        if grown and not self._retraining.locked():
+            threading.Thread(target=self.retrain, daemon=True).start()
+        return row
+
+    def nearest(self, embedding, k, nprobe=NPROBE):
+        """Row ids and cosine similarities of the k nearest indexed embeddings, best first"""
+        query = normalize(embedding)[0]
+        with self._lock:
+            if self.centroids is None:
+                probes = list(self._lists)
+            else:
+                nprobe = min(nprobe, len(self.centroids))
+                probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = [self._lists[int(p)] for p in probes if int(p) in self._lists]
+        if not candidates:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate([c[0] for c in candidates])
+        # numpy widens int8 several times faster than float16, so the scan runs on the codes
+        similarities = np.concatenate([(c[1].astype(np.float32) @ query) * c[2] for c in candidates])
+        k = min(k, len(rows))
+        best = np.argpartition(-similarities, k - 1)[:k]
+        best = best[np.argsort(-similarities[best])]
+        return rows[best], similarities[best]
+
+    def search(self, embedding, k=SIMILAR_K, nprobe=NPROBE, exclude_sha256=None):
+        """
+        The k most similar indexed cases, best first:
+        [{'similarity', 'image_sha256', 'upload', 'predicted_class', 'confidence', 'created_at'}]
+        """
+        with metrics.STAGE_SECONDS.time(stage='similar_search'):
+            self.refresh()
+            # One extra in case the query image itself is indexed
+            rows, similarities = self.nearest(embedding, k + 1, nprobe)
+            if len(rows) == 0:
+                return []
+            cases = {row[0]: row[1:] for row in self._cases().execute(
+                "SELECT id, image_sha256, upload, predicted_class, confidence, created_at FROM cases "
+                f"WHERE id IN ({', '.join('?' * len(rows))})",
+                [int(row) for row in rows]
+            )}
+        results = []
+        for row, similarity in zip(rows, similarities):
+            case = cases.get(int(row))
+            if case is None or (exclude_sha256 and case[0] == exclude_sha256):
+                continue
+            results.append({
+                'similarity': round(float(similarity), 4),
+                'image_sha256': case[0],
+                'upload': case[1],
+                'predicted_class': case[2],
+                'confidence': case[3],
+                'created_at': case[4],
+            })
+        return results[:k]
+
+    def retrain(self):
+        """Train a new quantizer on a snapshot and reassign every row"""
+        if not self._retraining.acquire(blocking=False):
+            return False
+        try:
+            start = time.perf_counter()
+            snapshot = self._disk_count()
+            if snapshot < INDEX_TRAIN_MIN:
+                return False
+            # The expensive part runs without the file lock, so inserts continue meanwhile
+            vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(snapshot, self.dim))
+            n_lists = max(1, int(LISTS_PER_SQRT * np.sqrt(snapshot)))
+            centroids = train_centroids(vectors, n_lists)
+            list_ids = assign(vectors, centroids)
+            del vectors
+
+            with self._file_lock(exclusive=True):
+                # Rows appended while training are assigned under the lock
+                total = self._disk_count()
+                if total > snapshot:
+                    tail = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(total, self.dim))
+                    list_ids = np.concatenate([list_ids, assign(tail[snapshot:], centroids)])
+                    del tail
+                list_ids.astype(np.int32).tofile(self.lists_path + '.tmp')
+                os.replace(self.lists_path + '.tmp', self.lists_path)
+                with open(self.quantizer_path + '.tmp', 'wb') as f:
+                    np.savez(f, centroids=centroids.astype(np.float32), trained_count=total)
+                os.replace(self.quantizer_path + '.tmp', self.quantizer_path)
+                self._refresh_locked()
+            print(f"Similar-case index: trained {n_lists} lists on {total} entries in {time.perf_counter() - start:.1f} s")
+            return True
+        finally:
+            self._retraining.release()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_similarity_index(model_version, dim, root=None):
+    """Return the process-wide index for a model version, or None when retrieval is off"""
+    if not ENABLED or not model_version:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(model_version)
+        if index is None:
+            # Only the serving version's index is kept in memory
+            _indexes.clear()
+            index = _indexes[model_version] = EmbeddingIndex(os.path.join(root or DEFAULT_INDEX_DIR, model_version), dim)
+        return index
+
+
+def bench(count, dim, queries=200, nprobe=NPROBE):
+    """Search latency and recall@10 on synthetic clustered vectors"""
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        index = EmbeddingIndex(directory, dim)
+        centres = normalize(rng.standard_normal((256, dim)))
+        with open(index.vectors_path, 'ab') as vectors_file, open(index.lists_path, 'ab') as lists_file:
+            for start in range(0, count, 100000):
+                n = min(100000, count - start)
+                block = normalize(centres[rng.integers(0, len(centres), n)] + rng.standard_normal((n, dim)) / np.sqrt(dim))
+                vectors_file.write(block.astype(np.float16).tobytes())
+                lists_file.write(np.zeros(n, dtype=np.int32).tobytes())
+        index.retrain()
+        vectors = np.fromfile(index.vectors_path, dtype=np.float16).reshape(count, dim)
+
+        timings, recall = [], []
+        for row in rng.integers(0, count, queries):
+            query = vectors[row].astype(np.float32) + 0.5 * rng.standard_normal(dim) / np.sqrt(dim)
+            start = time.perf_counter()
+            found, _ = index.nearest(query, 10, nprobe)
+            timings.append((time.perf_counter() - start) * 1000)
+            if len(recall) < 20:
+                exact = np.argpartition(-(vectors.astype(np.float32) @ normalize(query)[0]), 9)[:10]
+                recall.append(len(set(exact) & set(found)) / 10)
+        print(f"{count} entries in {len(index.centroids)} lists, nprobe {nprobe}: "
+              f"p50 {np.percentile(timings, 50):.2f} ms, p99 {np.percentile(timings, 99):.2f} ms, "
+              f"recall@10 {np.mean(recall):.2f}, {count * dim * 2 / 1e6:.0f} MB on disk, "
+              f"{count * (dim + 4) / 1e6:.0f} MB in memory")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the similar-case embedding index')
+    parser.add_argument('--dir', default=DEFAULT_INDEX_DIR, help='Index root')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Entries and lists per model version')
+    rebuild_parser = subparsers.add_parser('rebuild', help='Retrain the quantizer now')
+    rebuild_parser.add_argument('--version', default=None, help='Model version (default: every version)')
+    bench_parser = subparsers.add_parser('bench', help='Search latency on synthetic vectors')
+    bench_parser.add_argument('--count', type=int, default=1000000)
+    bench_parser.add_argument('--dim', type=int, default=256)
+    bench_parser.add_argument('--nprobe', type=int, default=NPROBE)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        bench(args.count, args.dim, nprobe=args.nprobe)
+        return
+    versions = sorted(os.listdir(args.dir)) if os.path.isdir(args.dir) else []
+    if args.command == 'rebuild' and args.version:
+        versions = [args.version]
+    if not versions:
+        print(f"No similar-case index at '{args.dir}'.")
+    for version in versions:
+        index = EmbeddingIndex(os.path.join(args.dir, version))
+        if args.command == 'rebuild' and not index.retrain():
+            print(f"{version}: fewer than {INDEX_TRAIN_MIN} entries, exhaustive search needs no training")
+        index.refresh()
+        search = f"{len(index.centroids)} lists" if index.centroids is not None else 'exhaustive search'
+        print(f"{version}: {index.count} entries, {search}, {index.count * index.row_bytes / 1e6:.1f} MB on disk")
+
+
+if __name__ == "__main__":
+    main()
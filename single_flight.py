@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Coalescing for Plant Disease Detection System
+Collapses concurrent identical work into one computation: while a prediction for an
+image hash, or an explanation for a class, is in flight, duplicate requests wait for
+its result instead of starting their own model pass or OpenAI call. This is what keeps
+a burst of uploads of the same photo, or the rush of requests after a model reload
+empties the caches, down to one call per key.
+
+Within a process, the first caller for a key runs the work and the others wait on it.
+Across worker processes, the running caller holds an flock()ed lock file for the key
+and publishes its outcome next to it; a caller in another process that was waiting on
+the lock picks that outcome up instead of recomputing, and a failure is re-raised
+rather than retried by each waiter in turn. Result files only bridge the hand-off, so
+they are removed after RESULT_TTL seconds. Nobody waits longer than SINGLE_FLIGHT_WAIT:
+a caller whose leader is still running after that computes the result itself, so a
+slow or stuck leader cannot pin other request threads past the admission budget.
+
+Results are unpickled, so the directory is only used when it is a real directory owned
+by this user with no group or other access; otherwise calls are coalesced within each
+process only.
+
+Settings are read from the environment:
+    SINGLE_FLIGHT        set to 0 to run every call independently
+    SINGLE_FLIGHT_DIR    lock and result directory shared by worker processes; empty
+                         coalesces within each process only (default: a per-user temp dir)
+    SINGLE_FLIGHT_WAIT   longest wait for a duplicate in flight, in seconds (default 2)
+"""
+
+import os
+import stat
+import time
+import fcntl
+import pickle
+import hashlib
+import tempfile
+import threading
+import metrics
+
+ENABLED = os.getenv('SINGLE_FLIGHT', '1') != '0'
+DEFAULT_DIR = os.getenv('SINGLE_FLIGHT_DIR', os.path.join(tempfile.gettempdir(), f'leafdoctor-single-flight-{os.getuid()}'))
+WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT', '2'))
+# Seconds a published result stays available to callers in other processes
+RESULT_TTL = 30
+# Interval between attempts to take a lock held by another process
+LOCK_POLL_INTERVAL = 0.02
+
+
+class LeaderFailedError(RuntimeError):
+    """The call this one was coalesced with failed with an error that could not be shared as is"""
+
+
+class _Call:
+    """One in-flight computation and its outcome"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time, sharing its result with duplicates"""
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory or None
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        if self.directory and not self._private_directory(self.directory):
+            print(f"Warning: {self.directory} is not a private directory; coalescing within this process only")
+            self.directory = None
+
+    @staticmethod
+    def _private_directory(directory):
+        """Create directory if needed; True if it is a non-symlink directory only this user can access"""
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # makedirs leaves an existing directory as it is, so check what is actually there
+            info = os.lstat(directory)
+        except OSError:
+            return False
+        return (stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+                and not info.st_mode & (stat.S_IRWXG | stat.S_IRWXO))
+
+    def do(self, kind, key, fn):
+        """
+        Return fn() for key, or the result of an identical call already in flight
+        kind ('predict', 'explanation', ...) labels metrics; exceptions reach every waiter.
+        A caller that has waited WAIT_TIMEOUT for a duplicate runs fn() itself
+        """
+        if not ENABLED:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(WAIT_TIMEOUT):
+                metrics.SINGLE_FLIGHT.inc(kind=kind, result='wait_timeout')
+                return self._lead(kind, fn)
+            metrics.SINGLE_FLIGHT.inc(kind=kind, result='shared')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(kind, key, fn) if self.directory else self._lead(kind, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _lead(self, kind, fn):
+        metrics.SINGLE_FLIGHT.inc(kind=kind, result='computed')
+        return fn()
+
+    def _run(self, kind, key, fn):
+        """Coalesce with other processes through a lock file and a published outcome"""
+        name = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.directory, f"{name}.lock")
+        result_path = os.path.join(self.directory, f"{name}.result")
+        waiting_since = time.time()
+        lock_file = self._lock_file(lock_path, waiting_since + WAIT_TIMEOUT)
+        if lock_file is None:
+            # The process holding the lock is slow or stuck; do not wait on it any longer
+            metrics.SINGLE_FLIGHT.inc(kind=kind, result='wait_timeout')
+            return self._lead(kind, fn)
+        try:
+            # An outcome published after we started waiting came from a concurrent duplicate
+            outcome = self._read_outcome(result_path, waiting_since)
+            if outcome is not None:
+                metrics.SINGLE_FLIGHT.inc(kind=kind, result='shared_process')
+                succeeded, value = outcome
+                if succeeded:
+                    return value
+                raise value
+            try:
+                result = self._lead(kind, fn)
+            except Exception as e:
+                # Waiters re-raise the failure instead of each retrying it in turn
+                self._publish(result_path, (False, e), (False, LeaderFailedError(f"{type(e).__name__}: {e}")))
+                raise
+            self._publish(result_path, (True, result))
+            return result
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            self._sweep()
+
+    @staticmethod
+    def _read_outcome(result_path, since):
+        """(succeeded, result or exception) published at or after since, or None"""
+        try:
+            fd = os.open(result_path, os.O_RDONLY | os.O_NOFOLLOW)
+            with os.fdopen(fd, 'rb') as f:
+                info = os.fstat(f.fileno())
+                if info.st_uid == os.getuid() and info.st_mtime >= since:
+                    return pickle.load(f)
+        except Exception:
+            # Missing, partly written or not reconstructible: compute instead
+            pass
+        return None
+
+    @staticmethod
+    def _publish(result_path, outcome, fallback=None):
+        """Write an outcome for waiting processes; fallback is written if outcome cannot be pickled"""
+        try:
+            try:
+                data = pickle.dumps(outcome, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                if fallback is None:
+                    raise
+                data = pickle.dumps(fallback, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(result_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(result_path + '.tmp', result_path)
+        except Exception as e:
+            print(f"Warning: could not publish single-flight result: {e}")
+
+    @staticmethod
+    def _lock_file(lock_path, deadline):
+        """
+        Open and exclusively lock the key's lock file, reopening if a sweep removed it
+        meanwhile. Returns None if the lock is still held by someone else at deadline
+        """
+        while True:
+            lock_file = open(lock_path, 'a')
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() >= deadline:
+                        lock_file.close()
+                        return None
+                    time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def _sweep(self):
+        """
+        Remove result files older than RESULT_TTL, and lock files nobody holds or waits on,
+        at most once per RESULT_TTL
+        """
+        now = time.time()
+        if now - self._last_sweep < RESULT_TTL:
+            return
+        self._last_sweep = now
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime <= RESULT_TTL:
+                            continue
+                        if entry.name.endswith('.lock'):
+                            self._remove_idle_lock(entry.path)
+                        else:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove_idle_lock(lock_path):
+        """Unlink a lock file only while holding it; waiters on the old file notice and reopen"""
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            os.remove(lock_path)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide single-flight group"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SingleFlight()
+    return _shared
@@ -6,17 +6,22 @@ Streamlit Web Interface for Plant Disease Detection System
 import streamlit as st
 import os
 import numpy as np
-import cv2
 from PIL import Image
 import tensorflow as tf
 from tensorflow import keras
 import matplotlib.pyplot as plt
-import openai
 import json
 from io import BytesIO
 import base64
+import hashlib
 from dotenv import load_dotenv
 load_dotenv()
+from llm_client import get_llm_client
+from advice_kb import get_advice_kb
+import preprocessing
+import calibration
+from model_registry import ModelRegistry, CALIBRATION_FILENAME
+from prediction_history import get_prediction_history
 
 # Configure Streamlit page
 st.set_page_config(
@@ -26,10 +31,10 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Set up OpenAI client
+# Set up shared, pooled OpenAI client
 @st.cache_resource
 def get_openai_client():
-    return openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return get_llm_client()
 
 client = get_openai_client()
 
@@ -38,15 +43,29 @@ class StreamlitPlantDetector:
         self.model = None
         self.class_names = []
         self.img_size = (128, 128)
+        self.model_version = None
+        self.leaf_crop = False
+        self.temperature = 1.0
         
-    @st.cache_resource
-    def load_model(_self, model_path='leafdoctor_model.h5', class_names_path='class_names.json'):
+    # Cached per model version; only the latest version is kept in memory
+    @st.cache_resource(max_entries=1)
+    def load_model(_self, model_path='leafdoctor_model.h5', class_names_path='class_names.json', model_version=None):
         """Load a pre-trained model"""
         if os.path.exists(model_path) and os.path.exists(class_names_path):
             try:
                 _self.model = keras.models.load_model(model_path)
                 with open(class_names_path, 'r') as f:
                     _self.class_names = json.load(f)
+                # Use the leaf crop and confidence temperature fitted with the model, as the
+                # Flask app does; unrecorded means whole photos and uncalibrated confidence
+                calibration_path = os.path.join(os.path.dirname(model_path) or '.', CALIBRATION_FILENAME)
+                config = {}
+                if os.path.exists(calibration_path):
+                    with open(calibration_path, 'r') as f:
+                        config = json.load(f)
+                _self.leaf_crop = config.get('leaf_crop', False)
+                _self.temperature = config.get('temperature', 1.0)
+                _self.model_version = model_version
                 return True
             except Exception as e:
                 st.error(f"Error loading model: {e}")
@@ -56,19 +75,14 @@ class StreamlitPlantDetector:
     def preprocess_image(self, image):
         """Preprocess PIL image for prediction"""
         try:
-            # Convert PIL to numpy array
-            img_array = np.array(image)
+            # Palette, CMYK and other modes are normalised to RGBA first
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA')
             
-            # Resize to model input size
-            img_resized = cv2.resize(img_array, self.img_size)
-            
-            # Normalize
-            img_normalized = img_resized.astype('float32') / 255.0
-            
-            # Add batch dimension
-            img_batch = np.expand_dims(img_normalized, axis=0)
-            
-            return img_batch
+            # Convert PIL to an RGB array (handles grayscale and alpha) and share
+            # the training/serving preprocessing path
+            img_array = preprocessing.to_rgb(np.array(image))
+            return preprocessing.preprocess_array(img_array, self.img_size, crop=self.leaf_crop)
         except Exception as e:
             st.error(f"Error preprocessing image: {e}")
             return None
@@ -86,7 +100,7 @@ class StreamlitPlantDetector:
         
         # Make prediction
         with st.spinner("Analyzing image..."):
-            predictions = self.model.predict(processed_img, verbose=0)
+            predictions = calibration.apply_temperature(self.model.predict(processed_img, verbose=0), self.temperature)
             predicted_class_idx = np.argmax(predictions[0])
             confidence = np.max(predictions[0])
         
@@ -99,37 +113,64 @@ class StreamlitPlantDetector:
             'all_predictions': predictions[0]
         }
     
+    def _explanation_messages(self, predicted_class):
+        """Build the chat messages used to request expert advice"""
+        prompt = f"""Explain what {predicted_class} is and how to treat it in organic and non-organic ways. 
+        Provide step-by-step advice for a smallholder farmer. Include:
+        
+        1. What is this disease/condition?
+        2. What causes it?
+        3. Organic treatment methods
+        4. Non-organic treatment methods
+        5. Prevention strategies
+        6. When to seek professional help
+        
+        Please provide practical, actionable advice that a farmer can implement."""
+        
+        return [
+            {"role": "system", "content": "You are an expert agricultural extension officer helping smallholder farmers."},
+            {"role": "user", "content": prompt}
+        ]
+    
     def get_gpt_explanation(self, predicted_class):
-        """Get farmer-friendly explanation from GPT-4"""
+        """Get farmer-friendly explanation from the offline knowledge base or GPT-4"""
+        stored_advice = get_advice_kb().lookup(predicted_class)
+        if stored_advice:
+            return stored_advice
+        
         try:
             with st.spinner("Getting expert advice..."):
-                prompt = f"""Explain what {predicted_class} is and how to treat it in organic and non-organic ways. 
-                Provide step-by-step advice for a smallholder farmer. Include:
-                
-                1. What is this disease/condition?
-                2. What causes it?
-                3. Organic treatment methods
-                4. Non-organic treatment methods
-                5. Prevention strategies
-                6. When to seek professional help
-                
-                Please provide practical, actionable advice that a farmer can implement."""
-                
-                response = client.chat.completions.create(
+                return client.chat(
                     model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "You are an expert agricultural extension officer helping smallholder farmers."},
-                        {"role": "user", "content": prompt}
-                    ],
+                    messages=self._explanation_messages(predicted_class),
+                    cache_key=('explanation', self.model_version, predicted_class),
                     max_tokens=1000,
                     temperature=0.7
                 )
                 
-                return response.choices[0].message.content
-                
         except Exception as e:
             st.error(f"Error getting expert advice: {e}")
             return f"Unable to get detailed explanation for {predicted_class}. Please consult with a local agricultural extension officer."
+    
+    def stream_gpt_explanation(self, predicted_class):
+        """Stream farmer-friendly explanation from GPT-4 for use with st.write_stream"""
+        stored_advice = get_advice_kb().lookup(predicted_class)
+        if stored_advice:
+            yield stored_advice
+            return
+        
+        try:
+            yield from client.stream_chat(
+                model="gpt-4o",
+                messages=self._explanation_messages(predicted_class),
+                cache_key=('explanation', self.model_version, predicted_class),
+                max_tokens=1000,
+                temperature=0.7
+            )
+                    
+        except Exception as e:
+            st.error(f"Error getting expert advice: {e}")
+            yield f"Unable to get detailed explanation for {predicted_class}. Please consult with a local agricultural extension officer."
 
 # Initialize detector
 @st.cache_resource
@@ -138,6 +179,22 @@ def get_detector():
 
 detector = get_detector()
 
+def record_prediction(uploaded_file, prediction_result):
+    """Add a diagnosis to the prediction history once per upload, not on every rerun"""
+    history = get_prediction_history()
+    if history is None:
+        return
+    image_sha256 = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    if st.session_state.get('recorded_upload') == image_sha256:
+        return
+    st.session_state['recorded_upload'] = image_sha256
+    top_indices = np.argsort(prediction_result['all_predictions'])[-3:][::-1]
+    history.record(
+        'streamlit', prediction_result['predicted_class'], prediction_result['confidence'],
+        image_sha256=image_sha256, model_version=detector.model_version,
+        details={'top': [[detector.class_names[i], float(prediction_result['all_predictions'][i])] for i in top_indices]},
+    )
+
 # Main app
 def main():
     st.title("🌱 Plant Disease Detection System")
@@ -156,8 +213,9 @@ def main():
     st.sidebar.markdown("**Supported formats:** JPG, JPEG, PNG")
     st.sidebar.markdown("**Max file size:** 200MB")
     
-    # Check if model is loaded
-    model_loaded = detector.load_model()
+    # Check if model is loaded; a newly published model version is loaded on the next rerun
+    resolved = ModelRegistry().resolve()
+    model_loaded = resolved is not None and detector.load_model(resolved[1], resolved[2], model_version=resolved[0])
     
     if not model_loaded:
         st.warning("⚠️ No pre-trained model found. Please train the model first.")
@@ -192,7 +250,7 @@ def main():
                 # Get OpenAI analysis
                 try:
                     with st.spinner("Analyzing with AI..."):
-                        response = client.chat.completions.create(
+                        ai_analysis = client.chat(
                             model="gpt-4o",
                             messages=[
                                 {
@@ -213,16 +271,14 @@ def main():
                             ],
                             max_tokens=500,
                         )
-                    
-                    ai_analysis = response.choices[0].message.content
+
                     st.success("✅ Analysis Complete")
                     st.write("**AI Analysis:**")
                     st.write(ai_analysis)
                     
-                    # Get treatment advice
-                    treatment_advice = detector.get_gpt_explanation(ai_analysis.split('\n')[0])
+                    # Stream treatment advice as it is generated
                     st.write("**Treatment Advice:**")
-                    st.write(treatment_advice)
+                    st.write_stream(detector.stream_gpt_explanation(ai_analysis.split('\n')[0]))
                     
                 except Exception as e:
                     st.error(f"Error analyzing image: {e}")
@@ -253,6 +309,8 @@ def main():
             prediction_result = detector.predict_disease(image)
             
             if prediction_result:
+                record_prediction(uploaded_file, prediction_result)
+                
                 # Display prediction
                 st.metric("Predicted Disease", prediction_result['predicted_class'])
                 st.metric("Confidence", f"{prediction_result['confidence']:.2%}")
@@ -285,12 +343,11 @@ def main():
             st.markdown("---")
             st.subheader("🌾 Expert Agricultural Advice")
             
-            # Get GPT explanation
-            explanation = detector.get_gpt_explanation(prediction_result['predicted_class'])
-            
-            # Display in expandable sections
+            # Stream GPT explanation into an expandable section as it arrives
             with st.expander("📖 Disease Information & Treatment", expanded=True):
-                st.write(explanation)
+                explanation = st.write_stream(
+                    detector.stream_gpt_explanation(prediction_result['predicted_class'])
+                )
             
             # Download results
             st.markdown("---")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Local stub of the OpenAI chat completions API
+Answers POST /v1/chat/completions with canned advice (plain or streamed) after a
+configurable delay, so the LLM client, the web apps and the benchmarks can run
+without network access or API cost.
+
+Usage:
+    python stub_openai_server.py --port 8089 --delay 0.5
+    export OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub
+"""
+
+import json
+import time
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_ADVICE = (
+    "1. What is this disease/condition? A common leaf disease.\n"
+    "2. What causes it? A fungal or bacterial pathogen favoured by humid weather.\n"
+    "3. Organic treatment methods: remove infected leaves and apply copper-based sprays.\n"
+    "4. Non-organic treatment methods: apply a registered fungicide as labelled.\n"
+    "5. Prevention strategies: rotate crops, space plants and water at the soil line.\n"
+    "6. When to seek professional help: if symptoms spread after two weeks of treatment."
+)
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Minimal chat completions endpoint"""
+
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    failure_rate = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        count = self.server.count_request()
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        time.sleep(self.delay)
+
+        # Fail every Nth request deterministically when a failure rate is set
+        if self.failure_rate and count % max(1, round(1 / self.failure_rate)) == 0:
+            self._send_json(500, {'error': {'message': 'Stub failure', 'type': 'server_error'}})
+            return
+
+        model = body.get('model', 'gpt-4o')
+        if body.get('stream'):
+            self._send_stream(model)
+        else:
+            self._send_json(200, {
+                'id': f'chatcmpl-stub-{count}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': STUB_ADVICE},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, model):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for word in STUB_ADVICE.split(' '):
+            chunk = {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server that numbers the requests it receives"""
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler):
+        super().__init__(server_address, handler)
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+    def count_request(self):
+        """Count one request and return its number on this server"""
+        with self._count_lock:
+            self.request_count += 1
+            return self.request_count
+
+
+def start_stub_server(host='127.0.0.1', port=0, delay=0.0, failure_rate=0.0):
+    """Start the stub in a background thread and return (server, base_url)"""
+    handler = type('ConfiguredStubHandler', (StubOpenAIHandler,), {
+        'delay': delay,
+        'failure_rate': failure_rate,
+    })
+    server = StubServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the OpenAI chat completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before answering')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 500')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.host, args.port, args.delay, args.failure_rate)
+    print(f"Stub OpenAI server listening on {base_url}")
+    print(f"export OPENAI_BASE_URL={base_url} OPENAI_API_KEY=stub")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
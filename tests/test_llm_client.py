@@ -0,0 +1,134 @@
+"""
+LLM client retries and circuit breaker, driven against the local stub OpenAI server
+
+Run with: python -m pytest tests
+"""
+
+import time
+import threading
+
+import pytest
+
+from llm_client import LLMClient, LLMUnavailableError
+from stub_openai_server import STUB_ADVICE, StubOpenAIHandler, start_stub_server
+
+MESSAGES = [{'role': 'user', 'content': 'Explain leaf blight'}]
+
+
+class BadRequestHandler(StubOpenAIHandler):
+    """Rejects every request as malformed (HTTP 400)"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.count_request()
+        self._send_json(400, {'error': {'message': 'Bad request', 'type': 'invalid_request_error'}})
+
+
+@pytest.fixture
+def stub():
+    server, base_url = start_stub_server()
+    yield server, base_url
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(base_url, **settings):
+    settings = dict(dict(api_key='stub', max_retries=0, retry_backoff=0.0, failure_threshold=2,
+                         reset_timeout=30.0, queue_timeout=5.0), **settings)
+    return LLMClient(base_url=base_url, **settings)
+
+
+def set_failure_rate(server, rate):
+    server.RequestHandlerClass.failure_rate = rate
+
+
+def test_server_error_is_retried(stub):
+    server, base_url = stub
+    # Every second request fails: the first call succeeds, the second needs one retry
+    set_failure_rate(server, 0.5)
+    client = make_client(base_url, max_retries=2)
+    start = server.request_count
+
+    assert client.chat(MESSAGES) == STUB_ADVICE
+    assert client.chat(MESSAGES) == STUB_ADVICE
+    assert server.request_count - start == 3
+    assert client.breaker.state == 'closed'
+
+
+def test_breaker_opens_and_serves_cached_answer(stub):
+    server, base_url = stub
+    client = make_client(base_url)
+    assert client.chat(MESSAGES, cache_key='blight') == STUB_ADVICE
+
+    set_failure_rate(server, 1.0)
+    for _ in range(2):
+        assert client.chat(MESSAGES, cache_key='blight') == STUB_ADVICE
+    assert client.breaker.state == 'open'
+
+    # While open, the API is not called at all
+    before = server.request_count
+    assert client.chat(MESSAGES, cache_key='blight') == STUB_ADVICE
+    with pytest.raises(LLMUnavailableError):
+        client.chat(MESSAGES, cache_key='other')
+    assert server.request_count == before
+
+
+def test_half_open_lets_one_probe_through(stub):
+    server, base_url = stub
+    client = make_client(base_url, reset_timeout=0.2)
+    set_failure_rate(server, 1.0)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            client.chat(MESSAGES)
+    assert client.breaker.state == 'open'
+
+    # The API has recovered but is slow; concurrent callers arrive after the cool-down
+    set_failure_rate(server, 0.0)
+    server.RequestHandlerClass.delay = 0.5
+    time.sleep(0.25)
+    before = server.request_count
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(client.chat(MESSAGES))
+        except LLMUnavailableError:
+            outcomes.append(None)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.request_count - before == 1
+    assert outcomes.count(STUB_ADVICE) == 1
+    assert client.breaker.state == 'closed'
+
+
+def test_failed_probe_reopens_breaker(stub):
+    server, base_url = stub
+    client = make_client(base_url, reset_timeout=0.2)
+    set_failure_rate(server, 1.0)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            client.chat(MESSAGES)
+
+    time.sleep(0.25)
+    with pytest.raises(LLMUnavailableError):
+        client.chat(MESSAGES)
+    assert client.breaker.state == 'open'
+
+
+def test_bad_requests_do_not_open_breaker(stub):
+    server, base_url = stub
+    server.RequestHandlerClass = BadRequestHandler
+    client = make_client(base_url, failure_threshold=1, max_retries=2)
+    before = server.request_count
+
+    for _ in range(3):
+        with pytest.raises(LLMUnavailableError):
+            client.chat(MESSAGES)
+    # Not retried, and the API is still treated as up
+    assert server.request_count - before == 3
+    assert client.breaker.state == 'closed'
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tiled Field Analysis for Plant Disease Detection System
+Classifies high-resolution multi-leaf images (drone and tripod captures) tile by tile
+instead of squashing the whole frame into one 128x128 input. The image is cut into
+overlapping tiles, tiles that are mostly background are skipped with the vegetation
+mask, and the rest are classified in fixed-size batches. The result is a per-tile
+disease map plus counts per class.
+
+.npy captures (HxWx3 uint8) are memory-mapped and read one tile at a time, so their
+memory is bounded by the batch. Other formats have to be decoded into memory: JPEGs at
+the 1/2, 1/4 or 1/8 scale the tiles need, PNGs at full resolution. The decoded size is
+worked out from the file header first, and images that would decode to more than
+TILE_MAX_PIXELS are rejected before any pixels are read, so peak memory stays under a
+few bytes per TILE_MAX_PIXELS pixel plus the batch. The tile side is clamped between the
+model input and TILE_MAX_SIZE, and grids of more than TILE_MAX_TILES tiles are rejected,
+so the per-tile results and the time spent classifying stay bounded too.
+
+Settings are read from the environment:
+    TILE_SIZE              tile side in source pixels (default 512)
+    TILE_OVERLAP           fraction of a tile shared with its neighbour (default 0.25)
+    TILE_BATCH_SIZE        tiles per forward pass (default 64)
+    TILE_MIN_VEGETATION    tiles with less vegetation than this are background (default 0.08)
+    TILE_MAX_PIXELS        largest decoded image accepted, in pixels (default 40000000)
+    TILE_MAX_SIZE          largest tile side accepted, in pixels (default 4096)
+    TILE_MAX_TILES         largest tile grid accepted, rows x columns (default 4096)
+
+Usage:
+    python tiled_analysis.py field.jpg
+    python tiled_analysis.py capture.npy --tile-size 384 --overlay field_map.jpg
+"""
+
+import os
+import math
+import argparse
+import numpy as np
+import cv2
+from PIL import Image
+import preprocessing
+import metrics
+
+TILE_SIZE = int(os.getenv('TILE_SIZE', '512'))
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', '0.25'))
+TILE_BATCH_SIZE = int(os.getenv('TILE_BATCH_SIZE', '64'))
+TILE_MIN_VEGETATION = float(os.getenv('TILE_MIN_VEGETATION', '0.08'))
+TILE_MAX_PIXELS = int(os.getenv('TILE_MAX_PIXELS', '40000000'))
+TILE_MAX_SIZE = int(os.getenv('TILE_MAX_SIZE', '4096'))
+TILE_MAX_TILES = int(os.getenv('TILE_MAX_TILES', '4096'))
+# The background test runs on an area-averaged copy this size, so sensor noise at
+# full resolution does not read as vegetation
+MASK_SIZE = 32
+
+
+class ImageTooLargeError(ValueError):
+    """The image would decode to more pixels than TILE_MAX_PIXELS, or cut into more tiles than TILE_MAX_TILES"""
+
+
+def open_source(image_path, tile_size, model_size):
+    """
+    Open an image for tiling
+    Returns (pixels, scale): an HxWx3 uint8 array-like and the factor from its
+    coordinates back to the original image
+    Raises ImageTooLargeError, before decoding, when the decode would exceed TILE_MAX_PIXELS
+    """
+    if image_path.lower().endswith('.npy'):
+        pixels = np.load(image_path, mmap_mode='r')
+        if pixels.ndim != 3 or pixels.shape[2] < 3 or pixels.dtype != np.uint8:
+            raise ValueError(f"Expected an HxWx3 uint8 array in '{image_path}', got {pixels.shape} {pixels.dtype}")
+        return pixels, 1.0
+
+    with Image.open(image_path) as header:
+        width, height = header.size
+    # Ask for just enough resolution that each tile still covers the model input
+    short_side = min(width, height)
+    needed = max(1, math.ceil(short_side * model_size / tile_size))
+    factor = 1
+    if image_path.lower().endswith(preprocessing.JPEG_FORMATS):
+        factor = preprocessing.reduction_factor((width, height), (needed, needed))
+    decoded_pixels = math.ceil(width / factor) * math.ceil(height / factor)
+    if decoded_pixels > TILE_MAX_PIXELS:
+        raise ImageTooLargeError(f"Image is {width}x{height} and would decode to {decoded_pixels} pixels; "
+                                 f"the limit is {TILE_MAX_PIXELS}. Use a smaller image or a .npy capture.")
+    pixels = preprocessing.decode_image(image_path, min_size=(needed, needed))
+    return pixels, width / pixels.shape[1]
+
+
+def tile_origins(length, tile, stride):
+    """Tile start offsets along one axis; the last tile is aligned to the edge"""
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile + 1, stride))
+    if origins[-1] != length - tile:
+        origins.append(length - tile)
+    return origins
+
+
+def tile_size_range(detector):
+    """Accepted tile sides in source pixels: from the model input up to TILE_MAX_SIZE"""
+    return max(detector.img_size), max(TILE_MAX_SIZE, max(detector.img_size))
+
+
+def analyze_image(detector, image_path, tile_size=None, overlap=None, batch_size=None, min_vegetation=None):
+    """
+    Classify an image tile by tile
+    Returns {'image_size', 'tile_size', 'grid', 'tiles', 'class_map', 'counts',
+    'leaf_tiles', 'background_tiles', 'diseased_fraction'}; class_map holds the class
+    index of each tile, or None for background
+    Raises ImageTooLargeError when the image exceeds TILE_MAX_PIXELS or the grid TILE_MAX_TILES
+    """
+    min_tile, max_tile = tile_size_range(detector)
+    tile_size = min(max(tile_size or TILE_SIZE, min_tile), max_tile)
+    overlap = TILE_OVERLAP if overlap is None else overlap
+    batch_size = batch_size or TILE_BATCH_SIZE
+    min_vegetation = TILE_MIN_VEGETATION if min_vegetation is None else min_vegetation
+    model_width, model_height = detector.img_size
+
+    with metrics.STAGE_SECONDS.time(stage='tiled_analysis'):
+        pixels, scale = open_source(image_path, tile_size, max(model_width, model_height))
+        height, width = pixels.shape[:2]
+        # Tile geometry in source coordinates
+        tile = max(1, min(round(tile_size / scale), height, width))
+        stride = max(1, round(tile * (1 - overlap)))
+        rows, cols = tile_origins(height, tile, stride), tile_origins(width, tile, stride)
+        if len(rows) * len(cols) > TILE_MAX_TILES:
+            raise ImageTooLargeError(f"{len(rows)}x{len(cols)} tiles of {tile_size} px exceed the limit of "
+                                     f"{TILE_MAX_TILES} tiles. Use a larger tile size or less overlap.")
+
+        # One preallocated batch, reused for every forward pass
+        batch = np.empty((batch_size, model_height, model_width, 3), dtype=np.uint8)
+        batch_float = np.empty(batch.shape, dtype=np.float32)
+        pending = []
+        tiles = []
+        class_map = [[None] * len(cols) for _ in rows]
+
+        def flush():
+            preprocessing.normalize_batch(batch, out=batch_float)
+            # The batch is always full size so the model is traced for one shape only
+            probabilities = detector.classify_batch(batch_float)[:len(pending)]
+            for (row, col, box), tile_probabilities in zip(pending, probabilities):
+                class_index = int(tile_probabilities.argmax())
+                class_map[row][col] = class_index
+                tiles.append({
+                    'row': row,
+                    'col': col,
+                    'box': box,
+                    'class': detector.class_names[class_index],
+                    'confidence': float(tile_probabilities[class_index]),
+                })
+            metrics.TILES.inc(len(pending), result='classified')
+            pending.clear()
+
+        background = 0
+        for row, y in enumerate(rows):
+            for col, x in enumerate(cols):
+                window = np.asarray(pixels[y:y + tile, x:x + tile, :3])
+                thumb = cv2.resize(window, (MASK_SIZE, MASK_SIZE), interpolation=cv2.INTER_AREA)
+                if preprocessing.vegetation_mask(thumb).mean() < min_vegetation:
+                    background += 1
+                    continue
+                preprocessing.resize_into(window, batch[len(pending)])
+                box = [round(x * scale), round(y * scale), round((x + tile) * scale), round((y + tile) * scale)]
+                pending.append((row, col, box))
+                if len(pending) == batch_size:
+                    flush()
+        if pending:
+            flush()
+        metrics.TILES.inc(background, result='background')
+
+    counts = {}
+    for tile_result in tiles:
+        counts[tile_result['class']] = counts.get(tile_result['class'], 0) + 1
+    diseased = sum(n for name, n in counts.items() if 'healthy' not in name.lower())
+    return {
+        'image_size': [round(width * scale), round(height * scale)],
+        'tile_size': round(tile * scale),
+        'grid': [len(rows), len(cols)],
+        'tiles': tiles,
+        'class_map': class_map,
+        'counts': dict(sorted(counts.items(), key=lambda item: -item[1])),
+        'leaf_tiles': len(tiles),
+        'background_tiles': background,
+        'diseased_fraction': diseased / len(tiles) if tiles else 0.0,
+    }
+
+
+def draw_overlay(image_path, result, output_path, max_side=1600):
+    """Save a preview with healthy tiles outlined in green and diseased tiles in red"""
+    if image_path.lower().endswith('.npy'):
+        img = np.load(image_path, mmap_mode='r')
+    else:
+        img = preprocessing.decode_image(image_path, min_size=(max_side, max_side))
+    step = max(1, math.ceil(max(img.shape[:2]) / max_side))
+    preview = np.ascontiguousarray(img[::step, ::step, :3])
+    # Boxes are in original image coordinates
+    scale = preview.shape[1] / result['image_size'][0]
+    for tile_result in result['tiles']:
+        x0, y0, x1, y1 = (round(v * scale) for v in tile_result['box'])
+        colour = (0, 200, 0) if 'healthy' in tile_result['class'].lower() else (220, 0, 0)
+        cv2.rectangle(preview, (x0, y0), (x1 - 1, y1 - 1), colour, 2)
+    cv2.imwrite(output_path, cv2.cvtColor(preview, cv2.COLOR_RGB2BGR))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classify a high-resolution field image tile by tile')
+    parser.add_argument('image_path', help='JPEG/PNG image or HxWx3 uint8 .npy capture')
+    parser.add_argument('--model', default='leafdoctor_model.h5')
+    parser.add_argument('--class-names', default='class_names.json')
+    parser.add_argument('--tile-size', type=int, default=None, help=f'Tile side in pixels (default {TILE_SIZE})')
+    parser.add_argument('--overlap', type=float, default=None, help=f'Tile overlap fraction (default {TILE_OVERLAP})')
+    parser.add_argument('--overlay', default=None, help='Write a preview with tiles outlined to this path')
+    args = parser.parse_args()
+
+    from plant_disease_detection import PlantDiseaseDetector
+
+    detector = PlantDiseaseDetector()
+    if not detector.load_model(args.model, args.class_names):
+        print("Error: model or class names not found.")
+        return
+    result = analyze_image(detector, args.image_path, tile_size=args.tile_size, overlap=args.overlap)
+
+    rows, cols = result['grid']
+    print(f"{args.image_path}: {rows}x{cols} tiles of {result['tile_size']} px, "
+          f"{result['leaf_tiles']} leaf, {result['background_tiles']} background")
+    for class_name, count in result['counts'].items():
+        print(f"  {class_name}: {count}")
+    print(f"Diseased tiles: {result['diseased_fraction']:.0%}")
+    if args.overlay:
+        draw_overlay(args.image_path, result, args.overlay)
+        print(f"Overlay written to {args.overlay}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Upload Store for Plant Disease Detection System
+Keeps uploaded images in sharded subdirectories (uploads/ab/cd/<id>.jpg) with a
+thumbnail generated at ingest and any rendered result image, and evicts the oldest
+uploads (with their derived files) by age and total size.
+
+Settings are read from the environment:
+    UPLOAD_DIR              root directory (default 'uploads')
+    UPLOAD_MAX_BYTES        total size kept on disk before the oldest uploads are evicted (default 1 GB)
+    UPLOAD_MAX_AGE_HOURS    uploads older than this are evicted (default 168, one week)
+    UPLOAD_SWEEP_INTERVAL   seconds between background eviction sweeps (default 300)
+    UPLOAD_THUMB_SIZE       longest thumbnail side in pixels (default 256)
+
+Files written directly into the root (for example by the Node server) are served but
+only evicted with --include-legacy.
+
+Usage:
+    python upload_store.py stats
+    python upload_store.py sweep [--include-legacy]
+"""
+
+import os
+import re
+import time
+import uuid
+import argparse
+import threading
+from PIL import Image
+import metrics
+
+THUMB_SUFFIX = '_thumb'
+RESULT_SUFFIX = '_result'
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'webp')
+# Upload ids are UUIDs; anything else is rejected before touching the filesystem
+FILENAME_PATTERN = re.compile(r'^([0-9a-f][0-9a-f-]{3,63})(' + THUMB_SUFFIX + '|' + RESULT_SUFFIX + r')?\.(' + '|'.join(IMAGE_EXTENSIONS) + r')$')
+
+
+class UploadStore:
+    """Sharded on-disk store for uploaded images with thumbnails and eviction"""
+
+    def __init__(self, root=None, max_bytes=None, max_age=None, sweep_interval=None, thumb_size=None):
+        self.root = root or os.getenv('UPLOAD_DIR', 'uploads')
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('UPLOAD_MAX_BYTES', str(1024 ** 3)))
+        self.max_age = max_age if max_age is not None else float(os.getenv('UPLOAD_MAX_AGE_HOURS', '168')) * 3600
+        self.sweep_interval = sweep_interval if sweep_interval is not None else float(os.getenv('UPLOAD_SWEEP_INTERVAL', '300'))
+        self.thumb_size = thumb_size or int(os.getenv('UPLOAD_THUMB_SIZE', '256'))
+
+        # Running size estimate so saves can trigger a sweep without walking the tree
+        self._bytes = None
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        self._sweeping = threading.Lock()
+
+    def shard_dir(self, upload_id):
+        """Two levels of two hex characters keep each directory small"""
+        compact_id = upload_id.replace('-', '')
+        return os.path.join(self.root, compact_id[:2], compact_id[2:4])
+
+    def save(self, file_storage, extension):
+        """
+        Save an uploaded werkzeug FileStorage and its thumbnail
+        Returns (upload_id, image_path)
+        """
+        extension = extension.lower()
+        upload_id = str(uuid.uuid4())
+        directory = self.shard_dir(upload_id)
+        os.makedirs(directory, exist_ok=True)
+        image_path = os.path.join(directory, f"{upload_id}.{extension}")
+        file_storage.save(image_path)
+
+        thumb_path = self.thumbnail_path(upload_id)
+        with metrics.STAGE_SECONDS.time(stage='thumbnail'):
+            try:
+                self.make_thumbnail(image_path, thumb_path)
+            except Exception as e:
+                metrics.FAILURES.inc(stage='thumbnail')
+                print(f"Warning: Could not create thumbnail for {upload_id}: {e}")
+
+        added = os.path.getsize(image_path)
+        if os.path.exists(thumb_path):
+            added += os.path.getsize(thumb_path)
+        self._record_save(added)
+        return upload_id, image_path
+
+    def thumbnail_path(self, upload_id):
+        return os.path.join(self.shard_dir(upload_id), f"{upload_id}{THUMB_SUFFIX}.jpg")
+
+    def result_path(self, upload_id):
+        return os.path.join(self.shard_dir(upload_id), f"{upload_id}{RESULT_SUFFIX}.png")
+
+    def save_result(self, upload_id, png_bytes):
+        """Store a rendered result image next to its upload, so it is evicted with it; returns its path"""
+        path = self.result_path(upload_id)
+        with open(path, 'wb') as f:
+            f.write(png_bytes)
+        self._record_save(len(png_bytes))
+        return path
+
+    def make_thumbnail(self, image_path, thumb_path):
+        """Write a small JPEG preview, decoding JPEGs at reduced scale"""
+        with Image.open(image_path) as img:
+            # draft() lets the JPEG decoder skip DCT detail the thumbnail cannot show
+            img.draft('RGB', (self.thumb_size, self.thumb_size))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel('A'))
+                img = background
+            img.thumbnail((self.thumb_size, self.thumb_size))
+            img.save(thumb_path, 'JPEG', quality=80, optimize=True)
+
+    def path_for(self, filename):
+        """
+        Resolve a served filename (<id>.<ext>, <id>_thumb.jpg or <id>_result.png) to a path on disk
+        Returns None for invalid names or missing files
+        """
+        match = FILENAME_PATTERN.match(filename)
+        if not match:
+            return None
+        for candidate in (os.path.join(self.shard_dir(match.group(1)), filename),
+                          os.path.join(self.root, filename)):
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def _record_save(self, added):
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += added
+            due = (self._bytes is None or self._bytes > self.max_bytes
+                   or time.monotonic() - self._last_sweep >= self.sweep_interval)
+        metrics.UPLOAD_STORE_BYTES.set(self._bytes or 0)
+        if due:
+            threading.Thread(target=self.sweep, daemon=True).start()
+
+    def _entries(self, include_legacy=False):
+        """Group files by upload id: {id: [(path, size, mtime), ...]}"""
+        entries = {}
+        if not os.path.isdir(self.root):
+            return entries
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and not include_legacy:
+                continue
+            for name in filenames:
+                match = FILENAME_PATTERN.match(name)
+                if not match:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.setdefault(match.group(1), []).append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def sweep(self, include_legacy=False):
+        """
+        Evict uploads older than max_age, then the oldest until the store fits in
+        90% of max_bytes. Returns (files_removed, bytes_removed)
+        """
+        if not self._sweeping.acquire(blocking=False):
+            return 0, 0  # Another sweep is already running
+        try:
+            with metrics.STAGE_SECONDS.time(stage='upload_sweep'):
+                entries = self._entries(include_legacy)
+                now = time.time()
+                # Oldest first; an upload and its thumbnail are evicted together
+                uploads = sorted(
+                    (max(mtime for _, _, mtime in files), sum(size for _, size, _ in files), files)
+                    for files in entries.values()
+                )
+                total = sum(size for _, size, _ in uploads)
+                target = self.max_bytes * 0.9
+                removed_files = removed_bytes = 0
+                for mtime, size, files in uploads:
+                    if now - mtime <= self.max_age and total <= target:
+                        break
+                    for path, _, _ in files:
+                        try:
+                            os.remove(path)
+                            removed_files += 1
+                        except FileNotFoundError:
+                            pass
+                    total -= size
+                    removed_bytes += size
+                    self._remove_empty_dirs(os.path.dirname(files[0][0]))
+
+            with self._lock:
+                self._bytes = total
+                self._last_sweep = time.monotonic()
+            metrics.UPLOAD_STORE_BYTES.set(total)
+            metrics.UPLOADS_EVICTED.inc(removed_files)
+            if removed_files:
+                print(f"Upload store: evicted {removed_files} files ({removed_bytes / 1e6:.1f} MB)")
+            return removed_files, removed_bytes
+        finally:
+            self._sweeping.release()
+
+    def _remove_empty_dirs(self, directory):
+        root = os.path.abspath(self.root)
+        while os.path.abspath(directory) != root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def stats(self, include_legacy=True):
+        entries = self._entries(include_legacy)
+        return {
+            'uploads': len(entries),
+            'files': sum(len(files) for files in entries.values()),
+            'bytes': sum(size for files in entries.values() for _, size, _ in files),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the upload store')
+    parser.add_argument('command', choices=['stats', 'sweep'])
+    parser.add_argument('--include-legacy', action='store_true', help='Also evict files directly in the upload root')
+    args = parser.parse_args()
+
+    store = UploadStore()
+    if args.command == 'stats':
+        stats = store.stats()
+        print(f"{store.root}: {stats['uploads']} uploads, {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB")
+    else:
+        removed_files, removed_bytes = store.sweep(include_legacy=args.include_legacy)
+        print(f"Removed {removed_files} files ({removed_bytes / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
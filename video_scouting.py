@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Video Scouting Mode for Plant Disease Detection System
+Diagnoses leaves continuously from a video file, camera or network stream while
+walking crop rows. Only informative frames are classified: a reader thread samples
+frames, waits for the scene to change, and keeps the sharpest leaf-filled frame of
+each new view. Selected frames go through a bounded queue to batched inference, and
+results are emitted as a timestamped stream (one JSON object per line from the CLI).
+
+When inference falls behind, the queue applies back-pressure: files are read more
+slowly, while live sources drop the oldest queued frame so results stay current.
+
+Settings are read from the environment:
+    SCOUT_SAMPLE_EVERY    examine every Nth frame (default 3, i.e. 10 of 30 fps)
+    SCOUT_MIN_CHANGE      mean grey-level difference from the last selected frame that counts
+                          as a new view, 0-255 (default 12)
+    SCOUT_SETTLE          seconds to look for a sharper frame after a change (default 0.3)
+    SCOUT_MAX_INTERVAL    select a frame at least this often on a steady view, 0 disables (default 5)
+    SCOUT_QUEUE_SIZE      selected frames waiting for inference (default 16)
+    SCOUT_BATCH_SIZE      largest inference batch (default 8)
+
+Usage:
+    python video_scouting.py row_walk.mp4
+    python video_scouting.py 0                          # first camera
+    python video_scouting.py rtsp://camera/stream --save-frames scouting_frames/
+"""
+
+import os
+import sys
+import json
+import contextlib
+import time
+import queue
+import argparse
+import threading
+import cv2
+import numpy as np
+import preprocessing
+import image_gate
+import metrics
+
+SAMPLE_EVERY = int(os.getenv('SCOUT_SAMPLE_EVERY', '3'))
+MIN_CHANGE = float(os.getenv('SCOUT_MIN_CHANGE', '12'))
+SETTLE_SECONDS = float(os.getenv('SCOUT_SETTLE', '0.3'))
+MAX_INTERVAL = float(os.getenv('SCOUT_MAX_INTERVAL', '5'))
+QUEUE_SIZE = int(os.getenv('SCOUT_QUEUE_SIZE', '16'))
+BATCH_SIZE = int(os.getenv('SCOUT_BATCH_SIZE', '8'))
+# Frame selection runs on a copy as wide as the admission gate's, so its thresholds apply
+ANALYSIS_WIDTH = image_gate.GATE_SIZE
+# Motion blur is judged against the recent sharpness peak, which decays by this factor per sampled frame
+PEAK_DECAY = 0.98
+MIN_RELATIVE_SHARPNESS = 0.35
+
+
+def open_capture(source):
+    """Open a video file, stream URL or camera index ('0', '1', ...)"""
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source '{source}'")
+    return capture
+
+
+class FrameSelector:
+    """
+    Picks informative frames: after the view changes, the sharpest frame within the
+    settle window is selected, provided it shows vegetation and is sharp both in
+    absolute terms and compared with recent frames (which catches motion blur)
+    """
+
+    def __init__(self, min_change=MIN_CHANGE, settle=SETTLE_SECONDS, max_interval=MAX_INTERVAL):
+        self.min_change = min_change
+        self.settle = settle
+        self.max_interval = max_interval
+        self._reference = None
+        self._reference_time = None
+        self._best = None
+        self._deadline = None
+        self._peak_sharpness = 0.0
+
+    def offer(self, frame, timestamp):
+        """
+        Consider a BGR frame; returns (frame, timestamp, scores) when a selection
+        is made, otherwise None
+        """
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (ANALYSIS_WIDTH, max(1, round(height * ANALYSIS_WIDTH / width))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        self._peak_sharpness = max(sharpness, self._peak_sharpness * PEAK_DECAY)
+
+        if self._best is None:
+            if self._reference is not None:
+                change = float(cv2.absdiff(gray, self._reference).mean())
+                steady_too_long = self.max_interval > 0 and timestamp - self._reference_time >= self.max_interval
+                if change < self.min_change and not steady_too_long:
+                    return None
+            else:
+                change = None
+            self._best = (sharpness, frame, timestamp, gray, small, change)
+            self._deadline = timestamp + self.settle
+        elif sharpness > self._best[0]:
+            self._best = (sharpness, frame, timestamp, gray, small, self._best[5])
+
+        if timestamp < self._deadline:
+            return None
+        return self._select()
+
+    def flush(self):
+        """Decide on the frame still being held at the end of the stream"""
+        return self._select() if self._best is not None else None
+
+    def _select(self):
+        sharpness, frame, timestamp, gray, small, change = self._best
+        self._best = None
+        # The view has been looked at either way, so later frames are compared with it
+        self._reference, self._reference_time = gray, timestamp
+        vegetation = image_gate.vegetation_fraction(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if (sharpness < max(image_gate.MIN_SHARPNESS, MIN_RELATIVE_SHARPNESS * self._peak_sharpness)
+                or vegetation < image_gate.MIN_VEGETATION):
+            metrics.SCOUT_FRAMES.inc(result='rejected')
+            return None
+        scores = {
+            'sharpness': round(sharpness, 1),
+            'vegetation': round(vegetation, 3),
+            'change': round(change, 1) if change is not None else None,
+        }
+        return frame, timestamp, scores
+
+
+class ScoutingSession:
+    """Reads a video source on a background thread and yields diagnoses for selected frames"""
+
+    def __init__(self, detector, source, sample_every=SAMPLE_EVERY, queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE, live=None, realtime=False, save_dir=None):
+        self.detector = detector
+        self.source = source
+        self.save_dir = save_dir
+        self.sample_every = max(1, sample_every)
+        self.batch_size = batch_size
+        # Files can wait for inference; cameras and streams cannot
+        self.live = live if live is not None else (realtime or str(source).isdigit() or '://' in str(source))
+        self.realtime = realtime
+        self.selector = FrameSelector()
+        self.preprocessor = preprocessing.BatchPreprocessor(detector.img_size, batch_size=batch_size, crop=detector.leaf_crop)
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error = None
+
+    def _enqueue(self, item):
+        if not self.live:
+            # Back-pressure: block the reader until inference catches up
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+            return
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                # Live source: drop the oldest selected frame rather than fall behind
+                try:
+                    self._queue.get_nowait()
+                    self.frames_dropped += 1
+                    metrics.SCOUT_FRAMES.inc(result='dropped')
+                except queue.Empty:
+                    pass
+
+    def _read(self):
+        try:
+            capture = open_capture(self.source)
+            fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            started = time.monotonic()
+            index = 0
+            while not self._stop.is_set():
+                # grab() advances without the colour conversion of frames we do not examine
+                if not capture.grab():
+                    break
+                index += 1
+                self.frames_read = index
+                if self.realtime:
+                    # Replay a file at its recorded frame rate, as a camera would deliver it
+                    delay = started + index / fps - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if index % self.sample_every:
+                    continue
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                timestamp = time.monotonic() - started if self.live else index / fps
+                selected = self.selector.offer(frame, timestamp)
+                if selected is not None:
+                    self._enqueue((index, *selected))
+            selected = self.selector.flush()
+            if selected is not None:
+                self._enqueue((index, *selected))
+            capture.release()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._enqueue(None)
+
+    def results(self):
+        """
+        Yield one result per selected frame, in order:
+        {'time', 'frame', 'predicted_class', 'confidence', 'top', 'scores', 'latency_ms'},
+        plus 'image' (the saved frame's path) when save_dir is set
+        """
+        if self.save_dir:
+            os.makedirs(self.save_dir, exist_ok=True)
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+        try:
+            finished = False
+            while not finished:
+                # Block for one frame, then take whatever else is already waiting
+                items = [self._queue.get()]
+                while len(items) < self.batch_size:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in items:
+                    finished = True
+                    items = [item for item in items if item is not None]
+                if not items:
+                    continue
+
+                started = time.perf_counter()
+                with metrics.STAGE_SECONDS.time(stage='scouting'):
+                    images = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for _, frame, _, _ in items]
+                    probabilities = self.detector.classify_batch(self.preprocessor(images))
+                latency_ms = (time.perf_counter() - started) * 1000
+                metrics.SCOUT_FRAMES.inc(len(items), result='selected')
+                for (index, frame, timestamp, scores), frame_probabilities in zip(items, probabilities):
+                    predicted = int(np.argmax(frame_probabilities))
+                    result = {
+                        'time': round(timestamp, 3),
+                        'frame': index,
+                        'predicted_class': self.detector.class_names[predicted],
+                        'confidence': float(frame_probabilities[predicted]),
+                        'top': [[name, round(p, 4)] for name, p in self.detector.top_predictions(frame_probabilities)],
+                        'scores': scores,
+                        'latency_ms': round(latency_ms, 1),
+                    }
+                    if self.save_dir:
+                        result['image'] = os.path.join(self.save_dir, f"frame_{index:06d}.jpg")
+                        cv2.imwrite(result['image'], frame)
+                    yield result
+        finally:
+            self._stop.set()
+            reader.join(timeout=5)
+        if self._error is not None:
+            raise self._error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diagnose leaves continuously from a video or camera stream')
+    parser.add_argument('source', help='Video file, stream URL or camera index')
+    parser.add_argument('--model', default='leafdoctor_model.h5')
+    parser.add_argument('--class-names', default='class_names.json')
+    parser.add_argument('--sample-every', type=int, default=SAMPLE_EVERY, help='Examine every Nth frame')
+    parser.add_argument('--realtime', action='store_true', help='Replay a file at its recorded frame rate')
+    parser.add_argument('--save-frames', default=None, help='Directory to save selected frames in')
+    args = parser.parse_args()
+
+    from plant_disease_detection import PlantDiseaseDetector
+
+    detector = PlantDiseaseDetector()
+    # stdout carries only the result stream
+    with contextlib.redirect_stdout(sys.stderr):
+        loaded = detector.load_model(args.model, args.class_names)
+    if not loaded:
+        print("Error: model or class names not found.", file=sys.stderr)
+        return
+    # Batches vary in size with the selection rate, so trace every size up front
+    detector.warm_up(batch_sizes=range(1, BATCH_SIZE + 1))
+
+    session = ScoutingSession(detector, args.source, sample_every=args.sample_every,
+                              realtime=args.realtime, save_dir=args.save_frames)
+    started = time.perf_counter()
+    count = 0
+    for result in session.results():
+        print(json.dumps(result), flush=True)
+        count += 1
+    elapsed = time.perf_counter() - started
+    print(f"{session.frames_read} frames in {elapsed:.1f} s ({session.frames_read / max(elapsed, 1e-9):.1f} fps), "
+          f"{count} diagnosed, {session.frames_dropped} dropped", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,43 +3,165 @@
 Flask Web Interface for Plant Disease Detection System
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, url_for, g, abort
 import os
+import time
 import base64
 from io import BytesIO
 from PIL import Image
 import numpy as np
+import metrics
+import profiling
+from upload_store import UploadStore
+from prediction_history import get_prediction_history
+import similarity_index
+import admission
+import tiled_analysis
+from model_registry import ModelRegistry, ModelManager
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 try:
     from plant_disease_detection import PlantDiseaseDetector
     KAGGLE_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Could not import PlantDiseaseDetector: {e}")
     KAGGLE_AVAILABLE = False
+from flask.json.provider import DefaultJSONProvider
 import matplotlib
 matplotlib.use('Agg')  # Use non-GUI backend
-import matplotlib.pyplot as plt
+import matplotlib.image as mpimg
+from matplotlib.figure import Figure
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes numpy scalars and arrays returned by the model"""
+    
+    def default(self, o):
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, np.generic):
+            return o.item()
+        return super().default(o)
 
 app = Flask(__name__)
+app.json = NumpyJSONProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Lean /upload encodings for low-bandwidth clients, in order of preference;
+# msgpack is offered only when the package is installed
+COMPACT_JSON = 'application/vnd.leafdoctor.compact+json'
+COMPACT_MIMETYPES = [COMPACT_JSON, 'text/plain'] + (['application/msgpack'] if msgpack else [])
+DEFAULT_TOP_K = 3
+
+# Uploads are immutable (each gets a fresh id), so browsers and proxies may cache them
+upload_store = UploadStore()
+UPLOAD_CACHE_SECONDS = 7 * 24 * 3600
+
+# Token for POST /admin/reload; the endpoint is disabled when unset
+ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN')
+
+def load_detector(version, model_path, class_names_path):
+    """Load and warm up a detector for one model version, off the request path"""
+    candidate = PlantDiseaseDetector()
+    if not candidate.load_model(model_path, class_names_path, model_version=version):
+        return None
+    # Warm up so the first request does not pay for graph tracing
+    candidate.warm_up()
+    return candidate
+
+def install_detector(new_detector):
+    """Swap in a warmed detector; requests already running keep the one they started with"""
+    global detector, model_warmed
+    detector = new_detector
+    model_warmed = True
+
 # Initialize detector
 detector = None
+model_warmed = False
+model_manager = None
 if KAGGLE_AVAILABLE:
     try:
-        detector = PlantDiseaseDetector()
-        # Try to load model if available
-        if not detector.load_model():
+        model_manager = ModelManager(ModelRegistry(), load_detector, on_swap=install_detector)
+        # Try to load model if available; later versions are picked up by the watcher
+        if not model_manager.load_initial():
+            detector = PlantDiseaseDetector()
             print("Warning: No pre-trained model found. Model-based predictions will not be available.")
+        model_manager.start_watching()
     except Exception as e:
         print(f"Warning: Failed to initialize PlantDiseaseDetector: {e}")
         detector = None
 else:
     print("Warning: Kaggle is not available. Model-based predictions will not be available.")
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count every request and record its latency by endpoint"""
+    endpoint = request.endpoint or 'unknown'
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if 'request_start' in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready')
+def ready():
+    """Readiness: 200 once the model is loaded and warmed up, 503 before that"""
+    active_detector = detector
+    model_loaded = active_detector is not None and active_detector.model is not None
+    status = {
+        'ready': model_loaded and model_warmed,
+        'model_loaded': model_loaded,
+        'model_warmed': model_warmed,
+        'model_version': active_detector.model_version if model_loaded else None,
+        'classes': len(active_detector.class_names) if model_loaded else 0,
+        'pid': os.getpid(),
+    }
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    Activate a model version (or re-read the active one) and load it in the background
+    Other workers pick up the new active version through their registry watcher
+    """
+    if not ADMIN_TOKEN or model_manager is None:
+        abort(404)
+    if request.headers.get('Authorization') != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    version = request.args.get('version')
+    if version:
+        try:
+            model_manager.registry.activate(version)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+    started = model_manager.reload(version)
+    return jsonify({'reloading': started, 'serving_version': model_manager.version}), 202 if started else 409
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose pipeline metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory('uploads', filename)
+    """Serve uploaded files, thumbnails and result images with ETags so repeat fetches are 304s"""
+    path = upload_store.path_for(filename)
+    if path is None:
+        abort(404)
+    response = send_file(os.path.abspath(path), conditional=True, etag=True, max_age=UPLOAD_CACHE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/')
 def index():
@@ -47,8 +169,11 @@ def index():
     return render_template('index.html')
 
 @app.route('/upload', methods=['POST'])
+@profiling.profiled('upload')
 def upload_file():
     """Handle file upload and disease prediction"""
+    # One detector for the whole request, even if a new model is swapped in meanwhile
+    active_detector = detector
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -58,29 +183,79 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
         
         if file and allowed_file(file.filename):
-            # Save uploaded file
-            filename = 'uploaded_image.jpg'
-            filepath = os.path.join('uploads', filename)
-            os.makedirs('uploads', exist_ok=True)
-            file.save(filepath)
+            # Shed before saving anything when the inference queue is already full
+            if active_detector is not None and not admission.INFERENCE.has_capacity():
+                metrics.SHED.inc(stage='inference', action='rejected')
+                return overloaded(admission.INFERENCE)
+            
+            # Save uploaded file under its own id, with a thumbnail
+            with metrics.STAGE_SECONDS.time(stage='save'):
+                upload_id, filepath = upload_store.save(file, file.filename.rsplit('.', 1)[1])
             
-            response = {}
+            response = {
+                'upload_url': url_for('uploaded_file', filename=os.path.basename(filepath)),
+                'thumbnail_url': url_for('uploaded_file', filename=os.path.basename(upload_store.thumbnail_path(upload_id))),
+            }
             
-            if detector is not None:
+            if active_detector is not None:
                 try:
                     # Make prediction
-                    prediction_result = detector.predict_leaf_disease(filepath)
+                    # ?tta=N classifies N augmented views in one batch; ?similar=0 skips similar cases
+                    want_similar = similarity_index.ENABLED and request.args.get('similar') != '0'
+                    with admission.INFERENCE.admit() as admitted:
+                        if not admitted:
+                            return overloaded(admission.INFERENCE)
+                        prediction_result = active_detector.predict_leaf_disease(
+                            filepath, tta_views=request.args.get('tta', type=int), with_embedding=want_similar
+                        )
+                    
+                    # Unusable photos get actionable advice instead of a guess
+                    if prediction_result and prediction_result.get('rejected'):
+                        response.update({
+                            'success': False,
+                            'error': ' '.join(prediction_result['advice']),
+                            'reasons': prediction_result['reasons'],
+                            'quality': prediction_result['scores'],
+                        })
+                        return jsonify(response), 422
                     
-                    # Get GPT explanation
+                    similar_cases = None
+                    if prediction_result:
+                        embedding = prediction_result.pop('embedding', None)
+                        record_prediction(active_detector, prediction_result)
+                        if embedding is not None:
+                            similar_cases = find_similar_cases(active_detector, prediction_result, embedding, filepath)
+                    
+                    compact_type = negotiate_compact()
+                    if compact_type:
+                        return compact_upload_response(active_detector, filepath, prediction_result, compact_type)
+                    
+                    # Get GPT explanation, or hand the client a stream URL so advice
+                    # can render token by token instead of blocking this response
                     gpt_explanation = ""
-                    if prediction_result and 'predicted_class' in prediction_result:
-                        try:
-                            gpt_explanation = detector.get_gpt_explanation(
-                                prediction_result['predicted_class']
-                            )
-                        except Exception as e:
-                            print(f"Warning: Could not get GPT explanation: {e}")
-                            gpt_explanation = "Explanation not available."
+                    degraded = []
+                    defer_explanation = request.args.get('stream') == '1'
+                    if defer_explanation and prediction_result and 'predicted_class' in prediction_result:
+                        response['explanation_stream'] = url_for(
+                            'stream_explanation', **{'class': prediction_result['predicted_class']}
+                        )
+                    elif prediction_result and 'predicted_class' in prediction_result:
+                        # Under load the explanation is left out rather than waited for;
+                        # the client can fetch it later from explanation_url
+                        with admission.LLM.admit() as admitted:
+                            if admitted:
+                                try:
+                                    gpt_explanation = active_detector.get_gpt_explanation(
+                                        prediction_result['predicted_class']
+                                    )
+                                except Exception as e:
+                                    print(f"Warning: Could not get GPT explanation: {e}")
+                                    gpt_explanation = "Explanation not available."
+                            else:
+                                degraded.append('explanation')
+                                response['explanation_url'] = url_for(
+                                    'explanation', **{'class': prediction_result['predicted_class']}
+                                )
                     
                     # Add prediction to response
                     response.update({
@@ -88,18 +263,30 @@ def upload_file():
                         'explanation': gpt_explanation,
                         'has_model': True
                     })
+                    if similar_cases is not None:
+                        response['similar_cases'] = similar_cases
                     
-                    # Generate result image
-                    try:
-                        result_image_path = generate_result_image(filepath, prediction_result, gpt_explanation)
-                        with open(result_image_path, 'rb') as img_file:
-                            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                        response['result_image'] = img_base64
-                    except Exception as e:
-                        print(f"Warning: Could not generate result image: {e}")
-                        response['result_image'] = None
+                    # Generate result image, unless rendering is saturated
+                    with admission.RENDER.admit() as admitted:
+                        if not admitted:
+                            degraded.append('result_image')
+                            response['result_image'] = None
+                        else:
+                            try:
+                                with metrics.STAGE_SECONDS.time(stage='render'):
+                                    result_png = generate_result_image(filepath, prediction_result, gpt_explanation,
+                                                                       class_names=active_detector.class_names)
+                                with metrics.STAGE_SECONDS.time(stage='encode'):
+                                    response['result_image'] = base64.b64encode(result_png).decode('utf-8')
+                            except Exception as e:
+                                metrics.FAILURES.inc(stage='render')
+                                print(f"Warning: Could not generate result image: {e}")
+                                response['result_image'] = None
+                    if degraded:
+                        response['degraded'] = degraded
                         
                 except Exception as e:
+                    metrics.FAILURES.inc(stage='prediction')
                     print(f"Error during prediction: {e}")
                     response.update({
                         'error': 'Prediction failed',
@@ -121,17 +308,239 @@ def upload_file():
         print(f"Error processing upload: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/analyze_field', methods=['POST'])
+def analyze_field():
+    """
+    Tiled analysis of a high-resolution multi-leaf image: per-tile disease map and counts
+    ?tile_size=N overrides the tile side in pixels; ?tiles=0 omits the per-tile list
+    """
+    active_detector = detector
+    if active_detector is None or active_detector.model is None:
+        return jsonify({'error': 'Model not available'}), 503
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file uploaded'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload JPG, JPEG, or PNG files.'}), 400
+    tile_size = None
+    if 'tile_size' in request.args:
+        tile_size = request.args.get('tile_size', type=int)
+        min_tile, max_tile = tiled_analysis.tile_size_range(active_detector)
+        if tile_size is None or not min_tile <= tile_size <= max_tile:
+            return jsonify({'error': f'tile_size must be an integer from {min_tile} to {max_tile}'}), 400
+    if not admission.INFERENCE.has_capacity():
+        metrics.SHED.inc(stage='inference', action='rejected')
+        return overloaded(admission.INFERENCE)
+    
+    try:
+        with metrics.STAGE_SECONDS.time(stage='save'):
+            upload_id, filepath = upload_store.save(file, file.filename.rsplit('.', 1)[1])
+        with admission.INFERENCE.admit() as admitted:
+            if not admitted:
+                return overloaded(admission.INFERENCE)
+            result = tiled_analysis.analyze_image(active_detector, filepath, tile_size=tile_size)
+    except tiled_analysis.ImageTooLargeError as e:
+        metrics.FAILURES.inc(stage='tiled_analysis')
+        print(f"Rejected tiled analysis: {e}")
+        return jsonify({'error': f'Image too large for tiled analysis: {e}'}), 413
+    except Exception as e:
+        metrics.FAILURES.inc(stage='tiled_analysis')
+        print(f"Error during tiled analysis: {e}")
+        return jsonify({'error': 'Tiled analysis failed'}), 500
+    
+    if request.args.get('tiles') == '0':
+        del result['tiles']
+    result.update({
+        'success': True,
+        'upload_url': url_for('uploaded_file', filename=os.path.basename(filepath)),
+        'class_names': active_detector.class_names,
+    })
+    return jsonify(result)
+
+def record_prediction(active_detector, prediction_result):
+    """Queue a diagnosis for the prediction history; the write happens off the request path"""
+    history = get_prediction_history()
+    if history is None:
+        return
+    history.record(
+        'web', prediction_result['predicted_class'], prediction_result['confidence'],
+        image_sha256=prediction_result.get('image_sha256'),
+        model_version=active_detector.model_version,
+        inference_exit=prediction_result.get('exit'),
+        latency_ms=(time.perf_counter() - g.request_start) * 1000,
+        details={'top': active_detector.top_predictions(prediction_result['all_predictions'], DEFAULT_TOP_K),
+                 'tta_views': prediction_result.get('tta_views')},
+    )
+
+def find_similar_cases(active_detector, prediction_result, embedding, filepath):
+    """
+    Earlier uploads that look most like this one, from the serving model's embedding index;
+    the upload is then added to the index for later requests
+    """
+    index = similarity_index.get_similarity_index(active_detector.model_version, len(embedding))
+    if index is None:
+        return None
+    image_sha256 = prediction_result.get('image_sha256')
+    k = request.args.get('similar_k', similarity_index.SIMILAR_K, type=int)
+    try:
+        # Ask for extra candidates, since uploads the store has evicted are dropped below
+        cases = index.search(embedding, 2 * k, exclude_sha256=image_sha256)
+        index.add(embedding, image_sha256, os.path.basename(filepath),
+                  prediction_result['predicted_class'], prediction_result['confidence'])
+    except Exception as e:
+        metrics.FAILURES.inc(stage='similar_cases')
+        print(f"Warning: Could not search similar cases: {e}")
+        return None
+    similar = []
+    for case in cases:
+        if len(similar) == k:
+            break
+        if upload_store.path_for(case['upload']) is None:
+            continue
+        upload_id = case['upload'].rsplit('.', 1)[0]
+        similar.append({
+            'upload_url': url_for('uploaded_file', filename=case['upload']),
+            'thumbnail_url': url_for('uploaded_file', filename=os.path.basename(upload_store.thumbnail_path(upload_id))),
+            'predicted_class': case['predicted_class'],
+            'confidence': case['confidence'],
+            'similarity': case['similarity'],
+            'created_at': case['created_at'],
+        })
+    return similar
+
+def negotiate_compact():
+    """
+    Return the compact mimetype to answer /upload with, or None for the full response
+    ?compact=1 forces compact JSON unless the Accept header names another compact type
+    """
+    best = request.accept_mimetypes.best_match(['application/json'] + COMPACT_MIMETYPES)
+    if best in COMPACT_MIMETYPES:
+        return best
+    if request.args.get('compact') == '1':
+        return COMPACT_JSON
+    return None
+
+def compact_upload_response(active_detector, filepath, prediction_result, mimetype):
+    """
+    Lean /upload response: top-k classes, an explanation URL and, with ?image=1, a result
+    image URL instead of the full probability vector and an inline base64 PNG
+    """
+    if not prediction_result:
+        return jsonify({'error': 'Could not read image'}), 400
+    
+    top_k = request.args.get('top_k', DEFAULT_TOP_K, type=int)
+    predicted_class = prediction_result['predicted_class']
+    payload = {
+        'top': [[name, round(p, 4)] for name, p in active_detector.top_predictions(prediction_result['all_predictions'], top_k)],
+        'explanation': url_for('explanation', **{'class': predicted_class}),
+    }
+    if request.args.get('image') == '1':
+        with admission.RENDER.admit() as admitted:
+            if not admitted:
+                payload['degraded'] = ['image']
+            else:
+                try:
+                    with metrics.STAGE_SECONDS.time(stage='render'):
+                        result_png = generate_result_image(filepath, prediction_result, "",
+                                                           class_names=active_detector.class_names)
+                    # Stored with the upload, so the store's eviction bounds result images too
+                    upload_id = os.path.basename(filepath).rsplit('.', 1)[0]
+                    result_path = upload_store.save_result(upload_id, result_png)
+                    payload['image'] = url_for('uploaded_file', filename=os.path.basename(result_path))
+                except Exception as e:
+                    metrics.FAILURES.inc(stage='render')
+                    print(f"Warning: Could not generate result image: {e}")
+    
+    with metrics.STAGE_SECONDS.time(stage='encode'):
+        if mimetype == 'application/msgpack':
+            body = msgpack.packb(payload)
+        elif mimetype == 'text/plain':
+            # One tab-separated "field value..." record per line
+            lines = [f"top\t{name}\t{p}" for name, p in payload['top']]
+            lines += [f"{field}\t{payload[field]}" for field in ('explanation', 'image') if field in payload]
+            body = '\n'.join(lines) + '\n'
+        else:
+            body = app.json.dumps(payload, separators=(',', ':'))
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+@app.route('/explain')
+def explanation():
+    """Return the expert explanation for a predicted class in one response"""
+    predicted_class = request.args.get('class', '')
+    active_detector = detector
+    if active_detector is None:
+        return jsonify({'error': 'Model not available'}), 503
+    if predicted_class not in active_detector.class_names:
+        return jsonify({'error': 'Unknown class'}), 400
+    
+    with admission.LLM.admit(action='rejected') as admitted:
+        if not admitted:
+            return overloaded(admission.LLM)
+        text = active_detector.get_gpt_explanation(predicted_class)
+    if request.accept_mimetypes.best_match(['application/json', 'text/plain']) == 'text/plain':
+        return Response(text, mimetype='text/plain')
+    return jsonify({'class': predicted_class, 'explanation': text})
+
+@app.route('/explain/stream')
+def stream_explanation():
+    """Stream the expert explanation for a predicted class as server-sent events"""
+    predicted_class = request.args.get('class', '')
+    active_detector = detector
+    if active_detector is None:
+        return jsonify({'error': 'Model not available'}), 503
+    if predicted_class not in active_detector.class_names:
+        return jsonify({'error': 'Unknown class'}), 400
+    
+    if not admission.LLM.acquire(action='rejected'):
+        return overloaded(admission.LLM)
+    started = time.perf_counter()
+    
+    def generate():
+        for fragment in active_detector.stream_gpt_explanation(predicted_class):
+            yield format_sse(fragment)
+        yield format_sse('', event='done')
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # The LLM slot is held until the stream ends, however the client leaves
+    response.call_on_close(lambda: admission.LLM.release(time.perf_counter() - started))
+    return response
+
+def overloaded(limiter):
+    """Fast 503 for a shed request, with a Retry-After estimate for the saturated stage"""
+    response = jsonify({
+        'success': False,
+        'error': 'The server is busy. Please try again shortly.',
+        'stage': limiter.stage,
+    })
+    response.headers['Retry-After'] = str(limiter.retry_after())
+    return response, 503
+
+def format_sse(data, event=None):
+    """Format a text fragment as a server-sent event, one data line per text line"""
+    message = f"event: {event}\n" if event else ""
+    message += "".join(f"data: {line}\n" for line in data.split('\n'))
+    return message + "\n"
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_result_image(image_path, prediction_result, gpt_explanation):
-    """Generate a result visualization image"""
+def generate_result_image(image_path, prediction_result, gpt_explanation, class_names=None):
+    """Render the result visualization and return it as PNG bytes"""
+    class_names = class_names if class_names is not None else detector.class_names
     # Load original image
-    original_img = plt.imread(image_path)
+    original_img = mpimg.imread(image_path)
     
-    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 12))
+    # A standalone Figure rather than pyplot, whose global state is not thread-safe
+    fig = Figure(figsize=(15, 12))
+    (ax1, ax2), (ax3, ax4) = fig.subplots(2, 2)
     
     # Original image
     ax1.imshow(original_img)
@@ -147,7 +556,7 @@ def generate_result_image(image_path, prediction_result, gpt_explanation):
     top_3_indices = np.argsort(prediction_result['all_predictions'])[-3:][::-1]
     ax2.text(0.1, 0.4, 'Top 3 Predictions:', fontsize=12, fontweight='bold', transform=ax2.transAxes)
     for i, idx in enumerate(top_3_indices):
-        class_name = detector.class_names[idx]
+        class_name = class_names[idx]
         confidence = prediction_result['all_predictions'][idx]
         ax2.text(0.1, 0.3-i*0.05, f"{i+1}. {class_name}: {confidence:.2%}", fontsize=10, transform=ax2.transAxes)
     
@@ -155,7 +564,7 @@ def generate_result_image(image_path, prediction_result, gpt_explanation):
     
     # Confidence bar chart
     top_5_indices = np.argsort(prediction_result['all_predictions'])[-5:][::-1]
-    top_5_classes = [detector.class_names[i][:20] + '...' if len(detector.class_names[i]) > 20 else detector.class_names[i] for i in top_5_indices]
+    top_5_classes = [class_names[i][:20] + '...' if len(class_names[i]) > 20 else class_names[i] for i in top_5_indices]
     top_5_confidences = [prediction_result['all_predictions'][i] for i in top_5_indices]
     
     ax3.barh(range(len(top_5_classes)), top_5_confidences)
@@ -176,15 +585,14 @@ def generate_result_image(image_path, prediction_result, gpt_explanation):
     
     ax4.axis('off')
     
-    plt.tight_layout()
-    result_path = 'static/result.png'
-    os.makedirs('static', exist_ok=True)
-    plt.savefig(result_path, dpi=150, bbox_inches='tight')
-    plt.close()
+    fig.tight_layout()
+    # Rendered in memory: concurrent requests must never share an output file
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
     
-    return result_path
+    return buffer.getvalue()
 
 if __name__ == '__main__':
     # Ensure upload directory exists
-    os.makedirs('uploads', exist_ok=True)
+    os.makedirs(upload_store.root, exist_ok=True)
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file